@@ -0,0 +1,206 @@
+"""Load test of the JSON endpoints under gunicorn, with a stubbed Sheets backend.
+
+    python -m benchmarks.loadtest [--duration 20] [--concurrency 16] [--workers 2] [--threads 16]
+                                  [--latency-ms 150] [--vehicle-rows 1000] [--compare results/loadtest-....json]
+
+Starts gunicorn on a local port with SHEET_SOURCE=local replaying a
+synthetic recording (so no request reaches Google), warms every worker
+up, then keeps ``--concurrency`` keep-alive clients hitting the endpoints
+round-robin for ``--duration`` seconds. Reports p50/p95/p99 latency and
+requests per second per endpoint and saves them as JSON. Use ``--url`` to
+drive an already running server instead of starting one.
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+from benchmarks import results as bench_results
+from benchmarks import synthetic
+from src.sources import save_recording
+
+ENDPOINTS = ['/api/vehicles', '/api/dashboard-data', '/get_point_fs_data']
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, directory, recording_path):
+    port = _free_port()
+    # Stores dans le répertoire temporaire : ne touche ni ne reprend ceux de data/
+    env = dict(
+        os.environ,
+        SHEET_SOURCE='local',
+        SHEET_SOURCE_PATH=recording_path,
+        SNAPSHOT_STORE=os.path.join(directory, 'snapshot.db'),
+        HISTORY_STORE=os.path.join(directory, 'history.db'),
+        METRICS_DIR=os.path.join(directory, 'metrics'),
+        SHEET_SOURCE_LATENCY_MS=str(args.latency_ms),
+        LOG_LEVEL='WARNING',
+        LOG_FILE=''
+    )
+    command = [
+        sys.executable, '-m', 'gunicorn', 'src.app:create_app()',
+        '--bind', f'127.0.0.1:{port}',
+        '--workers', str(args.workers),
+        '--worker-class', 'gthread',
+        '--threads', str(args.threads),
+        '--log-level', 'warning'
+    ]
+    process = subprocess.Popen(command, env=env)
+    return process, f'http://127.0.0.1:{port}'
+
+
+def _request(connection, path):
+    connection.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+    response = connection.getresponse()
+    response.read()
+    return response.status
+
+
+def wait_until_ready(base_url, workers, timeout=60):
+    """Wait for the server, then hit it until every worker has published a snapshot."""
+    parts = urlsplit(base_url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+            # New connections are spread over the workers; each starts its sync thread
+            for _ in range(workers * 4):
+                for path in ENDPOINTS:
+                    _request(connection, path)
+                connection.close()
+                connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+            connection.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Server at {base_url} did not come up within {timeout}s')
+
+
+def run_load(base_url, duration, concurrency):
+    parts = urlsplit(base_url)
+    latencies = {path: [] for path in ENDPOINTS}
+    errors = {path: 0 for path in ENDPOINTS}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def client(offset):
+        connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+        local = {path: [] for path in ENDPOINTS}
+        local_errors = {path: 0 for path in ENDPOINTS}
+        n = offset
+        while time.monotonic() < stop_at:
+            path = ENDPOINTS[n % len(ENDPOINTS)]
+            n += 1
+            started = time.perf_counter()
+            try:
+                status = _request(connection, path)
+            except (OSError, http.client.HTTPException):
+                local_errors[path] += 1
+                connection.close()
+                connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+                continue
+            elapsed = time.perf_counter() - started
+            if status not in (200, 304):
+                local_errors[path] += 1
+            local[path].append(elapsed)
+        connection.close()
+        with lock:
+            for path in ENDPOINTS:
+                latencies[path].extend(local[path])
+                errors[path] += local_errors[path]
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.monotonic() - started
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    results = {}
+    everything = []
+    for path, values in latencies.items():
+        values.sort()
+        everything.extend(values)
+        results[path] = _summary(values, errors[path], elapsed)
+    everything.sort()
+    results['total'] = _summary(everything, sum(errors.values()), elapsed)
+    return results
+
+
+def _summary(values, error_count, elapsed):
+    return {
+        'requests': len(values),
+        'errors': error_count,
+        'rps': round(len(values) / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='test this running server instead of starting gunicorn')
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--latency-ms', type=float, default=150, help='injected upstream latency')
+    parser.add_argument('--vehicle-rows', type=int, default=1000)
+    parser.add_argument('--output', help='where to write the JSON results')
+    parser.add_argument('--compare', help='baseline JSON results to compare against')
+    args = parser.parse_args()
+
+    process = None
+    with tempfile.TemporaryDirectory() as tmp:
+        base_url = args.url
+        if base_url is None:
+            recording_path = os.path.join(tmp, 'fleet.json')
+            save_recording(recording_path, synthetic.recording(args.vehicle_rows))
+            process, base_url = start_server(args, tmp, recording_path)
+        try:
+            wait_until_ready(base_url, args.workers)
+            print(f"Load testing {base_url} for {args.duration}s with {args.concurrency} clients")
+            latencies, errors, elapsed = run_load(base_url, args.duration, args.concurrency)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=30)
+
+    results = summarize(latencies, errors, elapsed)
+    for path, summary in results.items():
+        print(f"{path:25s} {summary['requests']:8d} req  {summary['rps']:9.1f} rps  "
+              f"p50 {summary['p50_ms']:8.2f}  p95 {summary['p95_ms']:8.2f}  p99 {summary['p99_ms']:8.2f} ms  "
+              f"errors {summary['errors']}")
+
+    output = bench_results.save('loadtest', results, args.output)
+    print(f"\nResults written to {output}")
+
+    if args.compare and bench_results.compare(args.compare, results, 'p95_ms'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
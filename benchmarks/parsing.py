@@ -0,0 +1,135 @@
+"""Micro-benchmarks for the sheet parsers on synthetic sheets.
+
+    python -m benchmarks.parsing [--sizes 1000 10000 100000] [--repeat 5] [--compare results/parsing-....json]
+    python -m benchmarks.parsing --check [--sizes 1000] [--rounds 200]
+
+Each case runs ``--repeat`` times; min and median wall time are reported
+together with the time per row. Results are saved as JSON under
+benchmarks/results/ for later comparison.  ``update_vehicle_inventory``
+applies a read differing from the previous one by ``--changed-rows`` rows,
+which is what a sync usually brings.
+
+``--check`` runs no benchmark: it applies ``--rounds`` successive random
+edits to each sheet with IncrementalInventory's check mode on, which compares
+every update to a full parse, and exits with an error on the first mismatch.
+"""
+import argparse
+import logging
+import statistics
+import sys
+import time
+
+from benchmarks import results as bench_results
+from benchmarks import synthetic
+from src.inventory import IncrementalInventory, InventoryMismatch
+from src.parsers import (
+    parse_point_fs_data,
+    parse_vehicle_data,
+    parse_vehicle_inventory,
+    parse_vehicle_with_immat
+)
+
+
+def _immat_cells(values):
+    return [row[13] for row in values[1:] if row[13]] or ['CHR (GG441SX)']
+
+
+def _parse_all_immat(cells):
+    for cell in cells:
+        parse_vehicle_with_immat(cell)
+
+
+def _alternate_updates(vehicles, changed_rows):
+    """A function updating an inventory with two reads that differ by ``changed_rows`` rows, in turn"""
+    edited = [list(row) for row in vehicles]
+    for number in range(1, len(edited), max(1, (len(edited) - 1) // changed_rows))[:changed_rows]:
+        edited[number][2] = 'ATELIER'
+    inventory = IncrementalInventory()
+    inventory.update(edited)
+    reads = [vehicles, edited]
+
+    def update_vehicle_inventory(_):
+        reads.reverse()
+        inventory.update(reads[0])
+
+    return update_vehicle_inventory
+
+
+def cases(size, changed_rows=10):
+    """(name, function, argument, rows) for one sheet size."""
+    vehicles = synthetic.vehicle_sheet(size)
+    return [
+        (f'parse_vehicle_inventory/{size}', parse_vehicle_inventory, vehicles, size),
+        (f'update_vehicle_inventory/{size}', _alternate_updates(vehicles, changed_rows), None, size),
+        (f'parse_vehicle_data/{size}', parse_vehicle_data, synthetic.legacy_vehicle_rows(size), size),
+        (f'parse_point_fs_data/{size}', parse_point_fs_data, synthetic.point_fs_summary(size), size),
+        (f'parse_vehicle_with_immat/{size}', _parse_all_immat, _immat_cells(vehicles), size)
+    ]
+
+
+def run_case(function, argument, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(argument)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def check_inventory(sizes, rounds):
+    """Apply ``rounds`` random edits to each sheet with the inventory's check mode on; 1 on a mismatch"""
+    for size in sizes:
+        values = synthetic.vehicle_sheet(size)
+        for agency in (None, 'paris'):
+            inventory = IncrementalInventory(agency=agency, check=True)
+            inventory.update(values)
+            for round_number, sheet in enumerate(synthetic.edited_sheets(values, rounds)):
+                try:
+                    inventory.update(sheet)
+                except InventoryMismatch as e:
+                    print(f"{size} rows, agency {agency}, round {round_number}: {e}")
+                    return 1
+            print(f"{size} rows, agency {agency}: {rounds} incremental updates match full parses")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='where to write the JSON results')
+    parser.add_argument('--compare', help='baseline JSON results to compare against')
+    parser.add_argument('--changed-rows', type=int, default=10, help='rows changed between two inventory updates')
+    parser.add_argument('--check', action='store_true', help='check incremental updates against full parses')
+    parser.add_argument('--rounds', type=int, default=200, help='successive random edits checked with --check')
+    args = parser.parse_args()
+
+    # Measure parsing only, not log formatting
+    logging.disable(logging.CRITICAL)
+
+    if args.check:
+        sys.exit(check_inventory(args.sizes, args.rounds))
+
+    results = {}
+    for size in args.sizes:
+        for name, function, argument, rows in cases(size, args.changed_rows):
+            timings = run_case(function, argument, args.repeat)
+            best = min(timings)
+            results[name] = {
+                'rows': rows,
+                'min_ms': round(best * 1000, 4),
+                'median_ms': round(statistics.median(timings) * 1000, 4),
+                'us_per_row': round(best * 1e6 / rows, 4)
+            }
+            print(f"{name:40s} min {results[name]['min_ms']:10.3f} ms   "
+                  f"median {results[name]['median_ms']:10.3f} ms   {results[name]['us_per_row']:8.3f} us/row")
+
+    path = bench_results.save('parsing', results, args.output)
+    print(f"\nResults written to {path}")
+
+    if args.compare and bench_results.compare(args.compare, results, 'min_ms'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Saving benchmark results as JSON and comparing them with a baseline run."""
+import json
+import os
+import platform
+import subprocess
+from datetime import datetime
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save(suite, results, path=None):
+    """Write ``results`` (``{case: {metric: value}}``) with run metadata; return the path."""
+    document = {
+        'suite': suite,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': _git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results
+    }
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{suite}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+    return path
+
+
+def compare(baseline_path, results, metric, threshold=0.10, higher_is_better=False):
+    """Print ``metric`` for each case against the baseline; return the regressed cases.
+
+    A case regresses when it is worse than the baseline by more than
+    ``threshold`` (10% by default).
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+
+    regressions = []
+    print(f"\nCompared with {baseline_path} ({metric}):")
+    for case, metrics in sorted(results.items()):
+        if case not in baseline or metric not in baseline[case]:
+            continue
+        before, after = baseline[case][metric], metrics[metric]
+        if not before:
+            continue
+        change = (after - before) / before
+        worse = -change if higher_is_better else change
+        flag = '  REGRESSION' if worse > threshold else ''
+        print(f"  {case:45s} {before:12.4f} -> {after:12.4f}  {change:+7.1%}{flag}")
+        if flag:
+            regressions.append(case)
+    return regressions
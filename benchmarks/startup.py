@@ -0,0 +1,118 @@
+"""Startup time of the app, each case in a fresh Python process.
+
+    python -m benchmarks.startup [--repeat 10] [--vehicle-rows 1000] [--importtime] [--compare results/startup-....json]
+
+Cases, measured as the wall time of the whole process so they read as what
+a worker boot costs:
+
+    python          an empty interpreter, the floor for every other case
+    import          ``import src.app``
+    create_app      import, then create_app() with stores in a temporary directory
+    first_request   create_app() and a first /api/vehicles, read and parsed from a
+                    synthetic recording (SHEET_SOURCE=local) as no snapshot exists yet
+    google_client   importing the Google client, which the app now defers to the
+                    first sheet read
+
+``--importtime`` also prints the slowest imports under ``src.app``
+(``python -X importtime``).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import results as bench_results
+from benchmarks import synthetic
+from src.sources import save_recording
+
+CREATE_APP = (
+    "from src.app import create_app\n"
+    "app = create_app({'SYNC_ENABLED': False})\n"
+)
+
+CASES = {
+    'python': 'pass',
+    'import': 'import src.app',
+    'create_app': CREATE_APP,
+    'first_request': CREATE_APP + (
+        "response = app.test_client().get('/api/vehicles')\n"
+        "assert response.status_code == 200, response.status_code\n"
+    ),
+    'google_client': 'import googleapiclient.discovery, google.oauth2.service_account'
+}
+
+
+def run_case(code, env, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], env=env, check=True)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def slowest_imports(env, count=15):
+    """(cumulative ms, module) of the slowest imports under src.app"""
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import src.app'],
+        env=env, capture_output=True, text=True, check=True
+    )
+    imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line.split('|')
+        imports.append((int(cumulative) / 1000, module.rstrip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--vehicle-rows', type=int, default=1000)
+    parser.add_argument('--importtime', action='store_true', help='print the slowest imports of src.app')
+    parser.add_argument('--output', help='where to write the JSON results')
+    parser.add_argument('--compare', help='baseline JSON results to compare against')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        recording_path = os.path.join(directory, 'fleet.json')
+        save_recording(recording_path, synthetic.recording(args.vehicle_rows))
+        env = dict(
+            os.environ,
+            PYTHONPATH=os.getcwd(),
+            SHEET_SOURCE='local',
+            SHEET_SOURCE_PATH=recording_path,
+            SNAPSHOT_STORE=os.path.join(directory, 'snapshot.db'),
+            HISTORY_STORE=os.path.join(directory, 'history.db'),
+            METRICS_DIR=os.path.join(directory, 'metrics'),
+            LOG_LEVEL='WARNING',
+            LOG_FILE=''
+        )
+
+        results = {}
+        for name, code in CASES.items():
+            timings = run_case(code, env, args.repeat)
+            results[name] = {
+                'min_ms': round(min(timings) * 1000, 2),
+                'median_ms': round(statistics.median(timings) * 1000, 2)
+            }
+            print(f"{name:15s} min {results[name]['min_ms']:9.1f} ms   median {results[name]['median_ms']:9.1f} ms")
+
+        if args.importtime:
+            print('\nSlowest imports under src.app (cumulative):')
+            for cumulative, module in slowest_imports(env):
+                print(f"  {cumulative:8.1f} ms  {module}")
+
+    path = bench_results.save('startup', results, args.output)
+    print(f"\nResults written to {path}")
+
+    if args.compare and bench_results.compare(args.compare, results, 'median_ms'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
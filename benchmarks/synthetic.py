@@ -0,0 +1,119 @@
+"""Synthetic sheets with the layout of the real spreadsheet, for benchmarks."""
+import json
+import random
+
+MODELS = ['CHR', 'Corolla', 'Kona', 'Model 3', 'Swace', 'Auris', 'Isuzu']
+STATUSES = ['MC', 'FC', 'FRANCE SERV', 'MC AUTO', '']
+
+POINT_FS_LABELS = [
+    'Flotte', 'Chauffeur', 'Chauffeur actif', 'Transco', 'Dispo', 'Vehicule total',
+    'Vehicule dispo', 'CHR', 'Corolla', 'Kona', 'Model 3', 'Swace', 'Auris', 'Isuzu',
+    'Depart semaine', 'Depart jour', 'Stop semaine', 'Stop jour', 'CA S-1', 'CA jour'
+]
+
+
+def _plate(n):
+    return f"{chr(65 + n % 26)}{chr(65 + n // 26 % 26)}{n % 1000:03d}{chr(65 + n // 676 % 26)}{chr(65 + n // 17576 % 26)}"
+
+
+def vehicle_sheet(rows, seed=42):
+    """A VÉHICULE sheet of ``rows`` data rows plus the header, every section populated.
+
+    The sheet goes through a JSON round-trip so every cell is its own string
+    object, as it is when googleapiclient decodes the API response.
+    """
+    rng = random.Random(seed)
+    values = [['TYPE', 'IMMATRICULATION', 'STATUT']]
+    for n in range(rows):
+        row = [''] * 26
+        plate = _plate(n)
+        row[0], row[1], row[2] = rng.choice(MODELS), plate + 'F', rng.choice(STATUSES)
+        if n % 2 == 0:
+            row[3], row[4], row[5] = rng.choice(MODELS), plate + 'C', rng.choice(STATUSES)
+        if n % 3 == 0:
+            row[6], row[7], row[8] = rng.choice(MODELS), plate + 'T', rng.choice(STATUSES)
+        if n % 4 == 0:
+            row[13] = f"{rng.choice(MODELS)} ({plate}D)"
+        if n % 5 == 0:
+            row[16] = f"{rng.choice(MODELS)} ({plate}M)"
+        if n % 7 == 0:
+            row[19], row[20], row[21] = f"{rng.choice(MODELS)} ({plate}I)", plate + 'G', ''
+        if n % 9 == 0:
+            row[22], row[23], row[24] = rng.choice(MODELS), plate + 'R', ''
+        values.append(row)
+    return json.loads(json.dumps(values))
+
+
+def point_fs_summary(rows=50, seed=42):
+    """'Point FS'!A1:B50 as read with UNFORMATTED_VALUE: a label and a number per row."""
+    rng = random.Random(seed)
+    return [
+        [POINT_FS_LABELS[n % len(POINT_FS_LABELS)], rng.choice([rng.randint(0, 500), f"{rng.randint(0, 9999)},{rng.randint(0, 99)} €"])]
+        for n in range(rows)
+    ]
+
+
+def point_fs_detail(rows=44, seed=42):
+    """'POINT FS'!B2:D45: free-form text with some blank rows."""
+    rng = random.Random(seed)
+    return [
+        [] if n % 6 == 5 else [f"Ligne {n}", str(rng.randint(0, 100)), rng.choice(['OK', 'KO', ''])]
+        for n in range(rows)
+    ]
+
+
+def legacy_vehicle_rows(rows, seed=42):
+    """Rows in the A:G layout read by parse_vehicle_data."""
+    rng = random.Random(seed)
+    return [
+        [rng.choice(MODELS), f"CU{n}", _plate(n), '', rng.choice(['FRANCE SERV', 'SOCIETE']),
+         rng.choice(STATUSES), rng.choice(['MC', 'FC', ''])]
+        for n in range(rows)
+    ]
+
+
+def recording(vehicle_rows):
+    """Ranges in the format LocalSheetSource replays (see src/sources.py)."""
+    return {
+        "'Point FS'!A1:B50": {'UNFORMATTED_VALUE': point_fs_summary()},
+        "'VÉHICULE'!A1:Z1000": {'FORMATTED_VALUE': vehicle_sheet(vehicle_rows)},
+        "'POINT FS'!B2:D45": {'FORMATTED_VALUE': point_fs_detail()}
+    }
+
+
+def edit_sheet(values, edits, seed=42):
+    """A copy of a VÉHICULE sheet with ``edits`` random edits: cells changed, rows added, removed or cleared.
+
+    Rows are copied, as a new read of the sheet returns new lists.
+    """
+    rng = random.Random(seed)
+    values = [list(row) for row in values]
+    for _ in range(edits):
+        kind = rng.random()
+        if kind < 0.7 or len(values) < 3:
+            row = values[rng.randrange(1, len(values))] if len(values) > 1 else values[0]
+            if row:
+                row[rng.randrange(len(row))] = rng.choice(MODELS + STATUSES)
+        elif kind < 0.8:
+            values.insert(rng.randrange(1, len(values)), list(values[rng.randrange(1, len(values))]))
+        elif kind < 0.9:
+            del values[rng.randrange(1, len(values))]
+        else:
+            values[rng.randrange(1, len(values))] = []
+    return values
+
+
+def edited_sheets(values, rounds):
+    """``rounds`` successive reads of a sheet edited at random, 1 to 10 edits apart, each from the previous one.
+
+    Starts again from ``values`` when the edits have left fewer than two
+    data rows.  Replayed by ``benchmarks.parsing --check`` and
+    tests/test_inventory.py against full parses.
+    """
+    sheet = values
+    for round_number in range(rounds):
+        sheet = edit_sheet(sheet, 1 + round_number % 10, seed=round_number)
+        if len(sheet) < 3:
+            sheet = values
+        yield sheet
+
@@ -0,0 +1,90 @@
+"""Memory footprint of the parsed fleet, per 10k vehicles.
+
+Compares the per-row dicts get_vehicles used to build with the slotted,
+interned VehicleRecord returned by parse_vehicle_inventory today.
+
+    python -m benchmarks.vehicle_memory [--vehicles 10000]
+"""
+import argparse
+import gc
+import tracemalloc
+
+from benchmarks import synthetic
+from src.parsers import DEFAULT_VEHICLE_LAYOUT, parse_vehicle_inventory
+
+# Véhicules par ligne de synthetic.vehicle_sheet : chaque section est remplie une ligne sur 1, 2, 3, 4, 5,
+# 7 (immo et gestionnaire) ou 9
+VEHICLES_PER_ROW = sum(1 / step for step in (1, 2, 3, 4, 5, 7, 7, 9))
+
+
+def vehicle_sheet(vehicles):
+    """A synthetic VÉHICULE sheet (see benchmarks/synthetic.py) holding about ``vehicles`` vehicles."""
+    return synthetic.vehicle_sheet(max(1, round(vehicles / VEHICLES_PER_ROW)))
+
+
+def dict_inventory(values):
+    """The dict-per-vehicle layout the API used before VehicleRecord, over every section of the sheet."""
+    categories = {}
+    for row in values[1:]:
+        for section in DEFAULT_VEHICLE_LAYOUT:
+            if len(row) < section['min_width']:
+                continue
+            category = section['category']
+            if section['kind'] == 'embedded':
+                if not row[section['cell']]:
+                    continue
+                vehicle_type, immat = row[section['cell']].split('(')
+                vehicle = {
+                    'type': vehicle_type.strip(),
+                    'immatriculation': immat.replace(')', '').strip(),
+                    'cucar': '',
+                    'status': section['status'],
+                    'category': category
+                }
+            else:
+                if not row[section['type']] or not row[section['immatriculation']]:
+                    continue
+                status = row[section['status']] if section['kind'] == 'columns' else section['status']
+                vehicle = {
+                    'type': str(row[section['type']]),
+                    'immatriculation': str(row[section['immatriculation']]),
+                    'status': str(status),
+                    'category': category
+                }
+            categories.setdefault(category, []).append(vehicle)
+    return categories
+
+
+def record_inventory(values):
+    categories, _ = parse_vehicle_inventory(values)
+    return categories
+
+
+def measure(build, values):
+    gc.collect()
+    tracemalloc.start()
+    result = build(values)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    vehicles = sum(len(v) for v in result.values())
+    return current, vehicles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--vehicles', type=int, default=10000)
+    args = parser.parse_args()
+
+    values = vehicle_sheet(args.vehicles)
+    results = {}
+    for name, build in (('dicts', dict_inventory), ('records', record_inventory)):
+        size, vehicles = measure(build, values)
+        per_10k = size * 10000 / vehicles
+        results[name] = per_10k
+        print(f"{name:8s} {vehicles:7d} vehicles  {size / 1024:9.1f} KiB  {per_10k / 1024:9.1f} KiB per 10k")
+
+    print(f"records use {results['records'] / results['dicts']:.0%} of the dict footprint")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,207 +1,616 @@
-from flask import Flask, render_template, jsonify, send_from_directory
-from google.oauth2.credentials import Credentials
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from datetime import datetime
+from flask import Blueprint, Flask, Response, current_app, g, render_template, jsonify, request, send_from_directory
+from flask.json.provider import DefaultJSONProvider
+from flask_login import current_user, login_required
+from werkzeug.local import LocalProxy
+from datetime import datetime, timedelta
 import os
-from dotenv import load_dotenv
 import logging
 import traceback
+import csv
+import gzip
+import io
 import json
-import re
-
-# Set up logging
-logging.basicConfig(level=logging.DEBUG, 
-                   format='%(asctime)s - %(levelname)s - %(message)s',
-                   handlers=[
-                       logging.FileHandler('logs/app.log'),  # Log to a file
-                       logging.StreamHandler()  # Log to console
-                   ])
+import math
+import queue
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import lru_cache, partial
+from operator import attrgetter
+
+try:
+    import brotli
+except ImportError:  # optionnel : sans le paquet brotli on ne compresse qu'en gzip
+    brotli = None
+
+from src.auth import login_manager
+from src.cache import RangeCache
+from src.diff import diff_vehicles
+from src.events import SnapshotBroadcaster, format_sse
+from src.federation import FederatedSheetSource, federate, parse_agencies, sum_figures
+from src.history import ROLLUP_STEPS, MetricHistory, flatten_metrics
+from src.inventory import IncrementalInventory
+from src.logging_setup import configure_logging
+from src.metrics import REGISTRY, SIZE_BUCKETS, Counter, Histogram
+from src.parsers import (
+    compile_vehicle_layout,
+    default_point_fs_data,
+    filter_point_fs_rows,
+    load_vehicle_layout,
+    parse_point_fs_data,
+    status_columns
+)
+from src.records import Record, VehicleRecord
+from src.settings import load_settings
+from src.sheets import service_manager
+from src.snapshot import SnapshotSyncWorker, body_etag
+from src.store import SnapshotStore
+from src.sources import get_sheet_source, source_identity
+from src.upstream import guard_source
+from src.vehicle_index import SORT_FIELDS, VehicleIndex, decode_cursor, encode_cursor, normalize_plate
+from src.writeback import WriteBackQueue
+
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
+class FleetJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes the slotted vehicle records as plain objects"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Record):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+bp = Blueprint('fleet', __name__)
+
+# Services de l'app courante, créés par create_app() et rangés dans app.extensions['fleet']
+current_fleet = LocalProxy(lambda: current_app.extensions['fleet'])
+
+POINT_FS_SUMMARY_RANGE = "'Point FS'!A1:B50"
+VEHICLE_RANGE = "'VÉHICULE'!A1:Z1000"
+POINT_FS_DETAIL_RANGE = "'POINT FS'!B2:D45"
 
-app = Flask(__name__, static_folder='static', template_folder='templates')
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key')
+# Toutes les plages lues par le snapshot, avec l'option de rendu attendue par chaque parseur
+SNAPSHOT_RANGES = [
+    (POINT_FS_SUMMARY_RANGE, 'UNFORMATTED_VALUE'),
+    (VEHICLE_RANGE, 'FORMATTED_VALUE'),
+    (POINT_FS_DETAIL_RANGE, 'FORMATTED_VALUE')
+]
 
-# Google Sheets API setup
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
-logger.debug(f"Using Spreadsheet ID: {SPREADSHEET_ID}")
+# Métriques exposées sur /metrics, additionnées sur tous les workers (voir src/metrics.py)
+REQUEST_SECONDS = Histogram(
+    'fleet_http_request_duration_seconds', 'Time to build each response, per route',
+    ['route', 'method', 'status']
+)
+RESPONSE_BYTES = Histogram(
+    'fleet_http_response_bytes', 'Size of each response body as sent, per route',
+    ['route'], buckets=SIZE_BUCKETS
+)
+PARSE_SECONDS = Histogram('fleet_parse_duration_seconds', 'Time spent in each sheet parser', ['parser'])
+ROWS_PROCESSED = Counter('fleet_rows_processed_total', 'Sheet rows handed to each parser', ['parser'])
+SERIALIZE_SECONDS = Histogram('fleet_serialize_duration_seconds', 'Time spent serializing snapshot payloads to JSON')
+PAYLOAD_BYTES = Histogram(
+    'fleet_payload_bytes', 'Size of each serialized snapshot payload when rebuilt',
+    ['payload'], buckets=SIZE_BUCKETS
+)
+STREAMS_REFUSED = Counter(
+    'fleet_streams_refused_total', 'SSE streams and long-polls refused because the worker had no thread to spare'
+)
+
+def run_parser(parser, values):
+    """parser(values), recording its duration and the number of rows it processed"""
+    name = parser.__name__
+    with PARSE_SECONDS.labels(name).time():
+        result = parser(values)
+    ROWS_PROCESSED.labels(name).inc(len(values))
+    return result
 
 def get_google_sheets_service():
-    try:
-        credentials_path = os.path.abspath('src/config/credentials.json')
-        logger.debug(f"Looking for credentials at: {credentials_path}")
-        
-        if not os.path.exists(credentials_path):
-            logger.error(f"Credentials file not found at {credentials_path}")
-            return None
+    return service_manager.get_service()
 
-        try:
-            with open(credentials_path, 'r') as f:
-                creds_json = json.load(f)
-                service_email = creds_json.get('client_email')
-                project_id = creds_json.get('project_id')
-                logger.debug(f"Service account email: {service_email}")
-                logger.debug(f"Project ID: {project_id}")
-
-            creds = service_account.Credentials.from_service_account_file(
-                credentials_path, 
-                scopes=SCOPES
+def build_dashboard_payload(values):
+    if not values:
+        return default_point_fs_data()
+    return run_parser(parse_point_fs_data, values)
+
+def build_point_fs_payload(values):
+    return {'data': run_parser(filter_point_fs_rows, values)}
+
+def merge_dashboard_payloads(payloads):
+    """Point FS figures of every agency added together, each agency's own under 'agencies'"""
+    merged = sum_figures(payloads.values())
+    merged['agencies'] = payloads
+    return merged
+
+def merge_vehicles_payloads(payloads):
+    """Every agency's vehicles in one inventory.
+
+    The vehicles already carry their agency, set by each agency's
+    IncrementalInventory; the records are shared with it and not modified
+    here.  ``stats`` are the global counts, with each agency's own counts under
+    ``stats['agencies']``; agencies whose sheet gave no data are listed
+    under ``errors``.
+    """
+    categories = {}
+    stats = {}
+    errors = {}
+    for agency, payload in payloads.items():
+        if 'error' in payload:
+            errors[agency] = payload['error']
+            continue
+        for category, vehicles in payload['categories'].items():
+            categories.setdefault(category, []).extend(vehicles)
+        stats[agency] = payload['stats']
+    if not stats:
+        return {'error': 'No data found'}
+
+    merged = {
+        'categories': categories,
+        'stats': dict(sum_figures(stats.values()), agencies=stats),
+        'success': True
+    }
+    if errors:
+        merged['errors'] = errors
+    return merged
+
+def merge_point_fs_payloads(payloads):
+    return {
+        'data': [row for payload in payloads.values() for row in payload['data']],
+        'agencies': {agency: payload['data'] for agency, payload in payloads.items()}
+    }
+
+def serialize_payload(json_provider, payload):
+    with SERIALIZE_SECONDS.time():
+        return json_provider.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+def decode_vehicles_payload(body):
+    """The vehicles payload read back from the snapshot store, with its VehicleRecords"""
+    payload = json.loads(body)
+    if 'categories' in payload:
+        payload['categories'] = {
+            category: [VehicleRecord(**vehicle) for vehicle in vehicles]
+            for category, vehicles in payload['categories'].items()
+        }
+    return payload
+
+def encode_payloads(snapshot, names):
+    """JSON body {"version": N, "payloads": {name: payload}} built from the pre-serialized bodies"""
+    parts = [b'"%s":%s' % (name.encode('utf-8'), snapshot.bodies[name]) for name in names]
+    return b'{"version":%d,"payloads":{%s}}' % (snapshot.version, b','.join(parts))
+
+def record_payload_sizes(previous, snapshot):
+    for name, body in snapshot.bodies.items():
+        if previous is None or previous.bodies.get(name) is not body:
+            PAYLOAD_BYTES.labels(name).observe(len(body))
+
+HISTORY_MAX_POINTS = 2000
+# Corps des réponses ?since= gardés par app
+VEHICLE_DELTA_CACHE_SIZE = 32
+
+class Fleet:
+    """The services create_app() builds for one app, kept in ``app.extensions['fleet']``.
+
+    The sheet source, the caches, the sync worker, the write-back queue and
+    the push channel belong to the app rather than to this module, so two
+    apps in one process (tests, ASGI and WSGI) keep apart.  The sync and
+    write-back threads run outside any app context, which is why what they
+    call is a method of this object; routes reach it as ``current_fleet``.
+    """
+
+    def __init__(self, settings, json_provider):
+        self.settings = settings
+        self.json = json_provider
+
+        # Colonnes de la feuille VÉHICULE, et parmi elles les statuts modifiables (PATCH /api/vehicles/<immatriculation>)
+        layout = load_vehicle_layout(settings['VEHICLE_LAYOUT_FILE'])
+        self.vehicle_layout = compile_vehicle_layout(layout)
+        self.vehicle_status_columns = status_columns(layout)
+        # Inventaire de la feuille VÉHICULE tenu à jour ligne par ligne (src/inventory.py), un par agence
+        self.vehicle_inventories = {}
+        # Inventaires des dernières versions, pour répondre à /api/vehicles?since=<version>
+        self.vehicle_history = OrderedDict()
+        # Index de l'inventaire pour /api/vehicles/search, reconstruit à chaque nouvelle version
+        self.vehicle_index_lock = threading.Lock()
+        self.vehicle_index_cache = {}
+        # Corps des réponses ?since=, par (since, version) : un seul diff quel que soit le nombre de clients
+        self.vehicle_delta_lock = threading.Lock()
+        self.vehicle_delta_cache = OrderedDict()
+        # Canal de push vers les dashboards ouverts (Server-Sent Events, ou long-poll en repli)
+        self.broadcaster = SnapshotBroadcaster()
+
+        # Source des données : l'API Google Sheets, ou un enregistrement local (SHEET_SOURCE=local),
+        # derrière la limite de débit, les retries et le disjoncteur de src/upstream.py ;
+        # avec SPREADSHEET_IDS, un classeur par agence lus en parallèle (src/federation.py)
+        agencies = parse_agencies(settings['SPREADSHEET_IDS'])
+        if agencies:
+            self.sheet_source = FederatedSheetSource(
+                {agency: guard_source(get_sheet_source(spreadsheet_id, settings), settings)
+                 for agency, spreadsheet_id in agencies.items()},
+                max_workers=settings['FEDERATION_WORKERS']
             )
-            logger.debug("Successfully created credentials object")
-            
-            service = build('sheets', 'v4', credentials=creds)
-            logger.debug("Successfully built sheets service")
-            
-            return service
-                
-        except Exception as e:
-            logger.error(f"Error creating service: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.info(f"Federating {len(agencies)} agencies: {', '.join(agencies)}")
+        else:
+            self.sheet_source = guard_source(get_sheet_source(settings['SPREADSHEET_ID'], settings), settings)
+
+        # Cache des plages lues dans le Google Sheet, partagé par toutes les requêtes du worker
+        self.range_cache = RangeCache(ttl=settings['SHEETS_CACHE_TTL'], stale_ttl=settings['SHEETS_CACHE_STALE_TTL'])
+
+        # Snapshot partagé par les workers et conservé entre deux redémarrages (vide pour désactiver)
+        store_path = settings['SNAPSHOT_STORE']
+        spreadsheet_ids = [f"{agency}={spreadsheet_id}" for agency, spreadsheet_id in agencies.items()] if agencies \
+            else [settings['SPREADSHEET_ID'] or '']
+        self.sync_worker = SnapshotSyncWorker(
+            self.fetch_snapshot_values,
+            self.snapshot_builders(federated=bool(agencies)),
+            partial(serialize_payload, json_provider),
+            interval=settings['SYNC_INTERVAL'],
+            check_revision=self.read_spreadsheet_revision,
+            max_age=settings['SYNC_MAX_AGE'],
+            store=SnapshotStore(store_path, source=source_identity(spreadsheet_ids, settings)) if store_path else None,
+            decoders={'vehicles': decode_vehicles_payload},
+            poll_interval=settings['SNAPSHOT_STORE_POLL']
+        )
+        self.sync_worker.add_listener(self.publish_snapshot_diff)
+        self.sync_worker.add_listener(self.record_vehicle_history)
+        self.sync_worker.add_listener(self.index_vehicles)
+
+        # Historique des chiffres du Point FS pour /api/history (vide pour désactiver)
+        history_path = settings['HISTORY_STORE']
+        self.metric_history = MetricHistory(
+            history_path,
+            raw_retention=settings['HISTORY_RAW_DAYS'] * 86400,
+            rollup_retention=settings['HISTORY_ROLLUP_DAYS'] * 86400
+        ) if history_path else None
+        if self.metric_history is not None:
+            self.sync_worker.add_listener(self.record_point_fs_history)
+        self.sync_worker.add_listener(record_payload_sizes)
+
+        # Flux SSE et long-polls ouverts en même temps par ce worker, chacun tenant un thread gthread
+        self.stream_slots = threading.BoundedSemaphore(settings['STREAM_MAX_CLIENTS'])
+
+        # Statuts modifiés depuis l'app, écrits dans le classeur par lots (src/writeback.py)
+        self.writeback_queue = WriteBackQueue(
+            self.write_vehicle_statuses,
+            interval=settings['WRITEBACK_INTERVAL'],
+            max_attempts=settings['WRITEBACK_MAX_ATTEMPTS'],
+            on_failure=self.revert_vehicle_statuses
+        )
+
+    def start(self):
+        """Start the sync (unless SYNC_ENABLED is off) and write-back threads; a no-op once they run"""
+        if self.settings['SYNC_ENABLED']:
+            self.sync_worker.start()
+        self.writeback_queue.start()
+
+    def snapshot_builders(self, federated=False):
+        """Each payload of the snapshot and the range it depends on"""
+        if federated:
+            # Avec plusieurs agences, chaque plage arrive en {agence: lignes} : parsée par agence puis fusionnée
+            return {
+                'dashboard': (POINT_FS_SUMMARY_RANGE, federate(build_dashboard_payload, merge_dashboard_payloads)),
+                'vehicles': (VEHICLE_RANGE, federate(self.build_vehicles_payload, merge_vehicles_payloads,
+                                                     with_agency=True)),
+                'point_fs': (POINT_FS_DETAIL_RANGE, federate(build_point_fs_payload, merge_point_fs_payloads))
+            }
+        return {
+            'dashboard': (POINT_FS_SUMMARY_RANGE, build_dashboard_payload),
+            'vehicles': (VEHICLE_RANGE, self.build_vehicles_payload),
+            'point_fs': (POINT_FS_DETAIL_RANGE, build_point_fs_payload)
+        }
+
+    def register_metrics(self):
+        """Export this app's caches, sync worker and sheet source on /metrics (the last app created wins)"""
+        REGISTRY.add_collector(
+            'fleet_cache_lookups_total', 'Range cache lookups by result', 'counter',
+            ['cache', 'result'], self.collect_cache_lookups
+        )
+        REGISTRY.add_collector(
+            'fleet_cache_hit_ratio', 'Share of range cache lookups served from cache, fresh or stale', 'gauge',
+            ['cache'], lambda: {('ranges',): self.range_cache.stats()['hit_ratio']}
+        )
+        REGISTRY.add_collector(
+            'fleet_sync_events_total', 'Sync worker refreshes, skipped cycles and payload rebuilds', 'counter',
+            ['event'], lambda: {(event,): count for event, count in self.sync_worker.counters.items()}
+        )
+        REGISTRY.add_collector(
+            'fleet_upstream_events_total',
+            'Sheet source calls, retries, failures and reads refused by the rate limit or circuit',
+            'counter', ['event'], lambda: {(event,): count for event, count in self.sheet_source.counters.items()}
+        )
+        REGISTRY.add_collector(
+            'fleet_upstream_circuit_open', 'Whether a Sheets circuit breaker of each worker is open (1) or not (0)',
+            'gauge', [], lambda: {(): int(self.sheet_source.circuit_open())}
+        )
+        REGISTRY.add_collector(
+            'fleet_snapshot_version', 'Version of the snapshot served by each worker', 'gauge',
+            [], self.collect_snapshot_version
+        )
+
+    def collect_cache_lookups(self):
+        stats = self.range_cache.stats()
+        return {
+            ('ranges', 'hit'): stats['hits'],
+            ('ranges', 'stale'): stats['stale_hits'],
+            ('ranges', 'miss'): stats['misses'],
+            ('ranges', 'coalesced'): stats['coalesced']
+        }
+
+    def collect_snapshot_version(self):
+        snapshot = self.sync_worker.current
+        return {(): snapshot.version} if snapshot is not None else {}
+
+    def fetch_range(self, range_name, value_render_option=None):
+        """Rows of a range, read through the shared cache keyed on spreadsheet, range and render option"""
+        return self.range_cache.get(
+            (self.settings['SPREADSHEET_ID'], range_name, value_render_option),
+            lambda: self.sheet_source.get(range_name, value_render_option)
+        )
+
+    def get_vehicle_inventory(self, agency=None):
+        inventory = self.vehicle_inventories.get(agency)
+        if inventory is None:
+            inventory = self.vehicle_inventories.setdefault(
+                agency, IncrementalInventory(self.vehicle_layout, agency=agency, check=self.settings['INVENTORY_CHECK']))
+        return inventory
+
+    def build_vehicles_payload(self, values, agency=None):
+        if not values:
+            logger.error("No data found in sheet")
+            return {'error': 'No data found'}
+
+        # Seules les lignes modifiées depuis la lecture précédente sont parsées et recomptées
+        inventory = self.get_vehicle_inventory(agency)
+        with PARSE_SECONDS.labels('update_vehicle_inventory').time():
+            categories, stats = inventory.update(values)
+        ROWS_PROCESSED.labels('update_vehicle_inventory').inc(inventory.last_changed_rows)
+        return {
+            'categories': categories,
+            'stats': stats,
+            'success': True
+        }
+
+    def build_payload(self, name, values):
+        """Payload ``name`` from the rows of its range, with the builders the sync worker uses"""
+        return self.sync_worker.builders[name][1](values)
+
+    def fetch_snapshot_values(self):
+        """Fetch every range the dashboard needs in one batch, keyed by range name"""
+        values = self.sheet_source.batch_get(SNAPSHOT_RANGES)
+        return {range_name: rows for (range_name, _), rows in zip(SNAPSHOT_RANGES, values)}
+
+    def build_snapshot_payloads(self):
+        return self.sync_worker.build_payloads(self.fetch_snapshot_values())
+
+    def read_spreadsheet_revision(self):
+        """Revision of the spreadsheet, or None when change detection is off or unavailable"""
+        if not self.settings['SYNC_CHANGE_DETECTION']:
             return None
-            
-    except Exception as e:
-        logger.error(f"Error in get_google_sheets_service: {str(e)}")
-        logger.error(traceback.format_exc())
+        return self.sheet_source.revision()
+
+    def publish_snapshot_diff(self, previous, snapshot):
+        # Only the payloads rebuilt by this sync; unchanged ones keep the same body object
+        changed = [
+            name for name, body in snapshot.bodies.items()
+            if previous is None or previous.bodies.get(name) is not body
+        ]
+        self.broadcaster.publish(snapshot.version, 'snapshot', encode_payloads(snapshot, changed))
+
+    def record_vehicle_history(self, previous, snapshot):
+        categories = snapshot.payloads['vehicles'].get('categories')
+        if categories is None:
+            return
+        self.vehicle_history[snapshot.version] = categories
+        while len(self.vehicle_history) > self.settings['VEHICLE_HISTORY_SIZE']:
+            self.vehicle_history.popitem(last=False)
+
+    def get_vehicle_index(self, snapshot):
+        """Index of the snapshot's inventory, built once per version of the vehicles payload"""
+        version = snapshot.payload_versions['vehicles']
+        with self.vehicle_index_lock:
+            index = self.vehicle_index_cache.get(version)
+            if index is None:
+                index = VehicleIndex(snapshot.payloads['vehicles'].get('categories', {}))
+                self.vehicle_index_cache.clear()
+                self.vehicle_index_cache[version] = index
+        return index
+
+    def index_vehicles(self, previous, snapshot):
+        # Construit dans le thread de synchro pour que la première recherche n'attende pas
+        self.get_vehicle_index(snapshot)
+
+    def record_point_fs_history(self, previous, snapshot):
+        body = snapshot.bodies['dashboard']
+        if previous is not None and previous.bodies.get('dashboard') is body:
+            return
+        observed_at = datetime.fromisoformat(snapshot.fetched_at).timestamp()
+        self.metric_history.append(observed_at, flatten_metrics(snapshot.payloads['dashboard']))
+
+    def vehicle_delta_body(self, since, version, old_categories, categories, stats):
+        """Changes from ``old_categories`` (version ``since``) to ``categories`` (version ``version``): JSON body and ETag"""
+        key = (since, version)
+        with self.vehicle_delta_lock:
+            cached = self.vehicle_delta_cache.get(key)
+            if cached is not None:
+                self.vehicle_delta_cache.move_to_end(key)
+                return cached
+        added, removed, changed = diff_vehicles(old_categories, categories)
+        body = self.json.dumps({
+            'since': since,
+            'version': version,
+            'added': added,
+            'removed': removed,
+            'changed': changed,
+            'stats': stats,
+            'success': True
+        }, separators=(',', ':')).encode('utf-8')
+        cached = body, body_etag(body)
+        with self.vehicle_delta_lock:
+            self.vehicle_delta_cache[key] = cached
+            while len(self.vehicle_delta_cache) > VEHICLE_DELTA_CACHE_SIZE:
+                self.vehicle_delta_cache.popitem(last=False)
+        return cached
+
+    def sorted_by_type(self, categories):
+        """Each category's vehicles sorted by type, in sheet order within a type.
+
+        Read from the views the inventory keeps sorted when ``categories`` is
+        what it last built, sorted here otherwise (patched or adopted payloads,
+        several agencies).
+        """
+        inventory = self.vehicle_inventories.get(None)
+        views = inventory.sorted_views(categories) if inventory is not None else None
+        if views is not None:
+            return views
+        return {category: sorted(vehicles, key=attrgetter('type')) for category, vehicles in categories.items()}
+
+    def agency_source(self, agency):
+        """The sheet source holding ``agency``'s spreadsheet (the only one when not federated)"""
+        return self.sheet_source.sources[agency] if agency is not None else self.sheet_source
+
+    def write_vehicle_statuses(self, edits):
+        """Write ``{(agency, category, plate): status}`` to the VÉHICULE sheet, one batchUpdate per spreadsheet.
+
+        Rows are found on a fresh read of the sheet rather than in the snapshot,
+        so rows moved since the last sync get the right cell; with several
+        agencies, FederatedSheetSource routes each one's cells to its
+        spreadsheet.  Returns the edits whose plate is not on exactly one row
+        of its section.
+        """
+        by_agency = {}
+        for key, status in edits.items():
+            by_agency.setdefault(key[0], {})[key] = status
+
+        rejected = {}
+        cells_by_agency = {}
+        for agency, agency_edits in by_agency.items():
+            rows = self.agency_source(agency).get(VEHICLE_RANGE, 'FORMATTED_VALUE')
+            rows_by_plate = {}
+            cells = {}
+            for key, status in agency_edits.items():
+                _, category, plate = key
+                immat_col, status_col = self.vehicle_status_columns[category]
+                if category not in rows_by_plate:
+                    plates = rows_by_plate[category] = {}
+                    # La première ligne est l'en-tête, comme dans parse_vehicle_inventory
+                    for number, row in enumerate(rows[1:], start=1):
+                        if len(row) > immat_col and row[immat_col]:
+                            plates.setdefault(normalize_plate(str(row[immat_col])), []).append(number)
+                found = rows_by_plate[category].get(plate, [])
+                if len(found) != 1:
+                    rejected[key] = 'not in the sheet' if not found else 'on several rows'
+                    continue
+                cells[(found[0], status_col)] = status
+            if cells:
+                cells_by_agency[agency] = cells
+        if None in cells_by_agency:
+            self.sheet_source.write_cells(VEHICLE_RANGE, cells_by_agency[None])
+        elif cells_by_agency:
+            self.sheet_source.write_cells(VEHICLE_RANGE, cells_by_agency)
+        return rejected
+
+    def revert_vehicle_statuses(self, failed):
+        # Les statuts affichés n'ont pas été écrits : on relit le classeur pour revenir à son état réel
+        logger.warning(f"Reverting {len(failed)} vehicle statuses not written to the sheet")
+        self.sync_worker.refresh(force=True)
+
+    def find_editable_vehicles(self, snapshot, plate, category=None, agency=None):
+        """Vehicles of the snapshot with this plate, in the sections whose status is a cell of its own"""
+        index = self.get_vehicle_index(snapshot)
+        numbers = index.match(
+            immatriculation=plate,
+            category=[category] if category else None,
+            agency=[agency] if agency else None
+        )
+        return [index.vehicles[number] for number in sorted(numbers)]
+
+def snapshot_response(snapshot, name):
+    response = current_app.response_class(snapshot.bodies[name], mimetype='application/json')
+    response.set_etag(f"{name}-{snapshot.etags[name]}")
+    response.headers['X-Data-Version'] = str(snapshot.version)
+    return response
+
+def vehicle_delta_response(snapshot, since):
+    """Only the vehicles added, removed or changed since version ``since``.
+
+    Falls back to the full inventory when that version is no longer in the
+    history, so clients can tell the two apart by the 'categories' key.
+    """
+    # Lu une seule fois : la version peut sortir de l'historique entre deux lectures
+    old_categories = current_fleet.vehicle_history.get(since)
+    payload = snapshot.payloads['vehicles']
+    if old_categories is None or 'categories' not in payload:
+        return snapshot_response(snapshot, 'vehicles')
+    body, etag = current_fleet.vehicle_delta_body(
+        since, snapshot.version, old_categories, payload['categories'], payload['stats'])
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(f"vehicles-delta-{etag}")
+    response.headers['X-Data-Version'] = str(snapshot.version)
+    return response
+
+@lru_cache(maxsize=64)
+def compress_body(data, encoding):
+    # Snapshot bodies are the same bytes object across requests, so each is compressed once
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+def choose_encoding(response):
+    # Réponses JSON plus petites que le seuil envoyées telles quelles
+    if response.content_length is None or response.content_length < current_fleet.settings['COMPRESSION_MIN_SIZE']:
         return None
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
 
-def parse_vehicle_data(values):
-    vehicles = []
-    try:
-        for row in values:
-            if len(row) >= 6:
-                # Get the category based on the sheet or column
-                category = 'FLOTTE'  # Default category
-                if 'FRANCE SERV' in str(row[4]):
-                    category = 'CHAUFFEUR'
-                elif any(status in str(row[5]).upper() for status in ['MC', 'FC']):
-                    category = 'TRANSCO'
-
-                vehicle = {
-                    'type': str(row[0]) if len(row) > 0 else '',
-                    'registration': str(row[2]) if len(row) > 2 else '',
-                    'cucar': str(row[1]) if len(row) > 1 else '',
-                    'service': str(row[4]) if len(row) > 4 else '',
-                    'status': str(row[5]) if len(row) > 5 else '',
-                    'mc_fc': str(row[6]) if len(row) > 6 else '',
-                    'category': category
-                }
-                vehicles.append(vehicle)
-        
-        # Sort vehicles by category and type
-        vehicles.sort(key=lambda x: (x['category'], x['type']))
-        
-        logger.debug(f"Parsed {len(vehicles)} vehicles")
-        if vehicles:
-            logger.debug(f"First vehicle: {vehicles[0]}")
-    except Exception as e:
-        logger.error(f"Error parsing vehicle data: {str(e)}")
-        logger.error(traceback.format_exc())
-    return vehicles
-
-def parse_point_fs_data(values):
-    data = {
-        'active_drivers': 0,
-        'total_vehicles': 0,
-        'available_vehicles': 0,
-        'categories': {
-            'FLOTTE': 0,
-            'CHAUFFEUR': 0,
-            'TRANSCO': 0,
-            'DISPONIBLE': 0
-        },
-        'status': {
-            'MC': 0,
-            'FC': 0,
-            'FRANCE_SERV': 0
-        },
-        'vehicle_types': [],
-        'weekly_departures': 0,
-        'daily_departures': 0,
-        'weekly_stops': 0,
-        'daily_stops': 0,
-        'ca_semaine': 0,
-        'ca_jour': 0
-    }
-    
-    try:
-        if not values:
-            logger.error("No values received from Point FS sheet")
-            return data
-
-        logger.debug(f"Processing {len(values)} rows from Point FS")
-        for row in values:
-            if len(row) < 2:
-                continue
-                
-            label = str(row[0]).lower() if row[0] else ''
-            value = row[1] if len(row) > 1 else 0
-            
-            try:
-                if isinstance(value, str):
-                    value = value.replace('€', '').replace(',', '.').strip()
-                    numeric_value = float(value) if '.' in value else int(value)
-                else:
-                    numeric_value = float(value) if isinstance(value, (int, float)) else 0
-            except (ValueError, AttributeError):
-                numeric_value = 0
-
-            # Update category counts
-            if 'flotte' in label:
-                data['categories']['FLOTTE'] = numeric_value
-            elif 'chauffeur' in label:
-                data['categories']['CHAUFFEUR'] = numeric_value
-            elif 'transco' in label:
-                data['categories']['TRANSCO'] = numeric_value
-            elif 'dispo' in label:
-                data['categories']['DISPONIBLE'] = numeric_value
-
-            # Update other metrics
-            if 'chauffeur' in label and 'actif' in label:
-                data['active_drivers'] = numeric_value
-            elif 'vehicule' in label and 'total' in label:
-                data['total_vehicles'] = numeric_value
-            elif 'vehicule' in label and 'dispo' in label:
-                data['available_vehicles'] = numeric_value
-            elif any(v in label for v in ['chr', 'corolla', 'kona', 'model 3', 'swace', 'auris', 'isuzu']):
-                if str(row[0]) not in data['vehicle_types']:
-                    data['vehicle_types'].append(str(row[0]))
-            elif 'depart' in label and 'semaine' in label:
-                data['weekly_departures'] = numeric_value
-            elif 'depart' in label and 'jour' in label:
-                data['daily_departures'] = numeric_value
-            elif 'stop' in label and 'semaine' in label:
-                data['weekly_stops'] = numeric_value
-            elif 'stop' in label and 'jour' in label:
-                data['daily_stops'] = numeric_value
-            elif 'ca s-1' in label:
-                data['ca_semaine'] = numeric_value
-            elif label.startswith('ca') and 'semaine' not in label:
-                data['ca_jour'] = numeric_value
-                
-        logger.debug(f"Parsed Point FS data: {data}")
-    except Exception as e:
-        logger.error(f"Error parsing Point FS data: {str(e)}")
-        logger.error(traceback.format_exc())
-    return data
+# Enregistré avant la compression : Flask appelle les after_request en ordre inverse,
+# donc on mesure la réponse telle qu'elle part
+@bp.after_app_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.labels(route, request.method, response.status_code).observe(time.perf_counter() - started)
+        if response.content_length is not None:
+            RESPONSE_BYTES.labels(route).observe(response.content_length)
+    return response
 
-def parse_vehicle_with_immat(cell_value):
-    """Helper function to parse vehicle type and immatriculation from a cell like 'CHR (GG441SX)'"""
-    if not cell_value or '(' not in cell_value or ')' not in cell_value:
-        return cell_value, ''
-    
-    try:
-        # Split by opening parenthesis and remove closing parenthesis
-        parts = cell_value.split('(')
-        vehicle_type = parts[0].strip()
-        immat = parts[1].replace(')', '').strip()
-        return vehicle_type, immat
-    except:
-        return cell_value, ''
+@bp.after_app_request
+def add_conditional_and_compression(response):
+    """ETag / If-None-Match and gzip/brotli for the JSON data routes"""
+    if request.method != 'GET' or response.status_code != 200 or response.is_streamed:
+        return response
+    if not (request.path.startswith('/api/') or request.path == '/get_point_fs_data'):
+        return response
+
+    encoding = choose_encoding(response)
+    etag, _ = response.get_etag()
+    if etag is None:
+        response.add_etag()
+        etag, _ = response.get_etag()
+    if encoding:
+        # Chaque encodage est une représentation différente : ETag forte distincte
+        response.set_etag(f"{etag}-{encoding}")
+    response.vary.add('Accept-Encoding')
+
+    response.make_conditional(request)
+    if encoding and response.status_code == 200:
+        response.set_data(compress_body(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@bp.before_app_request
+def ensure_sync_worker():
+    # Démarré à la première requête pour que chaque worker gunicorn ait son propre thread
+    current_fleet.start()
+    REGISTRY.start()
 
 def get_sheet_names(service, spreadsheet_id):
     try:
@@ -215,273 +624,57 @@ def get_sheet_names(service, spreadsheet_id):
         logger.error(f"Error getting sheet names: {str(e)}")
         return []
 
-@app.route('/')
+@bp.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/api/dashboard-data')
+@bp.route('/api/dashboard-data')
 def get_dashboard_data():
-    try:
-        service = get_google_sheets_service()
-        if not service:
-            logger.error("No service available")
-            return jsonify({'error': 'Failed to initialize Google Sheets service'})
+    snapshot = current_fleet.sync_worker.current
+    if snapshot is not None:
+        return snapshot_response(snapshot, 'dashboard')
 
+    try:
         try:
             logger.debug("Fetching data from Point FS sheet...")
-            result = service.spreadsheets().values().get(
-                spreadsheetId=SPREADSHEET_ID,
-                range="'Point FS'!A1:B50",
-                valueRenderOption='UNFORMATTED_VALUE'
-            ).execute()
-            values = result.get('values', [])
-            logger.debug(f"Got {len(values)} rows from Point FS sheet")
-            logger.debug(f"First few rows: {values[:3] if values else 'No data'}")
-
-            if not values:
-                return jsonify({
-                    'active_drivers': 0,
-                    'total_vehicles': 0,
-                    'available_vehicles': 0,
-                    'categories': {
-                        'FLOTTE': 0,
-                        'CHAUFFEUR': 0,
-                        'TRANSCO': 0,
-                        'DISPONIBLE': 0
-                    },
-                    'status': {
-                        'MC': 0,
-                        'FC': 0,
-                        'FRANCE_SERV': 0
-                    },
-                    'vehicle_types': [],
-                    'weekly_departures': 0,
-                    'daily_departures': 0,
-                    'weekly_stops': 0,
-                    'daily_stops': 0,
-                    'ca_semaine': 0,
-                    'ca_jour': 0
-                })
-
-            dashboard_data = parse_point_fs_data(values)
-            return jsonify(dashboard_data)
+            values = current_fleet.fetch_range(POINT_FS_SUMMARY_RANGE, 'UNFORMATTED_VALUE')
+            logger.debug("Got %d rows from Point FS sheet", len(values))
+
+            return jsonify(current_fleet.build_payload('dashboard', values))
 
         except Exception as e:
             logger.error(f"Error getting Point FS data: {str(e)}")
             logger.error(traceback.format_exc())
-            return jsonify({
-                'active_drivers': 0,
-                'total_vehicles': 0,
-                'available_vehicles': 0,
-                'categories': {
-                    'FLOTTE': 0,
-                    'CHAUFFEUR': 0,
-                    'TRANSCO': 0,
-                    'DISPONIBLE': 0
-                },
-                'status': {
-                    'MC': 0,
-                    'FC': 0,
-                    'FRANCE_SERV': 0
-                },
-                'vehicle_types': [],
-                'weekly_departures': 0,
-                'daily_departures': 0,
-                'weekly_stops': 0,
-                'daily_stops': 0,
-                'ca_semaine': 0,
-                'ca_jour': 0
-            })
+            return jsonify(default_point_fs_data())
 
     except Exception as e:
         logger.error(f"Error in get_dashboard_data: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({'error': str(e)})
 
-@app.route('/api/vehicles')
+@bp.route('/api/vehicles')
 def get_vehicles():
-    try:
-        service = get_google_sheets_service()
-        if not service:
-            logger.error("No service available")
-            return jsonify({'error': 'Service not available'})
+    snapshot = current_fleet.sync_worker.current
+    if snapshot is not None:
+        since = request.args.get('since', type=int)
+        if since is not None:
+            return vehicle_delta_response(snapshot, since)
+        return snapshot_response(snapshot, 'vehicles')
 
+    try:
         try:
             # Get all data from VÉHICULE sheet
-            range_name = "'VÉHICULE'!A1:Z1000"
-            logger.debug(f"Fetching data from range: {range_name}")
+            range_name = VEHICLE_RANGE
+            logger.debug("Fetching data from range: %s", range_name)
             
             try:
-                result = service.spreadsheets().values().get(
-                    spreadsheetId=SPREADSHEET_ID,
-                    range=range_name,
-                    valueRenderOption='FORMATTED_VALUE'
-                ).execute()
-                logger.debug(f"API Response: {result}")
+                values = current_fleet.fetch_range(range_name, 'FORMATTED_VALUE')
+                logger.debug("API Response: %d rows", len(values))
             except Exception as api_error:
                 logger.error(f"API Error: {str(api_error)}")
                 return jsonify({'error': f'API Error: {str(api_error)}'})
 
-            values = result.get('values', [])
-            if not values:
-                logger.error("No data found in sheet")
-                return jsonify({'error': 'No data found'})
-
-            # Initialize categories and stats
-            categories = {
-                'flotte': [],
-                'chauffeur': [],
-                'transco': [],
-                'disponible_fs': [],
-                'disponible_mc': [],
-                'immo': [],
-                'gestionnaire': [],
-                'gratuit': []
-            }
-            
-            stats = {
-                'total': 0,
-                'by_type': {},
-                'by_category': {},
-                'by_status': {}
-            }
-
-            # Process each section
-            for row_index, row in enumerate(values[1:], start=1):  # Skip header row
-                try:
-                    # Flotte vehicles (columns A-C)
-                    if len(row) >= 3 and row[0] and row[1]:
-                        vehicle = {
-                            'type': str(row[0]),
-                            'immatriculation': str(row[1]),
-                            'status': str(row[2]) if len(row) > 2 else '',
-                            'category': 'flotte'
-                        }
-                        categories['flotte'].append(vehicle)
-                        stats['total'] += 1
-                        stats['by_type'][vehicle['type']] = stats['by_type'].get(vehicle['type'], 0) + 1
-                        stats['by_category']['flotte'] = stats['by_category'].get('flotte', 0) + 1
-                        if vehicle['status']:
-                            stats['by_status'][vehicle['status']] = stats['by_status'].get(vehicle['status'], 0) + 1
-
-                    # Disponible FS vehicles (column N)
-                    if len(row) >= 14 and row[13] and str(row[13]).strip() != '0':
-                        vehicle_type, immat = parse_vehicle_with_immat(str(row[13]))
-                        if vehicle_type and immat:
-                            vehicle = {
-                                'type': vehicle_type,
-                                'immatriculation': immat,
-                                'cucar': '',
-                                'status': 'Disponible FS',
-                                'category': 'disponible_fs'
-                            }
-                            categories['disponible_fs'].append(vehicle)
-                            stats['total'] += 1
-                            stats['by_type'][vehicle_type] = stats['by_type'].get(vehicle_type, 0) + 1
-                            stats['by_category']['disponible_fs'] = stats['by_category'].get('disponible_fs', 0) + 1
-
-                    # Disponible MC vehicles (column Q)
-                    if len(row) >= 17 and row[16] and str(row[16]).strip() != '0':
-                        vehicle_type, immat = parse_vehicle_with_immat(str(row[16]))
-                        if vehicle_type and immat:
-                            vehicle = {
-                                'type': vehicle_type,
-                                'immatriculation': immat,
-                                'cucar': '',
-                                'status': 'Disponible MC',
-                                'category': 'disponible_mc'
-                            }
-                            categories['disponible_mc'].append(vehicle)
-                            stats['total'] += 1
-                            stats['by_type'][vehicle_type] = stats['by_type'].get(vehicle_type, 0) + 1
-                            stats['by_category']['disponible_mc'] = stats['by_category'].get('disponible_mc', 0) + 1
-
-                    # IMMO vehicles (column T2)
-                    if len(row) >= 20 and row[19] and str(row[19]).strip() != '0':
-                        vehicle_type, immat = parse_vehicle_with_immat(str(row[19]))
-                        if vehicle_type and immat:
-                            vehicle = {
-                                'type': vehicle_type,
-                                'immatriculation': immat,
-                                'cucar': '',
-                                'status': 'IMMO',
-                                'category': 'immo'
-                            }
-                            categories['immo'].append(vehicle)
-                            stats['total'] += 1
-                            stats['by_type'][vehicle_type] = stats['by_type'].get(vehicle_type, 0) + 1
-                            stats['by_category']['immo'] = stats['by_category'].get('immo', 0) + 1
-
-                    # Chauffeur vehicles (columns D-F)
-                    if len(row) >= 6 and row[3] and row[4]:
-                        vehicle = {
-                            'type': str(row[3]),
-                            'immatriculation': str(row[4]),
-                            'status': str(row[5]) if len(row) > 5 else '',
-                            'category': 'chauffeur'
-                        }
-                        categories['chauffeur'].append(vehicle)
-                        stats['total'] += 1
-                        stats['by_type'][vehicle['type']] = stats['by_type'].get(vehicle['type'], 0) + 1
-                        stats['by_category']['chauffeur'] = stats['by_category'].get('chauffeur', 0) + 1
-                        if vehicle['status']:
-                            stats['by_status'][vehicle['status']] = stats['by_status'].get(vehicle['status'], 0) + 1
-
-                    # Transco vehicles (columns G-I)
-                    if len(row) >= 9 and row[6] and row[7]:
-                        vehicle = {
-                            'type': str(row[6]),
-                            'immatriculation': str(row[7]),
-                            'status': str(row[8]) if len(row) > 8 else '',
-                            'category': 'transco'
-                        }
-                        categories['transco'].append(vehicle)
-                        stats['total'] += 1
-                        stats['by_type'][vehicle['type']] = stats['by_type'].get(vehicle['type'], 0) + 1
-                        stats['by_category']['transco'] = stats['by_category'].get('transco', 0) + 1
-                        if vehicle['status']:
-                            stats['by_status'][vehicle['status']] = stats['by_status'].get(vehicle['status'], 0) + 1
-
-                    # Gestionnaire vehicles (columns T-V)
-                    if len(row) >= 22 and row[19]:
-                        vehicle = {
-                            'type': str(row[19]),
-                            'immatriculation': str(row[20]) if len(row) > 20 else '',
-                            'status': 'Gestionnaire',
-                            'category': 'gestionnaire'
-                        }
-                        categories['gestionnaire'].append(vehicle)
-                        stats['total'] += 1
-                        stats['by_type'][vehicle['type']] = stats['by_type'].get(vehicle['type'], 0) + 1
-                        stats['by_category']['gestionnaire'] = stats['by_category'].get('gestionnaire', 0) + 1
-
-                    # Gratuit vehicles (columns W-Y)
-                    if len(row) >= 25 and row[22]:
-                        vehicle = {
-                            'type': str(row[22]),
-                            'immatriculation': str(row[23]) if len(row) > 23 else '',
-                            'status': 'Gratuit',
-                            'category': 'gratuit'
-                        }
-                        categories['gratuit'].append(vehicle)
-                        stats['total'] += 1
-                        stats['by_type'][vehicle['type']] = stats['by_type'].get(vehicle['type'], 0) + 1
-                        stats['by_category']['gratuit'] = stats['by_category'].get('gratuit', 0) + 1
-
-                except Exception as row_error:
-                    logger.error(f"Error processing row {row}: {str(row_error)}")
-                    continue
-
-            # Add debug logging
-            logger.debug("Disponible MC vehicles:")
-            for vehicle in categories['disponible_mc']:
-                logger.debug(f"  {vehicle}")
-
-            return jsonify({
-                'categories': categories,
-                'stats': stats,
-                'success': True
-            })
+            return jsonify(current_fleet.build_payload('vehicles', values))
 
         except Exception as e:
             logger.error(f"Error getting vehicle data: {str(e)}")
@@ -493,59 +686,465 @@ def get_vehicles():
         logger.error(traceback.format_exc())
         return jsonify({'error': str(e)})
 
-@app.route('/point_fs')
+SEARCH_MAX_LIMIT = 500
+
+@bp.route('/api/vehicles/search')
+def search_vehicles():
+    """A page of the inventory: ?category=&type=&status=&agency=&plate=&immatriculation=&sort=-type&limit=&cursor=
+
+    type, status, category and agency take comma-separated values, plate is a
+    prefix, sort a field name prefixed with '-' for descending order.
+    """
+    snapshot = current_fleet.sync_worker.current
+    if snapshot is None:
+        return jsonify({'error': 'Vehicle data is not loaded yet'}), 503
+
+    args = request.args
+    sort = args.get('sort', 'immatriculation')
+    descending = sort.startswith('-')
+    sort = sort.lstrip('-')
+    if sort not in SORT_FIELDS:
+        return jsonify({'error': f"Invalid sort, expected one of {', '.join(SORT_FIELDS)}"}), 400
+    limit = min(max(args.get('limit', 50, type=int), 1), SEARCH_MAX_LIMIT)
+
+    after = None
+    if args.get('cursor'):
+        try:
+            cursor_sort, cursor_descending, after = decode_cursor(args['cursor'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if (cursor_sort, cursor_descending) != (sort, descending):
+            return jsonify({'error': 'cursor was issued for another sort order'}), 400
+
+    def values(name):
+        value = args.get(name)
+        return value.split(',') if value is not None else None
+
+    vehicles, total, last = current_fleet.get_vehicle_index(snapshot).search(
+        sort=sort,
+        descending=descending,
+        limit=limit,
+        after=after,
+        immatriculation=args.get('immatriculation'),
+        plate_prefix=args.get('plate'),
+        type=values('type'),
+        status=values('status'),
+        category=values('category'),
+        agency=values('agency')
+    )
+    response = jsonify({
+        'vehicles': vehicles,
+        'total': total,
+        'next_cursor': encode_cursor(sort, descending, last) if last is not None else None,
+        'version': snapshot.version
+    })
+    response.headers['X-Data-Version'] = str(snapshot.version)
+    return response
+
+EXPORT_FORMATS = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+def export_chunks(vehicles, columns, export_format):
+    """Encoded export rows, in chunks of about EXPORT_CHUNK_SIZE bytes"""
+    buffer = io.StringIO()
+    if export_format == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+    for vehicle in vehicles:
+        values = [getattr(vehicle, column) for column in columns]
+        if export_format == 'csv':
+            writer.writerow(['' if value is None else value for value in values])
+        else:
+            buffer.write(json.dumps(dict(zip(columns, values)), ensure_ascii=False))
+            buffer.write('\n')
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@bp.route('/api/vehicles/export')
+def export_vehicles():
+    """The whole inventory, streamed: ?format=csv|ndjson&columns=type,immatriculation&category=&agency=&sort=type
+
+    Rows are written from the snapshot as the client reads them, so memory
+    stays flat whatever the fleet size, and the export is consistent even if
+    a sync publishes a new version meanwhile.  category and agency take
+    comma-separated values; sort=type orders each category by type.
+    """
+    snapshot = current_fleet.sync_worker.current
+    if snapshot is None:
+        return jsonify({'error': 'Vehicle data is not loaded yet'}), 503
+    payload = snapshot.payloads['vehicles']
+    if 'categories' not in payload:
+        return jsonify({'error': payload.get('error', 'No vehicle data')}), 503
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"Invalid format, expected one of {', '.join(EXPORT_FORMATS)}"}), 400
+
+    if request.args.get('columns'):
+        columns = request.args['columns'].split(',')
+        unknown = [column for column in columns if column not in VehicleRecord._fields]
+        if unknown:
+            return jsonify({'error': f"Unknown columns {', '.join(unknown)}, "
+                                     f"expected some of {', '.join(VehicleRecord._fields)}"}), 400
+    else:
+        columns = [column for column in VehicleRecord._fields
+                   if column != 'agency' or 'agencies' in payload['stats']]
+
+    sort = request.args.get('sort')
+    if sort not in (None, 'type'):
+        return jsonify({'error': "Invalid sort, expected 'type'"}), 400
+
+    def wanted(name):
+        value = request.args.get(name)
+        return {item.lower() for item in value.split(',')} if value else None
+
+    categories = wanted('category')
+    agencies = wanted('agency')
+    by_category = payload['categories']
+    if sort == 'type':
+        by_category = current_fleet.sorted_by_type(by_category)
+    vehicles = (
+        vehicle
+        for category, category_vehicles in by_category.items()
+        if categories is None or category.lower() in categories
+        for vehicle in category_vehicles
+        if agencies is None or (vehicle.agency or '').lower() in agencies
+    )
+
+    chunks = export_chunks(vehicles, columns, export_format)
+    headers = {
+        'Content-Disposition': f'attachment; filename="vehicles-v{snapshot.version}.{export_format}"',
+        'X-Data-Version': str(snapshot.version),
+        'Vary': 'Accept-Encoding'
+    }
+    if request.accept_encodings['gzip']:
+        # Compressé au fil de l'eau : pas de Content-Length, la réponse part en chunked
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(chunks, mimetype=EXPORT_FORMATS[export_format], headers=headers)
+
+def count_status_change(by_status, old, new):
+    """A copy of ``by_status`` with one vehicle moved from status ``old`` to ``new`` (blank ones are not counted)"""
+    by_status = dict(by_status)
+    if old:
+        by_status[old] = by_status.get(old, 0) - 1
+        if by_status[old] <= 0:
+            del by_status[old]
+    if new:
+        by_status[new] = by_status.get(new, 0) + 1
+    return by_status
+
+def with_vehicle_status(payload, vehicle, status):
+    """A copy of the vehicles payload with ``vehicle`` replaced by one in status ``status``.
+
+    Only the dicts and the list on the way to the vehicle are copied: the
+    published payload, and the inventories kept for ?since=, are untouched.
+    """
+    updated = VehicleRecord(vehicle.type, vehicle.immatriculation, status, vehicle.category,
+                            cucar=vehicle.cucar, agency=vehicle.agency)
+    categories = dict(payload['categories'])
+    categories[vehicle.category] = [
+        updated if item is vehicle else item for item in categories[vehicle.category]
+    ]
+    stats = dict(payload['stats'])
+    stats['by_status'] = count_status_change(stats['by_status'], vehicle.status, status)
+    if vehicle.agency is not None and 'agencies' in stats:
+        agencies = stats['agencies'] = dict(stats['agencies'])
+        agency_stats = agencies[vehicle.agency] = dict(agencies[vehicle.agency])
+        agency_stats['by_status'] = count_status_change(agency_stats['by_status'], vehicle.status, status)
+    return dict(payload, categories=categories, stats=stats)
+
+# Statut saisi depuis l'API : court, et jamais pris pour une formule par le tableur ou un export
+STATUS_MAX_LENGTH = 40
+STATUS_FORBIDDEN_PREFIXES = ('=', '+', '-', '@')
+
+@bp.route('/api/vehicles/<immatriculation>', methods=['PATCH'])
+@login_required
+def update_vehicle_status(immatriculation):
+    """Change a vehicle's status: {"status": "MC", "category": "flotte", "agency": "paris"}
+
+    The new status is served right away and queued for the spreadsheet;
+    edits of the same cell before the next flush are coalesced, and a flush
+    is one values().batchUpdate per spreadsheet (see src/writeback.py).
+    category and agency are only needed when the plate is in several
+    sections or agencies.  If the write fails for good, the sheet is read
+    again and the previous status comes back.  Needs an edit token (see
+    src/auth.py).
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('status'), str):
+        return jsonify({'error': "Expected a JSON object with a 'status' string"}), 400
+    status = data['status'].strip()
+    if len(status) > STATUS_MAX_LENGTH:
+        return jsonify({'error': f"The status is limited to {STATUS_MAX_LENGTH} characters"}), 400
+    if status.startswith(STATUS_FORBIDDEN_PREFIXES):
+        return jsonify({'error': f"The status cannot start with {' '.join(STATUS_FORBIDDEN_PREFIXES)}"}), 400
+    category = data.get('category')
+    agency = data.get('agency')
+    if not isinstance(category, (str, type(None))) or not isinstance(agency, (str, type(None))):
+        return jsonify({'error': "'category' and 'agency' must be strings"}), 400
+    plate = normalize_plate(immatriculation)
+
+    if current_fleet.sync_worker.current is None:
+        return jsonify({'error': 'Vehicle data is not loaded yet'}), 503
+
+    result = {}
+
+    def update(snapshot):
+        payload = snapshot.payloads['vehicles']
+        if 'categories' not in payload:
+            result['error'] = (503, payload.get('error', 'No vehicle data'))
+            return None
+        vehicles = current_fleet.find_editable_vehicles(snapshot, plate, category, agency)
+        editable = [vehicle for vehicle in vehicles if vehicle.category in current_fleet.vehicle_status_columns]
+        if not editable:
+            result['error'] = (409, 'The status of this vehicle is not a cell of the sheet') if vehicles else \
+                (404, 'Vehicle not found')
+            return None
+        if len(editable) > 1:
+            result['error'] = (409, 'Several vehicles have this plate, give their category and agency')
+            return None
+
+        vehicle = editable[0]
+        result['vehicle'] = vehicle
+        if vehicle.status == status:
+            return None
+        return {'vehicles': with_vehicle_status(payload, vehicle, status)}
+
+    snapshot = current_fleet.sync_worker.patch(update)
+    if 'error' in result:
+        code, message = result['error']
+        return jsonify({'error': message}), code
+    if snapshot is None or 'vehicle' not in result:
+        # Rien n'a été publié : on n'envoie pas l'édition au tableur
+        return jsonify({'error': 'The edit could not be saved, try again'}), 503
+
+    vehicle = result['vehicle']
+    pending = current_fleet.writeback_queue.enqueue((vehicle.agency, vehicle.category, plate), status)
+    logger.info(f"{current_user.id} set the status of {plate} ({vehicle.agency or ''} {vehicle.category}) to {status!r}")
+    response = jsonify({
+        'immatriculation': vehicle.immatriculation,
+        'category': vehicle.category,
+        'agency': vehicle.agency,
+        'status': status,
+        'pending': pending,
+        'version': snapshot.version
+    })
+    response.status_code = 202
+    response.headers['X-Data-Version'] = str(snapshot.version)
+    return response
+
+@bp.route('/point_fs')
 def point_fs():
     return render_template('point_fs.html')
 
-@app.route('/get_point_fs_data')
+@bp.route('/get_point_fs_data')
 def get_point_fs_data():
-    try:
-        service = get_google_sheets_service()
-        if not service:
-            logger.error("Failed to get Google Sheets service")
-            return jsonify({})
-
-        # Get all sheets to verify POINT FS exists
-        sheets_metadata = service.spreadsheets().get(spreadsheetId=SPREADSHEET_ID).execute()
-        sheet_titles = [sheet['properties']['title'] for sheet in sheets_metadata.get('sheets', [])]
-        logger.debug("Available sheets: {}".format(sheet_titles))
+    snapshot = current_fleet.sync_worker.current
+    if snapshot is not None:
+        return snapshot_response(snapshot, 'point_fs')
 
+    try:
         # Récupérer les données de la feuille POINT FS
-        range_name = "'POINT FS'!B2:D45"  
-        logger.debug("Fetching range: {}".format(range_name))
-        
-        result = service.spreadsheets().values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range=range_name
-        ).execute()
+        range_name = POINT_FS_DETAIL_RANGE
+        logger.debug("Fetching range: %s", range_name)
         
-        values = result.get('values', [])
+        values = current_fleet.fetch_range(range_name)
         
-        # Print detailed information about the data
-        logger.debug("\n=== DATA FROM GOOGLE SHEETS ===")
-        logger.debug("Total rows received: {}".format(len(values)))
+        logger.debug("Total rows received: %d", len(values))
         
-        # Filter out empty rows and process the data
-        processed_values = []
-        for i, row in enumerate(values):
-            logger.debug("Row {}: {}".format(i+2, row))  
-            if row and any(cell.strip() for cell in row if isinstance(cell, str)):  
-                processed_values.append(row)
-        
-        logger.debug("\nProcessed rows: {}".format(len(processed_values)))
-        logger.debug("Processed values:")
-        for row in processed_values:
-            logger.debug(row)
-        logger.debug("============================\n")
-
-        return jsonify({'data': processed_values})
+        return jsonify(current_fleet.build_payload('point_fs', values))
 
     except Exception as e:
         logger.error("Error fetching Point FS data: {}".format(str(e)))
         logger.error(traceback.format_exc())
         return jsonify({})
 
-@app.route('/test')
+def bootstrap_etag(snapshot):
+    # Dérivée des ETags des trois corps, sans hacher à nouveau la réponse
+    etags = ':'.join(snapshot.etags[name] for name in ('dashboard', 'point_fs', 'vehicles'))
+    return f"bootstrap-{body_etag(etags.encode('ascii'))}"
+
+def bootstrap_body(snapshot):
+    return b''.join([
+        b'{"dashboard":', snapshot.bodies['dashboard'],
+        b',"point_fs":', snapshot.bodies['point_fs'],
+        b',"vehicles":', snapshot.bodies['vehicles'],
+        b'}'
+    ])
+
+@bp.route('/api/bootstrap')
+def get_bootstrap_data():
+    """Everything the dashboard page needs, in a single response"""
+    snapshot = current_fleet.sync_worker.current
+    if snapshot is not None:
+        response = current_app.response_class(bootstrap_body(snapshot), mimetype='application/json')
+        response.set_etag(bootstrap_etag(snapshot))
+        response.headers['X-Data-Version'] = str(snapshot.version)
+        return response
+
+    try:
+        payloads = current_fleet.range_cache.get(
+            (current_fleet.settings['SPREADSHEET_ID'], 'bootstrap', None), current_fleet.build_snapshot_payloads)
+        return jsonify(payloads)
+    except Exception as e:
+        logger.error(f"Error in get_bootstrap_data: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': str(e)})
+
+@bp.route('/api/stream')
+def stream_updates():
+    """Server-Sent Events: one 'snapshot' event with the changed payloads after each sync that changed data
+
+    Each stream holds one of the worker's threads until it ends, so at most
+    STREAM_MAX_CLIENTS are open per worker; past that the stream is refused
+    with a 503 and the dashboard falls back to long-polling /api/updates.
+    Under src/asgi.py streams hold no thread and are not capped.
+    """
+    # Le générateur tourne après la fin du contexte de la requête
+    fleet = current_fleet._get_current_object()
+    if not fleet.stream_slots.acquire(blocking=False):
+        STREAMS_REFUSED.inc()
+        return Response(b'retry: 30000\n\n', status=503, mimetype='text/event-stream', headers={
+            'Retry-After': '30',
+            'Cache-Control': 'no-cache'
+        })
+    last_event_id = request.headers.get('Last-Event-ID', '')
+
+    def generate():
+        subscriber = fleet.broadcaster.subscribe()
+        try:
+            yield b'retry: 5000\n\n'
+            snapshot = fleet.sync_worker.current
+            if snapshot is not None:
+                # Un client qui se reconnecte après avoir manqué des versions reçoit l'état complet
+                if last_event_id.isdigit() and int(last_event_id) < snapshot.version:
+                    yield format_sse('snapshot', encode_payloads(snapshot, snapshot.bodies), snapshot.version)
+                else:
+                    yield format_sse('hello', b'{"version":%d}' % snapshot.version, snapshot.version)
+
+            deadline = time.monotonic() + fleet.settings['STREAM_MAX_DURATION']
+            while time.monotonic() < deadline:
+                try:
+                    version, event, data = subscriber.get(timeout=fleet.settings['STREAM_HEARTBEAT'])
+                except queue.Empty:
+                    yield b': keepalive\n\n'
+                    continue
+                yield format_sse(event, data, version)
+        finally:
+            fleet.broadcaster.unsubscribe(subscriber)
+
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Libéré quand le serveur ferme la réponse, même si le client part avant le premier octet
+    response.call_on_close(fleet.stream_slots.release)
+    return response
+
+def long_poll_timeout(value, maximum):
+    """Seconds a long-poll may wait: ?timeout= (25 by default), between 0 and ``maximum`` (LONG_POLL_MAX_TIMEOUT)"""
+    try:
+        timeout = float(value) if value is not None else 25.0
+    except ValueError:
+        timeout = 25.0
+    if math.isnan(timeout):
+        timeout = 25.0
+    return max(0.0, min(timeout, maximum))
+
+@bp.route('/api/updates')
+def poll_updates():
+    """Long-poll fallback for clients without EventSource: waits for a version newer than ?since=
+
+    A waiting long-poll holds a thread like a stream, so it takes one of the
+    same STREAM_MAX_CLIENTS slots; without a free slot it answers at once,
+    with the new payloads if there are some and a 204 plus Retry-After
+    otherwise.
+    """
+    since = request.args.get('since', 0, type=int)
+    timeout = long_poll_timeout(request.args.get('timeout'), current_fleet.settings['LONG_POLL_MAX_TIMEOUT'])
+
+    snapshot = current_fleet.sync_worker.current
+    if snapshot is None or snapshot.version <= since:
+        if not current_fleet.stream_slots.acquire(blocking=False):
+            STREAMS_REFUSED.inc()
+            return '', 204, {'Retry-After': str(max(1, math.ceil(current_fleet.settings['LONG_POLL_MAX_TIMEOUT'])))}
+        try:
+            current_fleet.broadcaster.wait_for_version(since, timeout)
+        finally:
+            current_fleet.stream_slots.release()
+        snapshot = current_fleet.sync_worker.current
+    if snapshot is None or snapshot.version <= since:
+        return '', 204
+    return current_app.response_class(encode_payloads(snapshot, snapshot.bodies), mimetype='application/json')
+
+def parse_history_time(value, default):
+    """Epoch seconds from an epoch number or an ISO 8601 date"""
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def parse_history_step(value, span):
+    """Step in seconds from '300', '5m', '1h' or '1d'; by default the finest rollup giving at most 500 points"""
+    if not value:
+        for step in ROLLUP_STEPS:
+            if span / step <= 500:
+                return step
+        return ROLLUP_STEPS[-1] * math.ceil(span / ROLLUP_STEPS[-1] / 500)
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if value[-1] in units:
+        step = int(value[:-1]) * units[value[-1]]
+    else:
+        step = int(value)
+    if step <= 0:
+        raise ValueError('step must be positive')
+    return step
+
+@bp.route('/api/history')
+def get_history():
+    """Time series of a Point FS figure: /api/history?metric=ca_jour&from=&to=&step=1h"""
+    if current_fleet.metric_history is None:
+        return jsonify({'error': 'History is disabled'}), 404
+
+    metric = request.args.get('metric')
+    if not metric:
+        return jsonify({'metrics': current_fleet.metric_history.metrics()})
+
+    try:
+        end = parse_history_time(request.args.get('to'), time.time())
+        start = parse_history_time(request.args.get('from'), end - 86400)
+        step = parse_history_step(request.args.get('step'), end - start)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid parameter: {str(e)}'}), 400
+    if end <= start:
+        return jsonify({'error': "'from' must be before 'to'"}), 400
+    if (end - start) / step > HISTORY_MAX_POINTS:
+        return jsonify({'error': f'Too many points, use a step of at least {math.ceil((end - start) / HISTORY_MAX_POINTS)}s'}), 400
+
+    try:
+        series = current_fleet.metric_history.query(metric, start, end, step)
+    except Exception as e:
+        logger.error(f"Error in get_history: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'metric': metric, 'from': int(start), 'to': int(end), 'step': step, **series})
+
+@bp.route('/test')
 def test_sheets():
     try:
         service = get_google_sheets_service()
@@ -554,40 +1153,98 @@ def test_sheets():
 
         # Try to get spreadsheet info
         try:
-            spreadsheet = service.spreadsheets().get(spreadsheetId=SPREADSHEET_ID).execute()
+            spreadsheet = service_manager.execute(
+                lambda service: service.spreadsheets().get(spreadsheetId=current_fleet.settings['SPREADSHEET_ID']))
             sheets = spreadsheet.get('sheets', [])
             sheet_names = [sheet['properties']['title'] for sheet in sheets]
             
             # Try to read data from VÉHICULE sheet
-            result = service.spreadsheets().values().get(
-                spreadsheetId=SPREADSHEET_ID,
+            result = service_manager.execute(lambda service: service.spreadsheets().values().get(
+                spreadsheetId=current_fleet.settings['SPREADSHEET_ID'],
                 range="'VÉHICULE'!A1:D5",  
                 valueRenderOption='FORMATTED_VALUE'
-            ).execute()
+            ))
             
             return jsonify({
                 'spreadsheet_title': spreadsheet.get('properties', {}).get('title'),
                 'sheet_names': sheet_names,
                 'data': result.get('values', []),
-                'spreadsheet_id': SPREADSHEET_ID
+                'spreadsheet_id': current_fleet.settings['SPREADSHEET_ID']
             })
             
         except Exception as e:
             return jsonify({
                 'error': str(e),
-                'spreadsheet_id': SPREADSHEET_ID,
+                'spreadsheet_id': current_fleet.settings['SPREADSHEET_ID'],
                 'service_account': 'acc-s-feuille-de-calcul@centering-valve-448613-e3.iam.gserviceaccount.com'
             })
 
     except Exception as e:
         return jsonify({'error': str(e)})
 
-@app.route('/favicon.ico')
+@bp.route('/api/cache-stats')
+def cache_stats():
+    return jsonify(current_fleet.range_cache.stats())
+
+@bp.route('/api/sync-status')
+def sync_status():
+    status = current_fleet.sync_worker.status()
+    status['upstream'] = current_fleet.sheet_source.status()
+    status['writeback'] = current_fleet.writeback_queue.status()
+    return jsonify(status)
+
+@bp.route('/metrics')
+def metrics():
+    """Prometheus text exposition of the metrics of every worker"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/favicon.ico')
 def favicon():
-    return send_from_directory(os.path.join(app.root_path, 'static'),
+    return send_from_directory(os.path.join(current_app.root_path, 'static'),
                              'favicon.ico', mimetype='image/vnd.microsoft.icon')
 
+def create_app(config=None):
+    """Build the Flask app with its sheet source, caches and sync worker.
+
+    Settings come from the environment and .env (see src/settings.py);
+    ``config``, a mapping or an object with upper-case attributes, overrides
+    them, including the sheet source, upstream limits and logging.  Logging
+    is set up here rather than on import, and the Google client is only
+    imported when the first sheet is read, so importing this module stays
+    cheap and gunicorn --preload forks a small master.  The worker threads
+    still start on each worker's first request.
+
+    The services are a Fleet kept in ``app.extensions['fleet']``, so every
+    call builds an app of its own; logging, the Google client and the
+    metrics registry are shared by the process.
+    """
+    app = Flask(__name__, static_folder='static', template_folder='templates')
+    app.json = FleetJSONProvider(app)
+    app.config.from_mapping(load_settings())
+    if isinstance(config, dict):
+        app.config.from_mapping(config)
+    elif config is not None:
+        app.config.from_object(config)
+    settings = app.config
+
+    if settings['CONFIGURE_LOGGING']:
+        # Set up logging (queue-based, see src/logging_setup.py)
+        configure_logging(settings)
+    logger.debug("Using Spreadsheet ID: %s", settings['SPREADSHEET_ID'])
+
+    REGISTRY.configure(settings['METRICS_DIR'], flush_interval=settings['METRICS_FLUSH_INTERVAL'])
+    service_manager.refresh_margin = timedelta(seconds=settings['SHEETS_TOKEN_REFRESH_MARGIN'])
+
+    fleet = Fleet(settings, app.json)
+    fleet.register_metrics()
+    app.extensions['fleet'] = fleet
+
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+    return app
+
 if __name__ == '__main__':
+    app = create_app()
     # Test connection on startup
     service = get_google_sheets_service()
     if not service:
@@ -0,0 +1,279 @@
+"""ASGI serving mode: the dashboard routes on one event loop per worker.
+
+    uvicorn src.asgi:app --workers 2
+    gunicorn src.asgi:app -k uvicorn.workers.UvicornWorker -w 2
+
+The snapshot routes (/api/dashboard-data, /api/vehicles, /get_point_fs_data,
+/api/bootstrap) and the push routes (/api/stream, /api/updates) are answered
+on the event loop straight from the in-memory snapshot, so hundreds of
+in-flight requests and open streams cost no thread each.  Every other route
+goes to the Flask app through asgiref's WSGI adapter, which runs it in a
+thread pool.  Before the first snapshot exists, concurrent requests all
+await a single refresh, whose range reads run side by side (see
+batch_get_values in src/sheets.py).
+
+Needs the ``asgiref`` and ``uvicorn`` packages: pip install -r requirements-asgi.txt
+"""
+import asyncio
+import logging
+import time
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.http import parse_accept_header, parse_etags
+
+from src.app import (
+    REGISTRY,
+    REQUEST_SECONDS,
+    RESPONSE_BYTES,
+    bootstrap_body,
+    bootstrap_etag,
+    brotli,
+    compress_body,
+    create_app,
+    encode_payloads,
+    long_poll_timeout
+)
+from src.events import format_sse
+
+logger = logging.getLogger(__name__)
+
+# Routes served from the snapshot: path -> payload name
+SNAPSHOT_ROUTES = {
+    '/api/dashboard-data': 'dashboard',
+    '/api/vehicles': 'vehicles',
+    '/get_point_fs_data': 'point_fs'
+}
+
+
+class Request:
+    """The parts of an ASGI HTTP scope the native routes need"""
+
+    def __init__(self, scope, receive):
+        self.receive = receive
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = {key: values[0] for key, values in parse_qs(scope['query_string'].decode('latin-1')).items()}
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+
+
+async def send_response(send, status, body=b'', headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def choose_encoding(request, body, min_size):
+    if len(body) < min_size:
+        return None
+    accepted = parse_accept_header(request.headers.get('accept-encoding'))
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+async def send_json_body(send, request, body, etag, version, min_size):
+    """Same validators and compression as the Flask after_request hook"""
+    encoding = choose_encoding(request, body, min_size)
+    if encoding:
+        etag = f"{etag}-{encoding}"
+    headers = [
+        ('content-type', 'application/json'),
+        ('etag', f'"{etag}"'),
+        ('x-data-version', str(version)),
+        ('vary', 'Accept-Encoding')
+    ]
+    if parse_etags(request.headers.get('if-none-match')).contains(etag):
+        await send_response(send, 304, headers=headers)
+        return 304, 0
+    if encoding:
+        body = compress_body(body, encoding)
+        headers.append(('content-encoding', encoding))
+    headers.append(('content-length', str(len(body))))
+    await send_response(send, 200, body, headers)
+    return 200, len(body)
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+class FleetASGIApp:
+    def __init__(self, wsgi_app):
+        self.wsgi = WsgiToAsgi(wsgi_app)
+        # Les services de l'app Flask (voir Fleet dans src/app.py), partagés avec les routes WSGI
+        self.fleet = wsgi_app.extensions['fleet']
+        self.settings = wsgi_app.config
+        self._loading = None
+        self._started = False
+
+    def _start_background(self):
+        if self._started:
+            return
+        self._started = True
+        self.fleet.start()
+        REGISTRY.start()
+
+    async def current_snapshot(self):
+        """The published snapshot, refreshing once (shared by concurrent callers) if there is none"""
+        snapshot = self.fleet.sync_worker.current
+        if snapshot is not None:
+            return snapshot
+        if self._loading is None or self._loading.done():
+            self._loading = asyncio.ensure_future(asyncio.to_thread(self.fleet.sync_worker.refresh))
+        try:
+            await asyncio.shield(self._loading)
+        except Exception as e:
+            logger.error(f"Error loading the first snapshot: {str(e)}")
+        return self.fleet.sync_worker.current
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        self._start_background()
+        if scope['type'] != 'http' or scope['method'] != 'GET':
+            await self.wsgi(scope, receive, send)
+            return
+
+        request = Request(scope, receive)
+        handler = self.native_handler(request)
+        if handler is None:
+            await self.wsgi(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        result = await handler(request, send)
+        if result is None:
+            # Pas de snapshot : la route Flask gère le repli et les erreurs
+            await self.wsgi(scope, receive, send)
+            return
+        status, size = result
+        REQUEST_SECONDS.labels(request.path, 'GET', status).observe(time.perf_counter() - started)
+        if size:
+            RESPONSE_BYTES.labels(request.path).observe(size)
+
+    def native_handler(self, request):
+        if request.path in SNAPSHOT_ROUTES and 'since' not in request.args:
+            return self.snapshot_payload
+        return {
+            '/api/bootstrap': self.bootstrap,
+            '/api/stream': self.stream,
+            '/api/updates': self.updates
+        }.get(request.path)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._start_background()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.fleet.sync_worker.stop()
+                # Dernière écriture des statuts en attente, hors de la boucle d'événements
+                await asyncio.to_thread(self.fleet.writeback_queue.stop)
+                REGISTRY.flush()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def snapshot_payload(self, request, send):
+        snapshot = await self.current_snapshot()
+        if snapshot is None:
+            return None
+        name = SNAPSHOT_ROUTES[request.path]
+        return await send_json_body(
+            send, request, snapshot.bodies[name],
+            f"{name}-{snapshot.etags[name]}", snapshot.version, self.settings['COMPRESSION_MIN_SIZE']
+        )
+
+    async def bootstrap(self, request, send):
+        snapshot = await self.current_snapshot()
+        if snapshot is None:
+            return None
+        return await send_json_body(
+            send, request, bootstrap_body(snapshot), bootstrap_etag(snapshot), snapshot.version,
+            self.settings['COMPRESSION_MIN_SIZE']
+        )
+
+    async def stream(self, request, send):
+        """Server-Sent Events, as /api/stream in src/app.py, without holding a thread"""
+        subscriber = self.fleet.broadcaster.subscribe_async(asyncio.get_running_loop())
+        disconnected = asyncio.ensure_future(wait_for_disconnect(request.receive))
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream; charset=utf-8'),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no')
+                ]
+            })
+
+            async def emit(chunk):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+            await emit(b'retry: 5000\n\n')
+            last_event_id = request.headers.get('last-event-id', '')
+            snapshot = self.fleet.sync_worker.current
+            if snapshot is not None:
+                if last_event_id.isdigit() and int(last_event_id) < snapshot.version:
+                    await emit(format_sse('snapshot', encode_payloads(snapshot, snapshot.bodies), snapshot.version))
+                else:
+                    await emit(format_sse('hello', b'{"version":%d}' % snapshot.version, snapshot.version))
+
+            deadline = time.monotonic() + self.settings['STREAM_MAX_DURATION']
+            while time.monotonic() < deadline and not disconnected.done():
+                try:
+                    version, event, data = await subscriber.get(self.settings['STREAM_HEARTBEAT'])
+                except asyncio.TimeoutError:
+                    await emit(b': keepalive\n\n')
+                    continue
+                await emit(format_sse(event, data, version))
+            await send({'type': 'http.response.body', 'body': b''})
+        except OSError:
+            # Client parti pendant l'envoi
+            pass
+        finally:
+            disconnected.cancel()
+            self.fleet.broadcaster.unsubscribe(subscriber)
+        return 200, 0
+
+    async def updates(self, request, send):
+        """Long-poll, as /api/updates in src/app.py"""
+        try:
+            since = int(request.args.get('since', 0))
+        except ValueError:
+            since = 0
+        timeout = long_poll_timeout(request.args.get('timeout'), self.settings['LONG_POLL_MAX_TIMEOUT'])
+
+        subscriber = self.fleet.broadcaster.subscribe_async(asyncio.get_running_loop())
+        try:
+            snapshot = self.fleet.sync_worker.current
+            if snapshot is None or snapshot.version <= since:
+                try:
+                    await subscriber.get(timeout)
+                except asyncio.TimeoutError:
+                    pass
+                snapshot = self.fleet.sync_worker.current
+        finally:
+            self.fleet.broadcaster.unsubscribe(subscriber)
+
+        if snapshot is None or snapshot.version <= since:
+            await send_response(send, 204)
+            return 204, 0
+        body = encode_payloads(snapshot, snapshot.bodies)
+        await send_response(send, 200, body, [
+            ('content-type', 'application/json'),
+            ('content-length', str(len(body)))
+        ])
+        return 200, len(body)
+
+
+app = FleetASGIApp(create_app())
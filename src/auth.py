@@ -0,0 +1,51 @@
+"""Who may edit the fleet through the API.
+
+Edits (PATCH /api/vehicles/<immatriculation>) end up in the spreadsheet, so
+they need one of the tokens of EDIT_TOKENS, sent as
+``Authorization: Bearer <token>``.  Flask-Login loads the editor from that
+header on every request and no session cookie is involved, so a page on
+another site cannot have a browser send an edit on its user's behalf.
+With EDIT_TOKENS empty, editing is disabled.
+"""
+import hmac
+
+from flask import current_app, jsonify
+from flask_login import LoginManager, UserMixin
+
+login_manager = LoginManager()
+
+
+class Editor(UserMixin):
+    """An API client allowed to edit, named after its entry in EDIT_TOKENS"""
+
+    def __init__(self, name):
+        self.id = name
+
+
+def parse_edit_tokens(spec):
+    """'ops=s3cr3t,lyon=t0k3n' -> {'ops': 's3cr3t', 'lyon': 't0k3n'}; a token without a name is named by position"""
+    tokens = {}
+    for position, item in enumerate(spec.split(','), start=1):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, token = item.rpartition('=')
+        tokens[name.strip() or f"editor-{position}"] = token.strip()
+    return tokens
+
+
+@login_manager.request_loader
+def load_editor(request):
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    token = token.strip().encode('utf-8')
+    for name, known in parse_edit_tokens(current_app.config['EDIT_TOKENS']).items():
+        if known and hmac.compare_digest(token, known.encode('utf-8')):
+            return Editor(name)
+    return None
+
+
+@login_manager.unauthorized_handler
+def unauthorized():
+    return jsonify({'error': 'Editing requires an edit token (Authorization: Bearer <token>)'}), 401
@@ -0,0 +1,119 @@
+import logging
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """A single in-progress load that concurrent callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class RangeCache:
+    """Keyed TTL cache with stale-while-revalidate and single-flight loads.
+
+    Entries younger than ``ttl`` seconds are served as-is.  Entries older than
+    that but younger than ``ttl + stale_ttl`` are still served immediately,
+    while a background thread reloads them.  Anything older is a miss: the
+    first caller runs the loader and every concurrent caller for the same key
+    waits for that one result instead of hitting the upstream API itself.
+    If that load fails and an expired entry is still around, the expired
+    value is served rather than the error.
+    """
+
+    def __init__(self, ttl=60, stale_ttl=300):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._flights = {}
+        self._counters = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'refreshes': 0,
+            'errors': 0,
+            'stale_on_error': 0
+        }
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, loaded_at = entry
+                age = now - loaded_at
+                if age < self.ttl:
+                    self._counters['hits'] += 1
+                    return value
+                if age < self.ttl + self.stale_ttl:
+                    self._counters['stale_hits'] += 1
+                    if key not in self._flights:
+                        self._flights[key] = _Flight()
+                        threading.Thread(
+                            target=self._load, args=(key, loader, self._flights[key]), daemon=True
+                        ).start()
+                    return value
+
+            self._counters['misses'] += 1
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._counters['coalesced'] += 1
+                leader = False
+            else:
+                flight = self._flights[key] = _Flight()
+                leader = True
+
+        if leader:
+            self._load(key, loader, flight)
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            if entry is not None:
+                with self._lock:
+                    self._counters['stale_on_error'] += 1
+                return entry[0]
+            raise flight.error
+        return flight.value
+
+    def _load(self, key, loader, flight):
+        try:
+            flight.value = loader()
+            with self._lock:
+                self._entries[key] = (flight.value, time.monotonic())
+                self._counters['refreshes'] += 1
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self._counters['errors'] += 1
+            logger.error(f"Error loading cache entry {key}: {str(e)}")
+            logger.debug(traceback.format_exc())
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_ratio'] = round((stats['hits'] + stats['stale_hits']) / lookups, 4) if lookups else 0.0
+        stats['ttl'] = self.ttl
+        stats['stale_ttl'] = self.stale_ttl
+        return stats
@@ -0,0 +1,31 @@
+def vehicle_keys(categories):
+    """Map a stable key to each vehicle of a parsed inventory.
+
+    A vehicle is identified by its category and plate.  Sections such as
+    'gestionnaire' may leave the plate empty, and the same plate can appear
+    twice in a category, so the key also carries the occurrence number of
+    that (category, plate-or-type) pair.
+    """
+    keyed = {}
+    for category, vehicles in categories.items():
+        seen = {}
+        for vehicle in vehicles:
+            ident = vehicle.immatriculation or vehicle.type
+            occurrence = seen.get(ident, 0)
+            seen[ident] = occurrence + 1
+            keyed[(category, ident, occurrence)] = vehicle
+    return keyed
+
+
+def diff_vehicles(old_categories, new_categories):
+    """Return (added, removed, changed) vehicles between two parsed inventories.
+
+    ``removed`` holds the old records, ``changed`` the new ones.
+    """
+    old = vehicle_keys(old_categories)
+    new = vehicle_keys(new_categories)
+
+    added = [vehicle for key, vehicle in new.items() if key not in old]
+    removed = [vehicle for key, vehicle in old.items() if key not in new]
+    changed = [vehicle for key, vehicle in new.items() if key in old and old[key] != vehicle]
+    return added, removed, changed
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotBroadcaster:
+    """Fans snapshot change events out to every connected dashboard.
+
+    Each Server-Sent Events client gets its own bounded queue.  A client too
+    slow to drain its queue is not allowed to hold back the others: its
+    pending events are dropped and replaced by a single ``resync`` event
+    telling it to reload everything.  Long-poll clients wait on a condition
+    for the version to move past the one they already have.
+    """
+
+    def __init__(self, max_pending=16):
+        self.max_pending = max_pending
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self.version = 0
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.max_pending)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def subscribe_async(self, loop):
+        """A subscriber for a client served on ``loop`` (see src/asgi.py)"""
+        subscriber = AsyncSubscriber(loop, self.max_pending)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish(self, version, event, data):
+        """Send ``data`` (already encoded JSON bytes) as ``event`` to every subscriber."""
+        with self._lock:
+            self.version = version
+            subscribers = list(self._subscribers)
+            self._changed.notify_all()
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((version, event, data))
+            except queue.Full:
+                self._resync(subscriber, version)
+        logger.debug("Broadcast %s v%d to %d clients", event, version, len(subscribers))
+
+    def _resync(self, subscriber, version):
+        while True:
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                break
+        subscriber.put_nowait((version, 'resync', b'{"version":%d}' % version))
+
+    def wait_for_version(self, since, timeout):
+        """Block until a version newer than ``since`` is published; True if one was."""
+        with self._changed:
+            return self._changed.wait_for(lambda: self.version > since, timeout=timeout)
+
+
+class AsyncSubscriber:
+    """A subscriber queue on an asyncio event loop, fed from the publishing thread.
+
+    Events are handed to the loop with call_soon_threadsafe; overflow is
+    handled there, with the same resync event as the thread queues.
+    """
+
+    def __init__(self, loop, max_pending):
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=max_pending)
+
+    def put_nowait(self, item):
+        try:
+            self._loop.call_soon_threadsafe(self._put, item)
+        except RuntimeError:
+            # Boucle arrêtée : le client est parti avec elle
+            pass
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            version = item[0]
+            self._queue.put_nowait((version, 'resync', b'{"version":%d}' % version))
+
+    async def get(self, timeout):
+        """The next ``(version, event, data)``; raises asyncio.TimeoutError after ``timeout`` seconds"""
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+
+def format_sse(event, data, event_id=None):
+    message = b''
+    if event_id is not None:
+        message += b'id: %d\n' % event_id
+    message += b'event: ' + event.encode('utf-8') + b'\n'
+    return message + b'data: ' + data + b'\n\n'
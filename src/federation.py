@@ -0,0 +1,158 @@
+"""Several agencies' spreadsheets, read side by side and merged.
+
+Every agency keeps its own spreadsheet with the same VÉHICULE / Point FS
+layout.  FederatedSheetSource reads a range from all of them at once and
+returns ``{agency: rows}`` where a single source returns rows; the payload
+builders are wrapped with federate() so each agency's rows go through the
+usual parser before the results are merged.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.sources import SheetSource
+
+logger = logging.getLogger(__name__)
+
+
+def parse_agencies(spec):
+    """'paris=1Oiv...,lyon=1Abc...' -> {'paris': '1Oiv...', 'lyon': '1Abc...'}, in order.
+
+    An entry without a name is named after its spreadsheet id.
+    """
+    agencies = {}
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, spreadsheet_id = item.rpartition('=')
+        spreadsheet_id = spreadsheet_id.strip()
+        agencies[name.strip() or spreadsheet_id] = spreadsheet_id
+    return agencies
+
+
+def sum_figures(figures):
+    """Key-by-key sum of dicts of numbers, recursively; lists are merged without duplicates"""
+    total = {}
+    for item in figures:
+        for key, value in item.items():
+            if isinstance(value, dict):
+                total[key] = sum_figures([total.get(key, {}), value])
+            elif isinstance(value, list):
+                merged = total.setdefault(key, [])
+                merged.extend(entry for entry in value if entry not in merged)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                total[key] = total.get(key, 0) + value
+            else:
+                total.setdefault(key, value)
+    return total
+
+
+def federate(build, merge, with_agency=False):
+    """A builder taking ``{agency: rows}``: ``build`` for each agency, then ``merge({agency: payload})``.
+
+    With ``with_agency`` the agency is passed on, as ``build(values, agency)``.
+    """
+
+    def build_federated(values_by_agency):
+        if with_agency:
+            return merge({agency: build(values, agency) for agency, values in values_by_agency.items()})
+        return merge({agency: build(values) for agency, values in values_by_agency.items()})
+
+    build_federated.__name__ = f"federated_{build.__name__}"
+    return build_federated
+
+
+class FederatedSheetSource(SheetSource):
+    """One guarded source per agency (see src/upstream.py), read concurrently on a bounded pool.
+
+    A refresh therefore takes about as long as the slowest spreadsheet, not
+    the sum of all of them.  When an agency's read fails, the last rows read
+    from it are used (and counted as ``stale_reads``) so one broken sheet
+    does not hold back the others; the error is raised only when there is
+    nothing to fall back on.  The revision combines the agencies' revisions
+    and is None as soon as one of them is unknown.
+    """
+
+    name = 'federated'
+
+    def __init__(self, sources, max_workers=8):
+        self.sources = sources
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(1, min(max_workers, len(sources))), thread_name_prefix='fleet-fanout')
+        self._lock = threading.Lock()
+        self._last_good = {}
+        self.stale_reads = 0
+
+    def _fan_out(self, operation, key, call):
+        futures = {agency: self._pool.submit(call, source) for agency, source in self.sources.items()}
+        results = {}
+        for agency, future in futures.items():
+            try:
+                results[agency] = future.result()
+            except Exception as e:
+                with self._lock:
+                    if (agency, key) not in self._last_good:
+                        raise
+                    self.stale_reads += 1
+                    results[agency] = self._last_good[(agency, key)]
+                logger.warning(f"Sheets {operation} failed for agency {agency} ({str(e)}), using its last rows")
+                continue
+            with self._lock:
+                self._last_good[(agency, key)] = results[agency]
+        return results
+
+    def batch_get(self, ranges):
+        by_agency = self._fan_out('batch_get', tuple(ranges), lambda source: source.batch_get(ranges))
+        return [{agency: rows[index] for agency, rows in by_agency.items()} for index in range(len(ranges))]
+
+    def get(self, range_name, value_render_option=None):
+        return self._fan_out('get', (range_name, value_render_option),
+                             lambda source: source.get(range_name, value_render_option))
+
+    def write_cells(self, range_name, cells):
+        """Set cells of several agencies' spreadsheets: ``{agency: {(row, column): value}}``, as get() returns rows.
+
+        One call per agency, made in the calling thread rather than on the
+        pool, which is already shut down when the write-back queue flushes at
+        exit.  Every agency is written before the first error is raised; the
+        caller then retries the whole batch, and writing the same values
+        again is harmless.
+        """
+        unknown = set(cells) - set(self.sources)
+        if unknown:
+            raise KeyError(f"No spreadsheet for agencies {', '.join(sorted(unknown))}")
+        written = 0
+        error = None
+        for agency, agency_cells in cells.items():
+            try:
+                written += self.sources[agency].write_cells(range_name, agency_cells)
+            except Exception as e:
+                logger.error(f"Sheets write failed for agency {agency}: {str(e)}")
+                error = error or e
+        if error is not None:
+            raise error
+        return written
+
+    def revision(self):
+        futures = {agency: self._pool.submit(source.revision) for agency, source in self.sources.items()}
+        revisions = []
+        for agency, future in futures.items():
+            revision = future.result()
+            if revision is None:
+                return None
+            revisions.append(f"{agency}:{revision}")
+        return ';'.join(revisions)
+
+    @property
+    def counters(self):
+        """The agencies' upstream counters added together"""
+        counters = sum_figures(source.counters for source in self.sources.values())
+        counters['stale_reads'] = self.stale_reads
+        return counters
+
+    def circuit_open(self):
+        return any(source.circuit_open() for source in self.sources.values())
+
+    def status(self):
+        return {agency: source.status() for agency, source in self.sources.items()}
@@ -0,0 +1,177 @@
+import logging
+import math
+import threading
+import time
+from contextlib import closing
+
+from src.store import connect, initialize_database
+
+logger = logging.getLogger(__name__)
+
+# Rollup resolutions in seconds: 5 minutes, 1 hour, 1 day
+ROLLUP_STEPS = (300, 3600, 86400)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    metric TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (metric, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollups (
+    metric TEXT NOT NULL,
+    step INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    sum REAL NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    last REAL NOT NULL,
+    last_ts INTEGER NOT NULL,
+    PRIMARY KEY (metric, step, bucket)
+) WITHOUT ROWID;
+"""
+
+ROLLUP_UPSERT = """
+INSERT INTO rollups (metric, step, bucket, count, sum, min, max, last, last_ts)
+VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?)
+ON CONFLICT (metric, step, bucket) DO UPDATE SET
+    count = count + 1,
+    sum = sum + excluded.sum,
+    min = MIN(min, excluded.min),
+    max = MAX(max, excluded.max),
+    last = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last ELSE last END,
+    last_ts = MAX(last_ts, excluded.last_ts)
+"""
+
+
+def flatten_metrics(payload, prefix=''):
+    """Numeric values of a payload as ``{dotted.name: value}``; lists and text are skipped"""
+    metrics = {}
+    for key, value in payload.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(flatten_metrics(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[name] = float(value)
+    return metrics
+
+
+class MetricHistory:
+    """Time series of the dashboard figures, with precomputed rollups.
+
+    Each sample is stored raw and folded, in the same transaction, into
+    5-minute, hourly and daily buckets (count, sum, min, max, last), so a
+    range query reads at most a few hundred pre-aggregated rows.  Samples
+    are keyed on (metric, timestamp): workers that record the same shared
+    snapshot only count it once.  Raw samples and 5-minute buckets are
+    pruned after ``raw_retention`` and ``rollup_retention`` seconds.
+    """
+
+    def __init__(self, path, raw_retention=30 * 86400, rollup_retention=180 * 86400):
+        self.path = path
+        self.raw_retention = raw_retention
+        self.rollup_retention = rollup_retention
+        self._pruned_at = 0
+        self._prune_lock = threading.Lock()
+        initialize_database(path, SCHEMA)
+
+    def _connect(self):
+        return connect(self.path)
+
+    def append(self, ts, metrics):
+        """Record ``{metric: value}`` observed at epoch second ``ts``; returns how many were new"""
+        ts = int(ts)
+        added = 0
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                for metric, value in metrics.items():
+                    cursor = db.execute('INSERT OR IGNORE INTO samples (metric, ts, value) VALUES (?, ?, ?)',
+                                        (metric, ts, value))
+                    if cursor.rowcount != 1:
+                        continue
+                    added += 1
+                    db.executemany(ROLLUP_UPSERT, [
+                        (metric, step, ts - ts % step, value, value, value, value, ts) for step in ROLLUP_STEPS
+                    ])
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        self._maybe_prune()
+        return added
+
+    def _maybe_prune(self):
+        now = time.time()
+        with self._prune_lock:
+            if now - self._pruned_at < 3600:
+                return
+            self._pruned_at = now
+        with closing(self._connect()) as db:
+            db.execute('DELETE FROM samples WHERE ts < ?', (int(now - self.raw_retention),))
+            db.execute('DELETE FROM rollups WHERE step = ? AND bucket < ?',
+                       (ROLLUP_STEPS[0], int(now - self.rollup_retention)))
+
+    def metrics(self):
+        with closing(self._connect()) as db:
+            return [row[0] for row in db.execute(
+                'SELECT DISTINCT metric FROM rollups WHERE step = ? ORDER BY metric', (ROLLUP_STEPS[-1],))]
+
+    def query(self, metric, start, end, step):
+        """Buckets of ``step`` seconds between ``start`` and ``end`` as columns.
+
+        Buckets are aligned on multiples of ``step`` since the epoch (UTC).
+        Reads the coarsest rollup that divides ``step``, or raw samples for
+        other steps.  Figures only change when the sheet does, so a bucket
+        without samples carries the previous value forward (with a count
+        of 0).
+        """
+        start, end, step = int(start), int(end), int(step)
+        start -= start % step
+        resolution = max((s for s in ROLLUP_STEPS if step % s == 0), default=None)
+
+        with closing(self._connect()) as db:
+            if resolution is None:
+                rows = db.execute(
+                    'SELECT ts, 1, value, value, value, value FROM samples '
+                    'WHERE metric = ? AND ts >= ? AND ts < ? ORDER BY ts',
+                    (metric, start, end)).fetchall()
+                before = db.execute(
+                    'SELECT value FROM samples WHERE metric = ? AND ts < ? ORDER BY ts DESC LIMIT 1',
+                    (metric, start)).fetchone()
+            else:
+                rows = db.execute(
+                    'SELECT bucket, count, sum, min, max, last FROM rollups '
+                    'WHERE metric = ? AND step = ? AND bucket >= ? AND bucket < ? ORDER BY bucket',
+                    (metric, resolution, start, end)).fetchall()
+                before = db.execute(
+                    'SELECT last FROM rollups WHERE metric = ? AND step = ? AND bucket < ? '
+                    'ORDER BY bucket DESC LIMIT 1',
+                    (metric, resolution, start)).fetchone()
+
+        columns = {'t': [], 'avg': [], 'min': [], 'max': [], 'last': [], 'count': []}
+        previous = before[0] if before is not None else None
+        index = 0
+        for bucket in range(start, end, step):
+            count, total, low, high, last = 0, 0.0, math.inf, -math.inf, None
+            while index < len(rows) and rows[index][0] < bucket + step:
+                _, n, row_sum, row_min, row_max, row_last = rows[index]
+                count += n
+                total += row_sum
+                low = min(low, row_min)
+                high = max(high, row_max)
+                last = row_last
+                index += 1
+            columns['t'].append(bucket)
+            columns['count'].append(count)
+            if count:
+                columns['avg'].append(total / count)
+                columns['min'].append(low)
+                columns['max'].append(high)
+                columns['last'].append(last)
+                previous = last
+            else:
+                for key in ('avg', 'min', 'max', 'last'):
+                    columns[key].append(previous)
+        return {'resolution': resolution or 0, **columns}
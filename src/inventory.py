@@ -0,0 +1,203 @@
+"""The VÉHICULE inventory kept up to date from row-level diffs.
+
+parse_vehicle_inventory reads every row and counts every vehicle on each
+sync, although a sync usually brings a handful of edited rows.
+IncrementalInventory keeps the rows it last read with the vehicles each
+one produced: a new read is compared row by row, only the rows that differ
+are parsed again, and the counts and sorted views are adjusted by what
+those rows removed and added.
+"""
+import logging
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+from itertools import chain
+from operator import attrgetter, eq
+
+from src.parsers import VEHICLE_LAYOUT, _last_populated_row, parse_vehicle_inventory
+
+logger = logging.getLogger(__name__)
+
+
+class InventoryMismatch(Exception):
+    """The incremental inventory differs from a full parse of the same rows."""
+
+
+class IncrementalInventory:
+    """Categories, stats and per-category views sorted by type, updated in O(changed rows).
+
+    ``update(values)`` returns ``(categories, stats)`` exactly as
+    parse_vehicle_inventory(values) would.  Rows are compared by position,
+    so a row inserted in the sheet shifts the rows below it, which then
+    count as changed.  Vehicles of unchanged rows are the same records from
+    one update to the next, and a category no changed row touches keeps the
+    same list: published payloads share them and must not modify them.
+
+    ``agency`` is set on every vehicle of a federated inventory.  With
+    ``check``, each update is compared to a full parse and raises
+    InventoryMismatch on any difference, after which the next update
+    starts over from a full parse.
+    """
+
+    def __init__(self, layout=None, agency=None, check=False):
+        self.layout = layout or VEHICLE_LAYOUT
+        self.agency = agency
+        self.check = check
+        category_names, sections = self.layout
+        self.category_names = list(dict.fromkeys(category_names))
+        # Extracteurs liés une fois pour toutes à des listes vidées avant chaque ligne
+        self._scratch = {name: [] for name in self.category_names}
+        self._scratch_types = []
+        self._scratch_statuses = []
+        self._extractors = [
+            (min_width, bind(self._scratch[category], self._scratch_types, self._scratch_statuses))
+            for min_width, category, bind in sections
+        ]
+        self._lock = threading.Lock()
+        self._reset()
+        self.categories = None
+        self.last_changed_rows = 0
+
+    def _reset(self):
+        self._rows = []
+        # Par catégorie, les véhicules de chaque ligne (tuple vide si aucun)
+        self._cells = {name: [] for name in self.category_names}
+        self._row_types = []
+        self._row_statuses = []
+        self.by_type = Counter()
+        self.by_status = Counter()
+        self.by_category = Counter()
+        # Par catégorie, (type, ligne, position, véhicule) triés : l'ordre stable par type
+        self._views = {name: [] for name in self.category_names}
+        # Par catégorie, la liste publiée au dernier update, reprise telle quelle si rien n'y change
+        self._lists = {}
+
+    def _extract(self, row):
+        """Vehicles, types and counted statuses of one row, as parse_vehicle_inventory reads it"""
+        for vehicles in self._scratch.values():
+            vehicles.clear()
+        self._scratch_types.clear()
+        self._scratch_statuses.clear()
+        width = len(row)
+        try:
+            for min_width, extract in self._extractors:
+                if width < min_width:
+                    break
+                extract(row, width)
+        except Exception as row_error:
+            logger.error(f"Error processing row {row}: {str(row_error)}")
+        cells = {name: tuple(vehicles) for name, vehicles in self._scratch.items() if vehicles}
+        if self.agency is not None:
+            for vehicles in cells.values():
+                for vehicle in vehicles:
+                    vehicle.agency = self.agency
+        return cells, tuple(self._scratch_types), tuple(self._scratch_statuses)
+
+    def _remove_row(self, number, touched):
+        for name, cells in self._cells.items():
+            if not cells[number]:
+                continue
+            touched.add(name)
+            view = self._views[name]
+            for position, vehicle in enumerate(cells[number]):
+                del view[bisect_left(view, (vehicle.type, number, position))]
+                self.by_category[name] -= 1
+            cells[number] = ()
+        self.by_type.subtract(self._row_types[number])
+        self.by_status.subtract(self._row_statuses[number])
+
+    def _add_row(self, number, row, touched):
+        cells, types, statuses = self._extract(row)
+        touched.update(cells)
+        for name, vehicles in cells.items():
+            self._cells[name][number] = vehicles
+            view = self._views[name]
+            for position, vehicle in enumerate(vehicles):
+                insort(view, (vehicle.type, number, position, vehicle))
+            self.by_category[name] += len(vehicles)
+        self._row_types[number] = types
+        self._row_statuses[number] = statuses
+        self.by_type.update(types)
+        self.by_status.update(statuses)
+
+    def _resize(self, count):
+        for cells in self._cells.values():
+            del cells[count:]
+            cells.extend([()] * (count - len(cells)))
+        for per_row in (self._row_types, self._row_statuses):
+            del per_row[count:]
+            per_row.extend([()] * (count - len(per_row)))
+
+    def update(self, values):
+        with self._lock:
+            try:
+                return self._update(values)
+            except InventoryMismatch:
+                self._reset()
+                raise
+
+    def _update(self, values):
+        # Comme parse_vehicle_inventory : en-tête ignoré, arrêt à la dernière ligne remplie
+        rows = values[:_last_populated_row(values)] if values else []
+        old = self._rows
+        common = min(len(rows), len(old))
+        changed = [number for number, same in enumerate(map(eq, rows[1:common], old[1:common]), start=1) if not same]
+        changed.extend(range(max(common, 1), max(len(rows), len(old))))
+        touched = set()
+        for number in changed:
+            if number < len(old):
+                self._remove_row(number, touched)
+        self._resize(len(rows))
+        for number in changed:
+            if number < len(rows):
+                self._add_row(number, rows[number], touched)
+        self._rows = list(rows)
+        self.last_changed_rows = len(changed)
+
+        # Les comptes tombés à zéro disparaissent, comme dans un recalcul complet
+        for counts in (self.by_type, self.by_status, self.by_category):
+            for key in [key for key, count in counts.items() if count <= 0]:
+                del counts[key]
+
+        for name in self.category_names:
+            if name in touched or name not in self._lists:
+                self._lists[name] = list(chain.from_iterable(self._cells[name]))
+        categories = dict(self._lists)
+        stats = {
+            'total': sum(self.by_type.values()),
+            'by_type': dict(self.by_type),
+            'by_category': {name: self.by_category[name] for name in self.category_names if self.by_category[name]},
+            'by_status': dict(self.by_status)
+        }
+        logger.debug("Inventory updated from %d changed rows", len(changed))
+        if self.check:
+            self.verify(values, categories, stats)
+        self.categories = categories
+        return categories, stats
+
+    def sorted_views(self, categories):
+        """``{category: vehicles sorted by type}``, in sheet order within a type.
+
+        Only answered for the ``categories`` the last update returned (None
+        otherwise), since the views follow the inventory, not older payloads.
+        """
+        with self._lock:
+            if categories is not self.categories:
+                return None
+            return {name: [entry[-1] for entry in view] for name, view in self._views.items()}
+
+    def verify(self, values, categories, stats):
+        """Raise InventoryMismatch if ``categories``, ``stats`` or the sorted views differ from a full parse"""
+        expected_categories, expected_stats = parse_vehicle_inventory(values, self.layout)
+        if self.agency is not None:
+            for vehicles in expected_categories.values():
+                for vehicle in vehicles:
+                    vehicle.agency = self.agency
+        if categories != expected_categories:
+            raise InventoryMismatch('categories differ from a full parse')
+        if stats != expected_stats:
+            raise InventoryMismatch(f"stats differ from a full parse: {stats} != {expected_stats}")
+        for name, vehicles in expected_categories.items():
+            view = [entry[-1] for entry in self._views[name]]
+            if view != sorted(vehicles, key=attrgetter('type')):
+                raise InventoryMismatch(f"sorted view of {name} differs from a full sort")
@@ -0,0 +1,114 @@
+import atexit
+import itertools
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+
+# Logger used for one-line-per-row debug output in the parsers; sampled, see RowSampler
+ROW_LOGGER_NAME = 'src.parsers.rows'
+
+_listener = None
+
+
+class RowSampler(logging.Filter):
+    """Lets through one record out of every ``every``.
+
+    Attached to the per-row debug logger so turning DEBUG on in production
+    gives a representative trickle of rows rather than the whole sheet.
+    """
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(1, every)
+        self._counter = itertools.count()
+
+    def filter(self, record):
+        return next(self._counter) % self.every == 0
+
+
+class DeferredQueueHandler(QueueHandler):
+    """A QueueHandler that leaves the formatting to the listener thread.
+
+    The stock prepare() formats the message, and the traceback, in the
+    logging thread so the record can be pickled to another process.  This
+    queue stays in the process, so the record goes on it as it is: the
+    request thread only pays for the put.  Arguments are formatted when the
+    listener gets to them, so log values rather than objects that change
+    right after the call.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def _parse_module_levels(spec):
+    """'src.parsers=DEBUG,src.sheets=WARNING' -> {'src.parsers': 'DEBUG', ...}"""
+    levels = {}
+    for item in spec.split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(settings):
+    """Route all logging through a queue drained by a background listener thread.
+
+    Request threads only put records on an in-memory queue (see
+    DeferredQueueHandler); formatting and the writes to the log file and the
+    console happen on the listener thread.  Every gunicorn worker appends
+    to the same file, so none of them rotates it: logrotate (or the like)
+    moves it aside and each worker reopens the path on its next write.
+    Settings come from the app's settings (see src/settings.py):
+
+    LOG_LEVEL         root level (default INFO)
+    LOG_LEVELS        per-module overrides, e.g. 'src.parsers=DEBUG,src.sheets=WARNING'
+    LOG_FILE          log file path (default logs/app.log), empty to disable
+    LOG_ROW_SAMPLE    keep one per-row debug line out of N (default 100)
+
+    Calling it again is a no-op.  Forked children (gunicorn --preload)
+    start their own listener thread.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler()]
+
+    log_file = settings['LOG_FILE']
+    if log_file:
+        os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+        # Rotation externe : un RotatingFileHandler par worker renommerait le fichier sous les autres
+        handlers.append(WatchedFileHandler(log_file, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [DeferredQueueHandler(log_queue)]
+    root.setLevel(settings['LOG_LEVEL'].upper())
+
+    for name, level in _parse_module_levels(settings['LOG_LEVELS']).items():
+        logging.getLogger(name).setLevel(level)
+
+    logging.getLogger(ROW_LOGGER_NAME).addFilter(RowSampler(int(settings['LOG_ROW_SAMPLE'])))
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_restart_listener)
+    return _listener
+
+
+def _restart_listener():
+    # Le thread du listener ne survit pas au fork (gunicorn --preload) : chaque
+    # worker relance le sien sur la même queue et les mêmes handlers
+    global _listener
+    _listener = QueueListener(_listener.queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
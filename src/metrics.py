@@ -0,0 +1,323 @@
+"""In-process counters and histograms, exposed in the Prometheus text format.
+
+Each gunicorn worker records into its own registry; recording is a lock,
+a bisect and a few additions.  Every ``flush_interval`` seconds the worker
+writes its values to ``<directory>/metrics-<pid>.json`` and /metrics,
+whichever worker serves it, adds up the files of every worker.  Counters
+and histograms of workers that have exited are kept so totals never go
+backwards; gauges are per-process values, reported with a ``pid`` label
+for live workers only.
+
+The directory defaults to one per gunicorn master (``fleet-metrics-<ppid>``
+in the temp dir) so a restart starts from zero; create_app() applies the
+METRICS_DIR and METRICS_FLUSH_INTERVAL settings with configure().
+"""
+import atexit
+import bisect
+import glob
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class _Timer:
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._started)
+
+
+class _CounterChild:
+    __slots__ = ('_lock', 'value')
+
+    def __init__(self, lock):
+        self._lock = lock
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def state(self):
+        return self.value
+
+
+class _HistogramChild:
+    __slots__ = ('_lock', '_buckets', 'counts', 'sum')
+
+    def __init__(self, lock, buckets):
+        self._lock = lock
+        self._buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def state(self):
+        with self._lock:
+            return self.counts + [self.sum]
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values):
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def samples(self):
+        return [[list(key), child.state()] for key, child in list(self._children.items())]
+
+    def describe(self):
+        return {'type': self.kind, 'help': self.documentation, 'labelnames': list(self.labelnames)}
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild(self._lock)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self._lock, self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def describe(self):
+        description = super().describe()
+        description['buckets'] = list(self.buckets)
+        return description
+
+
+class MetricsRegistry:
+    """The metrics of this process, and their sum over every worker.
+
+    ``add_collector(name, documentation, kind, labelnames, collect)`` adds
+    values read at collection time instead of recorded as they happen, for
+    state other modules already keep (cache counters, sync counters).
+    ``collect`` returns ``{label_values_tuple: value}``.
+    """
+
+    def __init__(self, directory=None, flush_interval=5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+
+    def add_collector(self, name, documentation, kind, labelnames, collect):
+        """Read ``collect()`` at each flush; replaces a collector of the same name (an app created again)"""
+        with self._lock:
+            self._collectors = [collector for collector in self._collectors if collector[0] != name]
+            self._collectors.append((name, {
+                'type': kind, 'help': documentation, 'labelnames': list(labelnames)
+            }, collect))
+
+    def configure(self, directory=None, flush_interval=5):
+        """Where and how often to flush; ``directory`` None is the per-master default, empty disables sharing"""
+        self.directory = directory
+        self.flush_interval = flush_interval
+
+    def _path(self):
+        return os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+
+    def local_state(self):
+        state = {}
+        for name, metric in list(self._metrics.items()):
+            entry = metric.describe()
+            entry['samples'] = metric.samples()
+            state[name] = entry
+        for name, description, collect in self._collectors:
+            try:
+                values = collect()
+            except Exception as e:
+                logger.error(f"Error collecting metric {name}: {str(e)}")
+                logger.debug(traceback.format_exc())
+                continue
+            entry = dict(description)
+            entry['samples'] = [[list(key), value] for key, value in values.items()]
+            state[name] = entry
+        return state
+
+    def flush(self):
+        if not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path()
+            temporary = f"{path}.tmp"
+            with open(temporary, 'w', encoding='utf-8') as f:
+                json.dump({'pid': os.getpid(), 'metrics': self.local_state()}, f, separators=(',', ':'))
+            os.replace(temporary, path)
+        except Exception as e:
+            logger.error(f"Error writing metrics to {self.directory}: {str(e)}")
+
+    def start(self):
+        """Start flushing to the shared directory; called once per worker."""
+        with self._lock:
+            if self.directory is None:
+                # Résolu dans le worker : son parent est le master gunicorn
+                self.directory = default_directory()
+            if not self.directory:
+                return
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _worker_states(self):
+        """(pid, state, alive) for this process and every other worker that flushed"""
+        pid = os.getpid()
+        yield pid, self.local_state(), True
+        if not self.directory:
+            return
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    document = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if document.get('pid') == pid:
+                continue
+            yield document['pid'], document['metrics'], _process_alive(document['pid'])
+
+    def collect(self):
+        """Every metric summed over the workers: ``{name: description + samples}``"""
+        merged = {}
+        for pid, state, alive in self._worker_states():
+            for name, entry in state.items():
+                target = merged.setdefault(name, dict(entry, samples={}))
+                samples = target['samples']
+                if entry['type'] == 'gauge':
+                    if alive:
+                        for labels, value in entry['samples']:
+                            samples[tuple(labels) + (str(pid),)] = value
+                    continue
+                for labels, value in entry['samples']:
+                    key = tuple(labels)
+                    if entry['type'] == 'histogram':
+                        previous = samples.get(key)
+                        samples[key] = value if previous is None else [a + b for a, b in zip(previous, value)]
+                    else:
+                        samples[key] = samples.get(key, 0) + value
+        for entry in merged.values():
+            if entry['type'] == 'gauge':
+                entry['labelnames'] = entry['labelnames'] + ['pid']
+        return merged
+
+    def render(self):
+        lines = []
+        for name, entry in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {entry['help']}")
+            lines.append(f"# TYPE {name} {entry['type']}")
+            labelnames = entry['labelnames']
+            for key, value in sorted(entry['samples'].items()):
+                labels = list(zip(labelnames, key))
+                if entry['type'] != 'histogram':
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(entry['buckets'] + [math.inf], value[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == math.inf else _format_value(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[-1])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def default_directory():
+    # Les workers gunicorn partagent le même parent : un dossier par instance du master
+    return os.path.join(tempfile.gettempdir(), f"fleet-metrics-{os.getppid()}")
+
+
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,350 @@
+import json
+import logging
+import re
+import traceback
+from collections import Counter
+from functools import lru_cache
+from operator import attrgetter
+
+from src.records import SheetVehicleRecord, VehicleRecord
+
+logger = logging.getLogger(__name__)
+# One line per sheet row: sampled when DEBUG is on (see src/logging_setup.py)
+row_logger = logging.getLogger(__name__ + '.rows')
+
+def parse_vehicle_data(values):
+    vehicles = []
+    try:
+        for row in values:
+            if len(row) >= 6:
+                # Get the category based on the sheet or column
+                category = 'FLOTTE'  # Default category
+                if 'FRANCE SERV' in str(row[4]):
+                    category = 'CHAUFFEUR'
+                elif any(status in str(row[5]).upper() for status in ['MC', 'FC']):
+                    category = 'TRANSCO'
+
+                vehicle = SheetVehicleRecord(
+                    type=str(row[0]) if len(row) > 0 else '',
+                    registration=str(row[2]) if len(row) > 2 else '',
+                    cucar=str(row[1]) if len(row) > 1 else '',
+                    service=str(row[4]) if len(row) > 4 else '',
+                    status=str(row[5]) if len(row) > 5 else '',
+                    mc_fc=str(row[6]) if len(row) > 6 else '',
+                    category=category
+                )
+                vehicles.append(vehicle)
+        
+        # Sort vehicles by category and type
+        vehicles.sort(key=attrgetter('category', 'type'))
+        
+        logger.debug("Parsed %d vehicles", len(vehicles))
+        if vehicles:
+            logger.debug("First vehicle: %s", vehicles[0])
+    except Exception as e:
+        logger.error(f"Error parsing vehicle data: {str(e)}")
+        logger.error(traceback.format_exc())
+    return vehicles
+
+def default_point_fs_data():
+    return {
+        'active_drivers': 0,
+        'total_vehicles': 0,
+        'available_vehicles': 0,
+        'categories': {
+            'FLOTTE': 0,
+            'CHAUFFEUR': 0,
+            'TRANSCO': 0,
+            'DISPONIBLE': 0
+        },
+        'status': {
+            'MC': 0,
+            'FC': 0,
+            'FRANCE_SERV': 0
+        },
+        'vehicle_types': [],
+        'weekly_departures': 0,
+        'daily_departures': 0,
+        'weekly_stops': 0,
+        'daily_stops': 0,
+        'ca_semaine': 0,
+        'ca_jour': 0
+    }
+
+# Vehicle models listed on their own row of the Point FS sheet
+VEHICLE_MODEL_KEYWORDS = ('chr', 'corolla', 'kona', 'model 3', 'swace', 'auris', 'isuzu')
+
+_LABEL_KEYWORDS = VEHICLE_MODEL_KEYWORDS + (
+    'flotte', 'chauffeur', 'transco', 'dispo', 'actif', 'vehicule', 'total',
+    'depart', 'semaine', 'jour', 'stop', 'ca s-1'
+)
+
+# One pass over the label finds every keyword it contains.  The lookahead
+# makes matches zero-width so overlapping keywords are all reported; no
+# keyword is a prefix of another, so one alternative per position is enough.
+_LABEL_PATTERN = re.compile('(?=(' + '|'.join(re.escape(k) for k in _LABEL_KEYWORDS) + '))')
+
+@lru_cache(maxsize=1024)
+def classify_point_fs_label(label):
+    """Map a lowercased Point FS label to (category key, metric key), either may be None.
+
+    The label column rarely changes between refreshes, so results are
+    memoized and a refresh only pays for labels it has never seen.
+    """
+    found = {match.group(1) for match in _LABEL_PATTERN.finditer(label)}
+
+    category = None
+    if 'flotte' in found:
+        category = 'FLOTTE'
+    elif 'chauffeur' in found:
+        category = 'CHAUFFEUR'
+    elif 'transco' in found:
+        category = 'TRANSCO'
+    elif 'dispo' in found:
+        category = 'DISPONIBLE'
+
+    metric = None
+    if 'chauffeur' in found and 'actif' in found:
+        metric = 'active_drivers'
+    elif 'vehicule' in found and 'total' in found:
+        metric = 'total_vehicles'
+    elif 'vehicule' in found and 'dispo' in found:
+        metric = 'available_vehicles'
+    elif not found.isdisjoint(VEHICLE_MODEL_KEYWORDS):
+        metric = 'vehicle_types'
+    elif 'depart' in found and 'semaine' in found:
+        metric = 'weekly_departures'
+    elif 'depart' in found and 'jour' in found:
+        metric = 'daily_departures'
+    elif 'stop' in found and 'semaine' in found:
+        metric = 'weekly_stops'
+    elif 'stop' in found and 'jour' in found:
+        metric = 'daily_stops'
+    elif 'ca s-1' in found:
+        metric = 'ca_semaine'
+    elif label.startswith('ca') and 'semaine' not in found:
+        metric = 'ca_jour'
+
+    return category, metric
+
+def parse_point_fs_data(values):
+    data = default_point_fs_data()
+    
+    try:
+        if not values:
+            logger.error("No values received from Point FS sheet")
+            return data
+
+        logger.debug("Processing %d rows from Point FS", len(values))
+        categories = data['categories']
+        vehicle_types = data['vehicle_types']
+        seen_types = set()
+        for row in values:
+            if len(row) < 2:
+                continue
+                
+            label = str(row[0]).lower() if row[0] else ''
+            value = row[1] if len(row) > 1 else 0
+            
+            try:
+                if isinstance(value, str):
+                    value = value.replace('€', '').replace(',', '.').strip()
+                    numeric_value = float(value) if '.' in value else int(value)
+                else:
+                    numeric_value = float(value) if isinstance(value, (int, float)) else 0
+            except (ValueError, AttributeError):
+                numeric_value = 0
+
+            category, metric = classify_point_fs_label(label)
+            if category is not None:
+                categories[category] = numeric_value
+
+            if metric == 'vehicle_types':
+                vehicle_type = str(row[0])
+                if vehicle_type not in seen_types:
+                    seen_types.add(vehicle_type)
+                    vehicle_types.append(vehicle_type)
+            elif metric is not None:
+                data[metric] = numeric_value
+                
+        logger.debug("Parsed Point FS data: %s", data)
+    except Exception as e:
+        logger.error(f"Error parsing Point FS data: {str(e)}")
+        logger.error(traceback.format_exc())
+    return data
+
+def parse_vehicle_with_immat(cell_value):
+    """Helper function to parse vehicle type and immatriculation from a cell like 'CHR (GG441SX)'"""
+    if not cell_value or '(' not in cell_value or ')' not in cell_value:
+        return cell_value, ''
+    
+    try:
+        # Split by opening parenthesis and remove closing parenthesis
+        parts = cell_value.split('(')
+        vehicle_type = parts[0].strip()
+        immat = parts[1].replace(')', '').strip()
+        return vehicle_type, immat
+    except:
+        return cell_value, ''
+
+# Layout of the VÉHICULE sheet: each category is a block of columns sitting
+# side by side on the same rows.  Column indexes are 0-based (A=0, N=13...).
+#   - 'columns': type, immatriculation and status each in their own column
+#   - 'embedded': type and immatriculation packed in one cell, e.g. 'CHR (GG441SX)'
+#   - 'fixed': type and immatriculation columns, status is a constant label
+# A row only feeds a section when it is at least 'min_width' cells long.
+# The layout can be replaced without code changes by pointing
+# VEHICLE_LAYOUT_FILE at a JSON file holding the same list; create_app()
+# loads it (see load_vehicle_layout).
+DEFAULT_VEHICLE_LAYOUT = [
+    {'category': 'flotte', 'kind': 'columns', 'min_width': 3, 'type': 0, 'immatriculation': 1, 'status': 2},
+    {'category': 'chauffeur', 'kind': 'columns', 'min_width': 6, 'type': 3, 'immatriculation': 4, 'status': 5},
+    {'category': 'transco', 'kind': 'columns', 'min_width': 9, 'type': 6, 'immatriculation': 7, 'status': 8},
+    {'category': 'disponible_fs', 'kind': 'embedded', 'min_width': 14, 'cell': 13, 'status': 'Disponible FS'},
+    {'category': 'disponible_mc', 'kind': 'embedded', 'min_width': 17, 'cell': 16, 'status': 'Disponible MC'},
+    {'category': 'immo', 'kind': 'embedded', 'min_width': 20, 'cell': 19, 'status': 'IMMO'},
+    {'category': 'gestionnaire', 'kind': 'fixed', 'min_width': 22, 'type': 19, 'immatriculation': 20, 'status': 'Gestionnaire'},
+    {'category': 'gratuit', 'kind': 'fixed', 'min_width': 25, 'type': 22, 'immatriculation': 23, 'status': 'Gratuit'}
+]
+
+def load_vehicle_layout(path=None):
+    """The layout spec in the JSON file at ``path``, or DEFAULT_VEHICLE_LAYOUT without one"""
+    if not path:
+        return DEFAULT_VEHICLE_LAYOUT
+    with open(path, 'r', encoding='utf-8') as f:
+        layout = json.load(f)
+    logger.info(f"Loaded vehicle layout from {path} ({len(layout)} sections)")
+    return layout
+
+def _compile_section(section):
+    """Build a factory that binds one layout section to the output lists.
+
+    The returned callable takes (vehicles, types, statuses) and returns an
+    extractor ``extract(row, width)`` that appends straight into them, so the
+    row loop does no lookups beyond the cells it actually reads.
+    """
+    category = section['category']
+    kind = section['kind']
+
+    if kind == 'columns':
+        type_col, immat_col, status_col = section['type'], section['immatriculation'], section['status']
+
+        def bind(vehicles, types, statuses):
+            def extract(row, width):
+                if row[type_col] and row[immat_col]:
+                    vehicle_type = str(row[type_col])
+                    status = str(row[status_col]) if width > status_col else ''
+                    vehicles.append(VehicleRecord(vehicle_type, str(row[immat_col]), status, category))
+                    types.append(vehicle_type)
+                    if status:
+                        statuses.append(status)
+            return extract
+
+    elif kind == 'embedded':
+        cell_col, status = section['cell'], section['status']
+
+        def bind(vehicles, types, statuses):
+            def extract(row, width):
+                cell = row[cell_col]
+                if cell and str(cell).strip() != '0':
+                    vehicle_type, immat = parse_vehicle_with_immat(str(cell))
+                    if vehicle_type and immat:
+                        vehicles.append(VehicleRecord(vehicle_type, immat, status, category, cucar=''))
+                        types.append(vehicle_type)
+            return extract
+
+    elif kind == 'fixed':
+        type_col, immat_col, status = section['type'], section['immatriculation'], section['status']
+
+        def bind(vehicles, types, statuses):
+            def extract(row, width):
+                if row[type_col]:
+                    vehicle_type = str(row[type_col])
+                    vehicles.append(VehicleRecord(
+                        vehicle_type,
+                        str(row[immat_col]) if width > immat_col else '',
+                        status,
+                        category
+                    ))
+                    types.append(vehicle_type)
+            return extract
+
+    else:
+        raise ValueError(f"Unknown vehicle layout kind '{kind}' for category '{category}'")
+
+    return section['min_width'], category, bind
+
+def compile_vehicle_layout(layout):
+    """Turn a layout spec into (categories, sections) for parse_vehicle_inventory.
+
+    Sections are ordered by min_width so the row loop can stop at the first
+    section a short row cannot reach.
+    """
+    categories = [section['category'] for section in layout]
+    sections = sorted((_compile_section(section) for section in layout), key=lambda s: s[0])
+    return categories, sections
+
+def status_columns(layout):
+    """{category: (immatriculation column, status column)} of the sections whose status is a cell of its own"""
+    return {
+        section['category']: (section['immatriculation'], section['status'])
+        for section in layout if section['kind'] == 'columns'
+    }
+
+# Layout par défaut ; celui de VEHICLE_LAYOUT_FILE est chargé par create_app(), pas à l'import
+VEHICLE_LAYOUT = compile_vehicle_layout(DEFAULT_VEHICLE_LAYOUT)
+
+def _last_populated_row(values):
+    last = len(values)
+    while last > 1 and not any(values[last - 1]):
+        last -= 1
+    return last
+
+def parse_vehicle_inventory(values, layout=None):
+    """Split the VÉHICULE sheet into its side-by-side sections and count them"""
+    category_names, sections = layout or VEHICLE_LAYOUT
+    categories = {name: [] for name in category_names}
+    types = []
+    statuses = []
+    extractors = [
+        (min_width, bind(categories[category], types, statuses))
+        for min_width, category, bind in sections
+    ]
+
+    # Skip header row, and stop at the last row holding any data
+    for row in values[1:_last_populated_row(values)]:
+        width = len(row)
+        try:
+            for min_width, extract in extractors:
+                if width < min_width:
+                    break
+                extract(row, width)
+        except Exception as row_error:
+            logger.error(f"Error processing row {row}: {str(row_error)}")
+            continue
+
+    stats = {
+        'total': len(types),
+        'by_type': dict(Counter(types)),
+        'by_category': {name: len(vehicles) for name, vehicles in categories.items() if vehicles},
+        'by_status': dict(Counter(statuses))
+    }
+
+    logger.debug("Disponible MC vehicles: %s", categories.get('disponible_mc', []))
+
+    return categories, stats
+
+def filter_point_fs_rows(values):
+    """Drop the blank rows of the POINT FS range, keeping rows with at least one non-empty cell"""
+    # Filter out empty rows and process the data
+    log_rows = row_logger.isEnabledFor(logging.DEBUG)
+    processed_values = []
+    for i, row in enumerate(values):
+        if log_rows:
+            row_logger.debug("Row %d: %s", i + 2, row)
+        if row and any(cell.strip() for cell in row if isinstance(cell, str)):  
+            processed_values.append(row)
+    
+    logger.debug("Processed rows: %d", len(processed_values))
+
+    return processed_values
@@ -0,0 +1,70 @@
+import sys
+
+
+class Record:
+    """Base for the slotted vehicle records.
+
+    Records carry no per-instance ``__dict__``, and their categorical fields
+    (type, status, category...) are interned so the thousands of vehicles
+    sharing 'CHR', 'Disponible FS' or 'flotte' point at a single string.
+    They are turned into plain dicts only when serialized to JSON.
+    """
+
+    __slots__ = ()
+    _fields = ()
+    _optional = ()
+
+    def to_dict(self):
+        result = {}
+        for field in self._fields:
+            value = getattr(self, field)
+            if value is None and field in self._optional:
+                continue
+            result[field] = value
+        return result
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in self._fields)
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, f) for f in self._fields))
+
+    def __repr__(self):
+        fields = ', '.join(f"{f}={getattr(self, f)!r}" for f in self._fields)
+        return f"{type(self).__name__}({fields})"
+
+
+class VehicleRecord(Record):
+    """A vehicle from one section of the VÉHICULE sheet (see parse_vehicle_inventory)."""
+
+    __slots__ = ('type', 'immatriculation', 'status', 'category', 'cucar', 'agency')
+    _fields = __slots__
+    # Only the sections where type and plate share a cell have a (blank) cucar column,
+    # and only federated inventories (see src/federation.py) tag vehicles with their agency
+    _optional = ('cucar', 'agency')
+
+    def __init__(self, type, immatriculation, status, category, cucar=None, agency=None):
+        self.type = sys.intern(type)
+        self.immatriculation = immatriculation
+        self.status = sys.intern(status)
+        self.category = sys.intern(category)
+        self.cucar = cucar
+        self.agency = sys.intern(agency) if agency is not None else None
+
+
+class SheetVehicleRecord(Record):
+    """A vehicle row as read by parse_vehicle_data."""
+
+    __slots__ = ('type', 'registration', 'cucar', 'service', 'status', 'mc_fc', 'category')
+    _fields = __slots__
+
+    def __init__(self, type, registration, cucar, service, status, mc_fc, category):
+        self.type = sys.intern(type)
+        self.registration = registration
+        self.cucar = cucar
+        self.service = sys.intern(service)
+        self.status = sys.intern(status)
+        self.mc_fc = sys.intern(mc_fc)
+        self.category = sys.intern(category)
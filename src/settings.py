@@ -0,0 +1,74 @@
+"""Settings of the app, read from the environment when the app is created.
+
+create_app() in src/app.py starts from load_settings() and applies its
+``config`` argument on top, then hands the result to get_sheet_source()
+(src/sources.py), guard_source() (src/upstream.py) and configure_logging()
+(src/logging_setup.py): nothing else reads the environment.
+"""
+import os
+
+from dotenv import load_dotenv
+
+
+def _flag(name, default):
+    return os.getenv(name, default).lower() == 'true'
+
+
+def load_settings():
+    """Every setting of the app, from the environment and .env (the environment wins)"""
+    load_dotenv()
+    return {
+        'SECRET_KEY': os.getenv('SECRET_KEY', 'your-secret-key'),
+        'SPREADSHEET_ID': os.getenv('SPREADSHEET_ID'),
+        'SPREADSHEET_IDS': os.getenv('SPREADSHEET_IDS', ''),
+        'FEDERATION_WORKERS': int(os.getenv('FEDERATION_WORKERS', '8')),
+        'SYNC_ENABLED': _flag('SYNC_ENABLED', 'true'),
+        'SYNC_INTERVAL': float(os.getenv('SYNC_INTERVAL', '60')),
+        'SYNC_CHANGE_DETECTION': _flag('SYNC_CHANGE_DETECTION', 'true'),
+        'SYNC_MAX_AGE': float(os.getenv('SYNC_MAX_AGE', '3600')),
+        'VEHICLE_LAYOUT_FILE': os.getenv('VEHICLE_LAYOUT_FILE', ''),
+        'SHEETS_CACHE_TTL': float(os.getenv('SHEETS_CACHE_TTL', '60')),
+        'SHEETS_CACHE_STALE_TTL': float(os.getenv('SHEETS_CACHE_STALE_TTL', '300')),
+        'SHEETS_TOKEN_REFRESH_MARGIN': float(os.getenv('SHEETS_TOKEN_REFRESH_MARGIN', '300')),
+        # Dossier partagé des métriques des workers (non défini : un dossier temporaire par master)
+        'METRICS_DIR': os.getenv('METRICS_DIR'),
+        'METRICS_FLUSH_INTERVAL': float(os.getenv('METRICS_FLUSH_INTERVAL', '5')),
+        'SNAPSHOT_STORE': os.getenv('SNAPSHOT_STORE', 'data/fleet-snapshot.db'),
+        'SNAPSHOT_STORE_POLL': float(os.getenv('SNAPSHOT_STORE_POLL', '2')),
+        'STREAM_HEARTBEAT': float(os.getenv('STREAM_HEARTBEAT', '20')),
+        'STREAM_MAX_DURATION': float(os.getenv('STREAM_MAX_DURATION', '300')),
+        'STREAM_MAX_CLIENTS': int(os.getenv('STREAM_MAX_CLIENTS', '8')),
+        'LONG_POLL_MAX_TIMEOUT': float(os.getenv('LONG_POLL_MAX_TIMEOUT', '30')),
+        'VEHICLE_HISTORY_SIZE': int(os.getenv('VEHICLE_HISTORY_SIZE', '20')),
+        'COMPRESSION_MIN_SIZE': int(os.getenv('COMPRESSION_MIN_SIZE', '1024')),
+        'HISTORY_STORE': os.getenv('HISTORY_STORE', 'data/fleet-history.db'),
+        'HISTORY_RAW_DAYS': float(os.getenv('HISTORY_RAW_DAYS', '30')),
+        'HISTORY_ROLLUP_DAYS': float(os.getenv('HISTORY_ROLLUP_DAYS', '180')),
+        'WRITEBACK_INTERVAL': float(os.getenv('WRITEBACK_INTERVAL', '2')),
+        'WRITEBACK_MAX_ATTEMPTS': int(os.getenv('WRITEBACK_MAX_ATTEMPTS', '5')),
+        'INVENTORY_CHECK': _flag('INVENTORY_CHECK', 'false'),
+        # Jetons autorisés à modifier les statuts (src/auth.py), vide pour désactiver l'édition
+        'EDIT_TOKENS': os.getenv('EDIT_TOKENS', ''),
+        # Source des plages (src/sources.py) : 'google', ou 'local' pour rejouer un enregistrement
+        'SHEET_SOURCE': os.getenv('SHEET_SOURCE', 'google').lower(),
+        'SHEET_SOURCE_PATH': os.getenv('SHEET_SOURCE_PATH', 'recordings/fleet.json'),
+        'SHEET_SOURCE_LATENCY_MS': float(os.getenv('SHEET_SOURCE_LATENCY_MS', '0')),
+        'SHEET_SOURCE_JITTER_MS': float(os.getenv('SHEET_SOURCE_JITTER_MS', '0')),
+        # Limites des lectures du tableur (src/upstream.py) ; UPSTREAM_RATE_FILE vide : seau par processus
+        'UPSTREAM_RATE_PER_MINUTE': float(os.getenv('UPSTREAM_RATE_PER_MINUTE', '60')),
+        'UPSTREAM_BURST': float(os.getenv('UPSTREAM_BURST', '10')),
+        'UPSTREAM_RATE_FILE': os.getenv('UPSTREAM_RATE_FILE'),
+        'UPSTREAM_ACQUIRE_TIMEOUT': float(os.getenv('UPSTREAM_ACQUIRE_TIMEOUT', '10')),
+        'UPSTREAM_RETRIES': int(os.getenv('UPSTREAM_RETRIES', '3')),
+        'UPSTREAM_BACKOFF_BASE': float(os.getenv('UPSTREAM_BACKOFF_BASE', '0.5')),
+        'UPSTREAM_BACKOFF_MAX': float(os.getenv('UPSTREAM_BACKOFF_MAX', '30')),
+        'UPSTREAM_FAILURE_THRESHOLD': int(os.getenv('UPSTREAM_FAILURE_THRESHOLD', '5')),
+        'UPSTREAM_RESET_TIMEOUT': float(os.getenv('UPSTREAM_RESET_TIMEOUT', '30')),
+        # Journalisation (src/logging_setup.py)
+        'LOG_LEVEL': os.getenv('LOG_LEVEL', 'INFO'),
+        'LOG_LEVELS': os.getenv('LOG_LEVELS', ''),
+        'LOG_FILE': os.getenv('LOG_FILE', 'logs/app.log'),
+        'LOG_ROW_SAMPLE': int(os.getenv('LOG_ROW_SAMPLE', '100')),
+        # Démarre la journalisation (file, fichier, console) ; à False si l'hôte la configure déjà
+        'CONFIGURE_LOGGING': True
+    }
@@ -0,0 +1,260 @@
+import json
+import logging
+import os
+import re
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Les modules google* sont importés au premier appel : ils pèsent la moitié du
+# démarrage de l'app et ne servent pas avec SHEET_SOURCE=local
+
+logger = logging.getLogger(__name__)
+
+SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    # Lets the sync worker read the spreadsheet's revision to skip unchanged refreshes
+    'https://www.googleapis.com/auth/drive.metadata.readonly'
+]
+CREDENTIALS_PATH = os.path.abspath('src/config/credentials.json')
+
+# Refresh the access token this long before Google expires it, so a request
+# never goes out with a token that dies in flight (SHEETS_TOKEN_REFRESH_MARGIN,
+# applied by create_app()).
+TOKEN_REFRESH_MARGIN = timedelta(seconds=300)
+
+# HTTP statuses that mean our credentials or connection are no longer valid.
+AUTH_ERROR_STATUSES = (401, 403)
+
+API_VERSIONS = {
+    'sheets': 'v4',
+    'drive': 'v3'
+}
+
+
+class SheetsServiceManager:
+    """Per-process cache of the service account credentials and Sheets clients.
+
+    Credentials are loaded from disk once and shared by every thread; the
+    access token is refreshed under a lock shortly before it expires.  The
+    googleapiclient service object wraps an httplib2 connection which is not
+    thread-safe, so each worker thread gets its own service per API (Sheets,
+    and Drive for revision checks), built once and reused for the lifetime
+    of the thread.
+    """
+
+    def __init__(self, credentials_path=CREDENTIALS_PATH, scopes=SCOPES,
+                 refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.credentials_path = credentials_path
+        self.scopes = scopes
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._credentials = None
+        self._generation = 0
+        self._local = threading.local()
+
+    def _load_credentials(self):
+        from google.oauth2 import service_account
+
+        if not os.path.exists(self.credentials_path):
+            logger.error(f"Credentials file not found at {self.credentials_path}")
+            return None
+
+        with open(self.credentials_path, 'r') as f:
+            creds_json = json.load(f)
+        logger.debug(f"Service account email: {creds_json.get('client_email')}")
+        logger.debug(f"Project ID: {creds_json.get('project_id')}")
+
+        creds = service_account.Credentials.from_service_account_info(
+            creds_json,
+            scopes=self.scopes
+        )
+        logger.debug("Successfully created credentials object")
+        return creds
+
+    def _token_needs_refresh(self, creds):
+        if not creds.valid or creds.expiry is None:
+            return True
+        # google-auth stores expiry as a naive UTC datetime
+        return creds.expiry - datetime.utcnow() <= self.refresh_margin
+
+    def get_credentials(self):
+        with self._lock:
+            if self._credentials is None:
+                self._credentials = self._load_credentials()
+                if self._credentials is None:
+                    return None
+                self._generation += 1
+
+            if self._token_needs_refresh(self._credentials):
+                from google.auth.transport.requests import Request
+
+                logger.debug("Refreshing Google access token")
+                self._credentials.refresh(Request())
+
+            return self._credentials
+
+    def get_service(self, api='sheets'):
+        try:
+            creds = self.get_credentials()
+            if creds is None:
+                return None
+
+            local = self._local
+            if getattr(local, 'generation', None) != self._generation:
+                local.services = {}
+                local.generation = self._generation
+            service = local.services.get(api)
+            if service is None:
+                from googleapiclient.discovery import build
+
+                service = local.services[api] = build(
+                    api, API_VERSIONS[api], credentials=creds, cache_discovery=False)
+                logger.debug(f"Successfully built {api} service")
+            return service
+
+        except Exception as e:
+            logger.error(f"Error creating service: {str(e)}")
+            logger.error(traceback.format_exc())
+            return None
+
+    def reset(self):
+        """Drop the cached credentials and every thread's service.
+
+        The next call to get_service() reloads the credentials file and
+        rebuilds the client, which is how we reconnect after Google rejects
+        our token or the service account key is rotated.
+        """
+        with self._lock:
+            self._credentials = None
+            self._generation += 1
+        logger.info("Google Sheets service reset, will reconnect on next call")
+
+    def execute(self, make_request, api='sheets'):
+        """Run ``make_request(service).execute()`` with one reconnect on auth errors."""
+        from googleapiclient.errors import HttpError
+
+        service = self.get_service(api)
+        if service is None:
+            raise RuntimeError(f'Failed to initialize Google {api} service')
+
+        try:
+            return make_request(service).execute()
+        except HttpError as e:
+            if e.resp.status not in AUTH_ERROR_STATUSES:
+                raise
+            logger.warning(f"Sheets API auth error ({e.resp.status}), reconnecting")
+            self.reset()
+            service = self.get_service(api)
+            if service is None:
+                raise
+            return make_request(service).execute()
+
+
+service_manager = SheetsServiceManager()
+
+# Runs the batchGet calls of one read side by side; each pool thread gets its
+# own service object from the manager, like any other thread.  Sized for the
+# reads of every agency of a federated fleet (src/federation.py) at once
+_batch_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='sheets-batch')
+
+
+def _batch_get_group(manager, spreadsheet_id, value_render_option, range_names):
+    params = {
+        'spreadsheetId': spreadsheet_id,
+        'ranges': range_names,
+        'fields': 'valueRanges(range,values)'
+    }
+    if value_render_option:
+        params['valueRenderOption'] = value_render_option
+    response = manager.execute(lambda service: service.spreadsheets().values().batchGet(**params))
+    return response.get('valueRanges', [])
+
+
+def batch_get_values(spreadsheet_id, ranges, manager=None):
+    """Read several ranges with as few ``values().batchGet`` calls as possible.
+
+    ``ranges`` is a list of ``(range_name, value_render_option)`` pairs.  A
+    batchGet only accepts one render option, so ranges are grouped by option
+    and each group costs one round-trip; the groups are fetched
+    concurrently.  Returns the list of row values in the same order as
+    ``ranges``.
+    """
+    manager = manager or service_manager
+    groups = {}
+    for index, (range_name, value_render_option) in enumerate(ranges):
+        groups.setdefault(value_render_option, []).append((index, range_name))
+
+    def fetch(value_render_option, members):
+        return _batch_get_group(manager, spreadsheet_id, value_render_option,
+                                [range_name for _, range_name in members])
+
+    if not groups:
+        return []
+    # The first group is read in the calling thread, the others on the pool
+    first, *others = groups.items()
+    futures = [_batch_pool.submit(fetch, option, members) for option, members in others]
+    responses = [fetch(*first)] + [future.result() for future in futures]
+
+    results = [[] for _ in ranges]
+    for members, value_ranges in zip(groups.values(), responses):
+        # valueRanges come back in request order; the range names are normalised
+        # by the API (quotes, bounds) so we match on position, not on name
+        for (index, _), value_range in zip(members, value_ranges):
+            results[index] = value_range.get('values', [])
+    return results
+
+
+def get_spreadsheet_revision(spreadsheet_id, manager=None):
+    """Cheap change marker for a spreadsheet: its Drive file version.
+
+    Drive bumps ``version`` on every edit to the file, so two equal values
+    mean the sheet content has not changed in between.
+    """
+    manager = manager or service_manager
+    metadata = manager.execute(
+        lambda drive: drive.files().get(
+            fileId=spreadsheet_id,
+            fields='version,modifiedTime',
+            supportsAllDrives=True
+        ),
+        api='drive'
+    )
+    return metadata.get('version') or metadata.get('modifiedTime')
+
+
+def column_letter(index):
+    """0 -> 'A', 25 -> 'Z', 26 -> 'AA'"""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def cell_in_range(range_name, row, column):
+    """A1 name of the cell ``row``, ``column`` (0-based) counted from the top-left of ``range_name``"""
+    sheet, _, cells = range_name.rpartition('!')
+    letters, first_row = re.match(r'([A-Z]+)(\d+)', cells).groups()
+    first_column = 0
+    for letter in letters:
+        first_column = first_column * 26 + ord(letter) - ord('A') + 1
+    return f"{sheet}!{column_letter(first_column - 1 + column)}{int(first_row) + row}"
+
+
+def batch_update_values(spreadsheet_id, cells, manager=None):
+    """Write ``{a1_cell: value}`` with a single ``values().batchUpdate``; returns the cells updated.
+
+    Values are stored as given (RAW): nothing is parsed, so a value that
+    looks like a formula or a date stays the text that was sent.
+    """
+    manager = manager or service_manager
+    body = {
+        'valueInputOption': 'RAW',
+        'data': [{'range': cell, 'values': [[value]]} for cell, value in cells.items()]
+    }
+    response = manager.execute(lambda service: service.spreadsheets().values().batchUpdate(
+        spreadsheetId=spreadsheet_id, body=body))
+    return response.get('totalUpdatedCells', 0)
@@ -0,0 +1,429 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+import traceback
+from datetime import datetime
+from types import MappingProxyType
+
+from src.upstream import UpstreamUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+def digest_values(values):
+    """Stable fingerprint of the rows read from one range."""
+    encoded = json.dumps(values, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.blake2b(encoded.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def body_etag(body):
+    """Validator of a serialized payload: the same bytes give the same ETag in every worker."""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class FleetSnapshot:
+    """Parsed fleet data from one sync, never modified once published.
+
+    ``payloads`` maps a payload name (``'dashboard'``, ``'vehicles'``,
+    ``'point_fs'``) to the dict the matching route returns, and ``bodies``
+    holds the same payloads already serialized, so serving a request is a
+    dictionary lookup.  ``payload_versions`` records the snapshot version at
+    which each payload last changed, and ``etags`` a hash of each body, which
+    is what HTTP validators are built from; bodies given without an ETag are
+    hashed here, so a body carried over from the previous snapshot should
+    come with its ETag.  ``revision`` is the spreadsheet revision the data was
+    read at and ``digests`` fingerprint the raw range values, so the next
+    sync can tell what changed.
+    """
+
+    __slots__ = ('version', 'fetched_at', 'payloads', 'bodies', 'payload_versions', 'etags', 'revision', 'digests')
+
+    def __init__(self, version, payloads, bodies, payload_versions=None, revision=None, digests=None,
+                 fetched_at=None, etags=None):
+        self.version = version
+        self.fetched_at = fetched_at or datetime.now().isoformat(timespec='seconds')
+        self.payloads = MappingProxyType(dict(payloads))
+        self.bodies = MappingProxyType(dict(bodies))
+        self.payload_versions = MappingProxyType(dict(payload_versions or {name: version for name in payloads}))
+        etags = dict(etags or {})
+        for name, body in bodies.items():
+            if name not in etags:
+                etags[name] = body_etag(body)
+        self.etags = MappingProxyType(etags)
+        self.revision = revision
+        self.digests = MappingProxyType(dict(digests or {}))
+
+
+class SnapshotSyncWorker:
+    """Background thread that rebuilds the fleet snapshot on a fixed interval.
+
+    Each refresh goes through three steps, each one skipped when it can be:
+
+    1. ``check_revision()`` (optional) returns the spreadsheet's current
+       revision; if it matches the published snapshot nothing is fetched,
+       unless the rows were last read more than ``max_age`` seconds ago:
+       formulas such as TODAY() change the values without a new revision.
+    2. ``fetch_values()`` returns the raw rows of every source range, keyed
+       by source name.
+    3. For each payload in ``builders`` (``name -> (source, build)``), the
+       builder only runs if its source rows changed since the last snapshot;
+       otherwise the previous payload and body are reused.
+
+    Readers always see either the previous or the new snapshot, never a
+    partially built one: the swap is a single attribute assignment.  The
+    version only increases when a payload actually changed, and listeners
+    registered with add_listener() are then called with the previous and
+    the new snapshot.  If a refresh fails the last good snapshot stays in
+    place.
+
+    With a ``store`` (see src/store.py) the snapshot is shared by every
+    worker: each one polls the store every ``poll_interval`` seconds and
+    adopts newer snapshots, decoding payload bodies with ``decoders``
+    (``name -> decode(body)``, json.loads by default), and only the worker
+    holding the store's lease runs the steps above, once per interval.
+    """
+
+    def __init__(self, fetch_values, builders, serialize, interval=60, check_revision=None,
+                 store=None, decoders=None, poll_interval=2, max_age=None):
+        self.fetch_values = fetch_values
+        self.builders = builders
+        self.serialize = serialize
+        self.interval = interval
+        self.check_revision = check_revision
+        self.max_age = max_age
+        self.store = store
+        self.decoders = decoders or {}
+        self.poll_interval = min(poll_interval, interval)
+        self._listeners = []
+        self._snapshot = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.last_error = None
+        self.last_duration = None
+        self.last_checked = None
+        self.counters = {
+            'refreshes': 0,
+            'unchanged_revision': 0,
+            'expired': 0,
+            'payloads_rebuilt': 0,
+            'payloads_reused': 0,
+            'adopted_from_store': 0,
+            'patches': 0,
+            'store_conflicts': 0
+        }
+
+    @property
+    def current(self):
+        return self._snapshot
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _notify(self, previous, snapshot):
+        for listener in self._listeners:
+            try:
+                listener(previous, snapshot)
+            except Exception as e:
+                logger.error(f"Error in snapshot listener {listener.__name__}: {str(e)}")
+                logger.error(traceback.format_exc())
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self.store is not None and self._snapshot is None:
+                # Démarrage à froid : on sert tout de suite le snapshot stocké par un autre worker
+                with self._refresh_lock:
+                    self._adopt_stored()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='fleet-sync', daemon=True)
+            self._thread.start()
+            logger.info(f"Fleet sync worker started (interval {self.interval}s)")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        wait = self.interval if self.store is None else self.poll_interval
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(wait)
+
+    def _current_revision(self):
+        if self.check_revision is None:
+            return None
+        try:
+            return self.check_revision()
+        except Exception as e:
+            logger.warning(f"Could not read spreadsheet revision, doing a full refresh: {str(e)}")
+            return None
+
+    def _expired(self, snapshot):
+        """Whether ``snapshot``'s rows were read more than ``max_age`` seconds ago"""
+        if self.max_age is None:
+            return False
+        try:
+            fetched_at = datetime.fromisoformat(snapshot.fetched_at)
+        except (TypeError, ValueError):
+            return True
+        return (datetime.now() - fetched_at).total_seconds() >= self.max_age
+
+    def build_payloads(self, sources):
+        return {name: build(sources[source]) for name, (source, build) in self.builders.items()}
+
+    def refresh(self, force=False):
+        with self._refresh_lock:
+            started = time.perf_counter()
+            try:
+                if self.store is not None:
+                    return self._refresh_shared(force)
+                return self._refresh(force)
+            except UpstreamUnavailable as e:
+                # Quota ou disjoncteur : on garde le dernier snapshot sans polluer les logs
+                self.last_error = str(e)
+                logger.warning(f"Fleet snapshot not refreshed: {str(e)}")
+                return self._snapshot
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Error refreshing fleet snapshot: {str(e)}")
+                logger.error(traceback.format_exc())
+                return self._snapshot
+            finally:
+                self.last_duration = round(time.perf_counter() - started, 4)
+                self.last_checked = datetime.now().isoformat(timespec='seconds')
+
+    def _is_newer(self, stored, current):
+        """Whether ``stored`` (from store.load()) should replace ``current``"""
+        if stored is None or not set(self.builders) <= set(stored['payload_versions']):
+            # Store vide, ou écrit par une version de l'app qui n'a pas tous nos payloads
+            return False
+        return current is None or stored['version'] > current.version or (
+            stored['version'] == current.version and stored['revision'] != current.revision)
+
+    def _from_stored(self, stored, current):
+        """FleetSnapshot of ``stored``, taking from ``current`` the bodies the store did not read"""
+        payloads = {}
+        bodies = {}
+        etags = {}
+        for name, body in stored['bodies'].items():
+            bodies[name] = body
+            payloads[name] = self.decoders.get(name, json.loads)(body)
+        for name in stored['payload_versions']:
+            if name not in bodies:
+                payloads[name] = current.payloads[name]
+                bodies[name] = current.bodies[name]
+                etags[name] = current.etags[name]
+        return FleetSnapshot(
+            stored['version'], payloads, bodies,
+            payload_versions=stored['payload_versions'],
+            revision=stored['revision'],
+            digests=stored['digests'],
+            fetched_at=stored['fetched_at'],
+            etags=etags
+        )
+
+    def _known_versions(self):
+        return dict(self._snapshot.payload_versions) if self._snapshot is not None else None
+
+    def _adopt(self, snapshot):
+        previous = self._snapshot
+        self._snapshot = snapshot
+        self.counters['adopted_from_store'] += 1
+        logger.debug("Adopted stored fleet snapshot v%d", snapshot.version)
+        if previous is None or snapshot.version != previous.version:
+            self._notify(previous, snapshot)
+        return snapshot
+
+    def _adopt_stored(self):
+        """Switch to the store's snapshot if it is newer than ours"""
+        previous = self._snapshot
+        try:
+            stored = self.store.load(self._known_versions())
+        except Exception as e:
+            logger.error(f"Error reading snapshot store: {str(e)}")
+            logger.error(traceback.format_exc())
+            return previous
+        if not self._is_newer(stored, previous):
+            return previous
+        return self._adopt(self._from_stored(stored, previous))
+
+    def _publish(self, previous, snapshot, changed):
+        self._snapshot = snapshot
+        self.counters['refreshes'] += 1
+        self.last_error = None
+        logger.debug("Fleet snapshot v%d published (revision %s)", snapshot.version, snapshot.revision)
+        if changed:
+            self._notify(previous, snapshot)
+        return snapshot
+
+    def _refresh_shared(self, force):
+        current = self._adopt_stored()
+        if not force and current is not None and not self.store.is_due(self.interval):
+            return current
+        if not self.store.acquire_lease():
+            # Un autre worker est en train de lire le classeur
+            return current
+        try:
+            snapshot, changed = self._build(force)
+            if snapshot is current:
+                return current
+            if not self.store.save(snapshot):
+                # Un patch d'un autre worker est passé entre-temps : on prend le sien, la
+                # synchro suivante relira le classeur par-dessus
+                self.counters['store_conflicts'] += 1
+                return self._adopt_stored()
+            return self._publish(current, snapshot, changed)
+        finally:
+            self.store.release_lease()
+
+    def _refresh(self, force):
+        previous = self._snapshot
+        snapshot, changed = self._build(force)
+        if snapshot is previous:
+            return previous
+        return self._publish(previous, snapshot, changed)
+
+    def _build(self, force):
+        """The next snapshot and whether any payload changed, without publishing it"""
+        previous = self._snapshot
+        revision = self._current_revision()
+        if not force and previous is not None and revision is not None and revision == previous.revision:
+            if not self._expired(previous):
+                self.counters['unchanged_revision'] += 1
+                self.last_error = None
+                logger.debug("Spreadsheet unchanged (revision %s), skipping refresh", revision)
+                return previous, False
+            # Même révision, mais les formules (TODAY()...) ont pu changer les valeurs depuis
+            self.counters['expired'] += 1
+            logger.debug("Spreadsheet unchanged (revision %s) but read at %s, refreshing", revision, previous.fetched_at)
+
+        sources = self.fetch_values()
+        digests = {name: digest_values(values) for name, values in sources.items()}
+
+        version = previous.version + 1 if previous is not None else 1
+        payloads = {}
+        bodies = {}
+        payload_versions = {}
+        etags = {}
+        changed = False
+        for name, (source, build) in self.builders.items():
+            if previous is not None and name in previous.payloads and previous.digests.get(source) == digests[source]:
+                payloads[name] = previous.payloads[name]
+                bodies[name] = previous.bodies[name]
+                payload_versions[name] = previous.payload_versions[name]
+                etags[name] = previous.etags[name]
+                self.counters['payloads_reused'] += 1
+                continue
+            payloads[name] = build(sources[source])
+            bodies[name] = self.serialize(payloads[name])
+            payload_versions[name] = version
+            self.counters['payloads_rebuilt'] += 1
+            changed = True
+
+        if not changed:
+            version = previous.version
+
+        snapshot = FleetSnapshot(
+            version, payloads, bodies,
+            payload_versions=payload_versions,
+            revision=revision,
+            digests=digests,
+            etags=etags
+        )
+        return snapshot, changed
+
+    def _patched(self, base, update):
+        """``base`` with ``update(base)`` applied as the next version, or None if it changes nothing"""
+        changes = update(base)
+        if not changes:
+            return None
+        version = base.version + 1
+        payloads = dict(base.payloads)
+        bodies = dict(base.bodies)
+        payload_versions = dict(base.payload_versions)
+        digests = dict(base.digests)
+        etags = dict(base.etags)
+        for name, payload in changes.items():
+            payloads[name] = payload
+            bodies[name] = self.serialize(payload)
+            payload_versions[name] = version
+            digests.pop(self.builders[name][0], None)
+            etags.pop(name, None)
+        return FleetSnapshot(
+            version, payloads, bodies,
+            payload_versions=payload_versions,
+            digests=digests,
+            fetched_at=base.fetched_at,
+            etags=etags
+        )
+
+    def patch(self, update):
+        """Publish ``update(snapshot)`` on top of the current snapshot, without reading the sheet.
+
+        ``update`` returns ``{name: payload}`` for the payloads it changes, or
+        nothing to leave the snapshot as it is; it runs under the refresh
+        lock, so patches and refreshes apply one after the other.  This is
+        how edits written back to the sheet show up before the write lands.
+        The new snapshot has no revision and lacks the digests of the patched
+        payloads' ranges, so the next sync reads the sheet again and replaces
+        them with what it actually holds.
+
+        With a store, the patch is applied to the stored snapshot inside the
+        store's write transaction, so patches from several workers stack up
+        as successive versions instead of two of them claiming the same one.
+
+        Returns the published snapshot, the unchanged one when ``update``
+        changes nothing, or None when the patch was not applied: there is no
+        snapshot yet, or the store could not be written.
+        """
+        with self._refresh_lock:
+            previous = self._snapshot
+            if self.store is None:
+                if previous is None:
+                    return None
+                base = previous
+                snapshot = self._patched(base, update)
+            else:
+                bases = []
+
+                def apply(stored):
+                    bases.append(self._from_stored(stored, previous) if self._is_newer(stored, previous) else previous)
+                    return self._patched(bases[0], update) if bases[0] is not None else None
+
+                try:
+                    snapshot = self.store.update(apply, self._known_versions())
+                except Exception as e:
+                    # Rien n'est publié : la prochaine synchro montrera l'édition une fois écrite
+                    logger.error(f"Error storing patched snapshot: {str(e)}")
+                    logger.error(traceback.format_exc())
+                    return None
+                base = bases[0]
+                if base is not previous:
+                    self._adopt(base)
+
+            if snapshot is None:
+                return base
+            self._snapshot = snapshot
+            self.counters['patches'] += 1
+            logger.debug("Fleet snapshot v%d published (patched)", snapshot.version)
+            self._notify(base, snapshot)
+            return snapshot
+
+    def status(self):
+        snapshot = self._snapshot
+        status = {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'interval': self.interval,
+            'version': snapshot.version if snapshot else None,
+            'revision': snapshot.revision if snapshot else None,
+            'fetched_at': snapshot.fetched_at if snapshot else None,
+            'last_checked': self.last_checked,
+            'last_duration': self.last_duration,
+            'last_error': self.last_error
+        }
+        status.update(self.counters)
+        return status
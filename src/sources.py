@@ -0,0 +1,251 @@
+"""Where the fleet data comes from.
+
+The app reads its ranges through a SheetSource.  GoogleSheetSource talks to
+the Sheets API; LocalSheetSource replays ranges recorded to a JSON or SQLite
+file, with optional injected latency, so the app can run offline and be
+load-tested deterministically.  SHEET_SOURCE selects the backend:
+
+    SHEET_SOURCE=google                      (default)
+    SHEET_SOURCE=local SHEET_SOURCE_PATH=recordings/fleet.json SHEET_SOURCE_LATENCY_MS=150
+
+Record the live ranges once with:
+
+    python -m src.sources record recordings/fleet.json
+"""
+import abc
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+
+from src.metrics import Histogram
+from src.sheets import batch_get_values, batch_update_values, cell_in_range, get_spreadsheet_revision, service_manager
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_SECONDS = Histogram(
+    'fleet_upstream_request_duration_seconds',
+    'Time spent reading from the sheet source, per call and range',
+    ['source', 'operation', 'range']
+)
+
+
+def _range_label(ranges):
+    return ','.join(range_name for range_name, _ in ranges)
+
+
+class SheetSource(abc.ABC):
+    """Access to the ranges of one spreadsheet; a source missing batch_get or write_cells cannot be created."""
+
+    name = 'abstract'
+
+    @abc.abstractmethod
+    def batch_get(self, ranges):
+        """Rows for each ``(range_name, value_render_option)`` pair, in order."""
+
+    def get(self, range_name, value_render_option=None):
+        return self.batch_get([(range_name, value_render_option)])[0]
+
+    def revision(self):
+        """A value that changes whenever the data changes, or None if unknown."""
+        return None
+
+    @abc.abstractmethod
+    def write_cells(self, range_name, cells):
+        """Set ``{(row, column): value}``, 0-based from the top-left of ``range_name``, in one call."""
+
+
+class GoogleSheetSource(SheetSource):
+    name = 'google'
+
+    def __init__(self, spreadsheet_id, manager=None):
+        self.spreadsheet_id = spreadsheet_id
+        self.manager = manager or service_manager
+        self._revision_available = True
+
+    def batch_get(self, ranges):
+        with UPSTREAM_SECONDS.labels(self.name, 'batch_get', _range_label(ranges)).time():
+            return batch_get_values(self.spreadsheet_id, ranges, manager=self.manager)
+
+    def get(self, range_name, value_render_option=None):
+        params = {'spreadsheetId': self.spreadsheet_id, 'range': range_name}
+        if value_render_option:
+            params['valueRenderOption'] = value_render_option
+        with UPSTREAM_SECONDS.labels(self.name, 'get', range_name).time():
+            result = self.manager.execute(lambda service: service.spreadsheets().values().get(**params))
+        return result.get('values', [])
+
+    def write_cells(self, range_name, cells):
+        a1_cells = {cell_in_range(range_name, row, column): value for (row, column), value in cells.items()}
+        with UPSTREAM_SECONDS.labels(self.name, 'write', range_name).time():
+            return batch_update_values(self.spreadsheet_id, a1_cells, manager=self.manager)
+
+    def revision(self):
+        from googleapiclient.errors import HttpError
+
+        if not self._revision_available:
+            return None
+        try:
+            with UPSTREAM_SECONDS.labels(self.name, 'revision', '').time():
+                return get_spreadsheet_revision(self.spreadsheet_id, manager=self.manager)
+        except HttpError as e:
+            if e.resp.status in (403, 404):
+                # Drive API désactivée ou fichier non partagé : on recharge tout à chaque cycle
+                self._revision_available = False
+                logger.warning(f"Drive metadata not readable ({e.resp.status}), change detection disabled")
+                return None
+            raise
+
+
+class LocalSheetSource(SheetSource):
+    """Replays recorded ranges from a JSON or SQLite file.
+
+    JSON files hold ``{"ranges": {range_name: {render_option: rows}}}``;
+    SQLite files a ``ranges(range_name, render_option, rows)`` table with
+    rows stored as JSON.  A missing render option falls back to
+    ``FORMATTED_VALUE``, the API default.  Every call sleeps ``latency``
+    seconds, plus up to ``jitter`` seconds, to stand in for the network.
+    The revision is the file's modification time, so editing the recording
+    is seen as a spreadsheet change.
+    """
+
+    name = 'local'
+
+    def __init__(self, path, latency=0.0, jitter=0.0):
+        self.path = path
+        self.latency = latency
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self._loaded_mtime = None
+        self._ranges = {}
+
+    def _is_sqlite(self):
+        return self.path.endswith(('.db', '.sqlite', '.sqlite3'))
+
+    def _load(self):
+        mtime = os.path.getmtime(self.path)
+        with self._lock:
+            if mtime == self._loaded_mtime:
+                return self._ranges
+            if self._is_sqlite():
+                with sqlite3.connect(self.path) as db:
+                    ranges = {}
+                    for range_name, render_option, rows in db.execute(
+                            'SELECT range_name, render_option, rows FROM ranges'):
+                        ranges.setdefault(range_name, {})[render_option] = json.loads(rows)
+            else:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    ranges = json.load(f).get('ranges', {})
+            self._ranges = ranges
+            self._loaded_mtime = mtime
+            logger.info(f"Loaded {len(ranges)} recorded ranges from {self.path}")
+            return ranges
+
+    def _wait(self):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def batch_get(self, ranges):
+        with UPSTREAM_SECONDS.labels(self.name, 'batch_get', _range_label(ranges)).time():
+            self._wait()
+            recorded = self._load()
+        results = []
+        for range_name, value_render_option in ranges:
+            by_option = recorded.get(range_name)
+            if by_option is None:
+                logger.warning(f"Range {range_name} not in recording {self.path}")
+                results.append([])
+                continue
+            rows = by_option.get(value_render_option or 'FORMATTED_VALUE')
+            if rows is None:
+                rows = by_option.get('FORMATTED_VALUE', [])
+            results.append(rows)
+        return results
+
+    def revision(self):
+        return str(os.path.getmtime(self.path))
+
+    def write_cells(self, range_name, cells):
+        """Edit the recording in place, for every render option of the range"""
+        with UPSTREAM_SECONDS.labels(self.name, 'write', range_name).time():
+            self._wait()
+            # Copie des lignes : celles déjà renvoyées par get() ne changent pas sous le lecteur
+            edited = {option: [list(row) for row in rows] for option, rows in self._load().get(range_name, {}).items()}
+            for rows in edited.values():
+                for (row, column), value in cells.items():
+                    while len(rows) <= row:
+                        rows.append([])
+                    rows[row].extend([''] * (column + 1 - len(rows[row])))
+                    rows[row][column] = value
+            with self._lock:
+                save_recording(self.path, dict(self._ranges, **{range_name: edited}))
+                # Relu au prochain appel : la date de modification sert de révision
+                self._loaded_mtime = None
+        return len(cells)
+
+
+def save_recording(path, recorded):
+    """Write ``{range_name: {render_option: rows}}`` in the format LocalSheetSource reads."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if path.endswith(('.db', '.sqlite', '.sqlite3')):
+        with sqlite3.connect(path) as db:
+            db.execute('CREATE TABLE IF NOT EXISTS ranges ('
+                       'range_name TEXT, render_option TEXT, rows TEXT, '
+                       'PRIMARY KEY (range_name, render_option))')
+            db.executemany(
+                'INSERT OR REPLACE INTO ranges VALUES (?, ?, ?)',
+                [(range_name, option, json.dumps(rows, ensure_ascii=False))
+                 for range_name, by_option in recorded.items()
+                 for option, rows in by_option.items()]
+            )
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'ranges': recorded}, f, ensure_ascii=False)
+
+
+def get_sheet_source(spreadsheet_id, settings):
+    """The SHEET_SOURCE backend for ``spreadsheet_id``, from the app's settings (see src/settings.py)"""
+    kind = settings['SHEET_SOURCE'].lower()
+    if kind == 'google':
+        return GoogleSheetSource(spreadsheet_id)
+    if kind == 'local':
+        # '{spreadsheet_id}' dans le chemin : un enregistrement par classeur (agences fédérées)
+        path = settings['SHEET_SOURCE_PATH'].replace('{spreadsheet_id}', spreadsheet_id or '')
+        latency = float(settings['SHEET_SOURCE_LATENCY_MS']) / 1000
+        jitter = float(settings['SHEET_SOURCE_JITTER_MS']) / 1000
+        logger.info(f"Using local sheet source {path} (latency {latency * 1000:.0f} ms)")
+        return LocalSheetSource(path, latency=latency, jitter=jitter)
+    raise ValueError(f"Unknown SHEET_SOURCE '{kind}' (expected 'google' or 'local')")
+
+
+def source_identity(spreadsheet_ids, settings):
+    """What snapshots are read from: the SHEET_SOURCE backend (with the recording for 'local') and the spreadsheets"""
+    kind = settings['SHEET_SOURCE'].lower()
+    if kind == 'local':
+        kind = f"local:{settings['SHEET_SOURCE_PATH']}"
+    return f"{kind}|{','.join(spreadsheet_ids)}"
+
+
+def record(path):
+    """Fetch every range the app reads from Google and save them for LocalSheetSource."""
+    from src.app import SNAPSHOT_RANGES
+    from src.settings import load_settings
+
+    source = GoogleSheetSource(load_settings()['SPREADSHEET_ID'])
+    recorded = {}
+    for (range_name, option), rows in zip(SNAPSHOT_RANGES, source.batch_get(SNAPSHOT_RANGES)):
+        recorded.setdefault(range_name, {})[option or 'FORMATTED_VALUE'] = rows
+    save_recording(path, recorded)
+    print(f"Recorded {len(SNAPSHOT_RANGES)} ranges to {path}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] != 'record':
+        print('usage: python -m src.sources record <path.json|path.db>')
+        sys.exit(2)
+    record(sys.argv[2])
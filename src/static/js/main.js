@@ -14,10 +14,45 @@ document.addEventListener('DOMContentLoaded', function() {
     // Initial data load
     refreshData();
     
-    // Set up auto-refresh every 5 minutes
-    setInterval(refreshData, 300000);
+    // Reload whenever the server pushes a new snapshot
+    subscribeToUpdates(refreshData);
 });
 
+// Server-Sent Events, with a long-poll fallback when EventSource is missing or the stream is refused
+function subscribeToUpdates(onUpdate) {
+    let version = 0;
+    if (window.EventSource) {
+        const source = new EventSource('/api/stream');
+        source.addEventListener('snapshot', onUpdate);
+        source.addEventListener('resync', onUpdate);
+        // Stream refused (503 when the server has too many open): long-poll instead
+        source.onerror = () => {
+            if (source.readyState === EventSource.CLOSED) {
+                poll();
+            }
+        };
+        return;
+    }
+
+    async function poll() {
+        try {
+            const response = await fetch(`/api/updates?since=${version}`);
+            if (response.status === 200) {
+                version = (await response.json()).version;
+                onUpdate();
+            } else if (response.headers.has('Retry-After')) {
+                // Server busy: wait before asking again
+                await new Promise(resolve => setTimeout(resolve, Number(response.headers.get('Retry-After')) * 1000));
+            }
+        } catch (error) {
+            console.error('Error polling updates:', error);
+            await new Promise(resolve => setTimeout(resolve, 30000));
+        }
+        poll();
+    }
+    poll();
+}
+
 // Sidebar functionality
 function initializeSidebar() {
     const sidebarCollapse = document.getElementById('sidebarCollapse');
@@ -0,0 +1,244 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshot_meta (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL,
+    revision TEXT,
+    fetched_at TEXT,
+    digests TEXT NOT NULL,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS payloads (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    body BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    checked_at REAL NOT NULL DEFAULT 0,
+    holder TEXT,
+    lease_expires_at REAL NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO sync_state (id) VALUES (1);
+"""
+
+
+def connect(path):
+    db = sqlite3.connect(path, timeout=10, isolation_level=None)
+    db.execute('PRAGMA synchronous=NORMAL')
+    return db
+
+
+def initialize_database(path, schema, attempts=50):
+    """Create ``schema`` in a WAL-mode database at ``path``.
+
+    Workers booting together race for the lock needed to switch the journal
+    mode, and SQLite reports that as 'database is locked' without waiting,
+    so the setup is retried for a few seconds.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    for attempt in range(attempts):
+        try:
+            with closing(connect(path)) as db:
+                if db.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+                    db.execute('PRAGMA journal_mode=WAL')
+                db.executescript(schema)
+            return
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) or attempt == attempts - 1:
+                raise
+            time.sleep(0.1)
+
+
+class SnapshotStore:
+    """The published fleet snapshot, shared by every worker through SQLite.
+
+    The file holds the latest snapshot's version, revision and range
+    digests, and the serialized body of each payload with the version at
+    which it last changed.  WAL mode lets workers read while the leader
+    writes.  ``sync_state`` records when the spreadsheet was last checked
+    and which worker holds the refresh lease, so that only one worker per
+    interval talks to Google; the others adopt what it stored.
+
+    ``source`` identifies what the snapshot is read from (see
+    source_identity() in src/sources.py): a snapshot stored from another
+    source, say a local recording left by a benchmark, is treated as
+    missing and replaced by the next save.
+    """
+
+    def __init__(self, path, lease_ttl=120, source=None):
+        self.path = path
+        self.lease_ttl = lease_ttl
+        self.source = source
+        initialize_database(path, SCHEMA)
+        with closing(connect(path)) as db:
+            # Stores créés avant la colonne source
+            if 'source' not in {row[1] for row in db.execute('PRAGMA table_info(snapshot_meta)')}:
+                try:
+                    db.execute('ALTER TABLE snapshot_meta ADD COLUMN source TEXT')
+                except sqlite3.OperationalError as e:
+                    if 'duplicate column' not in str(e):
+                        raise
+
+    @property
+    def holder(self):
+        # Calculé à chaque appel : avec --preload le store est créé avant le fork des workers
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def _connect(self):
+        return connect(self.path)
+
+    def load(self, known_versions=None):
+        """The stored snapshot, or None if the store is empty.
+
+        Returns ``version, revision, fetched_at, digests, payload_versions``
+        and ``bodies``; bodies are only read for payloads whose version
+        differs from ``known_versions`` (``{name: version}`` already held).
+        """
+        with closing(self._connect()) as db:
+            db.execute('BEGIN')
+            try:
+                return self._read(db, known_versions or {})
+            finally:
+                db.execute('COMMIT')
+
+    def _stored_source(self, db):
+        """Version stored for our source, or None if the store is empty or holds another source"""
+        row = db.execute('SELECT version, source FROM snapshot_meta WHERE id = 1').fetchone()
+        if row is None or (self.source is not None and row[1] != self.source):
+            return None
+        return row[0]
+
+    def _read(self, db, known_versions):
+        if self._stored_source(db) is None:
+            return None
+        meta = db.execute('SELECT version, revision, fetched_at, digests FROM snapshot_meta WHERE id = 1').fetchone()
+        payload_versions = dict(db.execute('SELECT name, version FROM payloads'))
+        bodies = {}
+        for name, version in payload_versions.items():
+            if known_versions.get(name) != version:
+                bodies[name] = db.execute('SELECT body FROM payloads WHERE name = ?', (name,)).fetchone()[0]
+        version, revision, fetched_at, digests = meta
+        return {
+            'version': version,
+            'revision': revision,
+            'fetched_at': fetched_at,
+            'digests': json.loads(digests),
+            'payload_versions': payload_versions,
+            'bodies': bodies
+        }
+
+    def version(self):
+        with closing(self._connect()) as db:
+            return self._stored_source(db)
+
+    def _conflicts(self, db, snapshot):
+        """Why ``snapshot`` must not replace what the store holds, or None"""
+        stored_version = self._stored_source(db)
+        if stored_version is None or stored_version < snapshot.version:
+            return None
+        if stored_version > snapshot.version:
+            return f"store already at v{stored_version}"
+        # Même version : acceptée seulement si c'est le même contenu, sinon deux workers
+        # serviraient des corps différents sous le même ETag
+        stored = dict(db.execute('SELECT name, version FROM payloads'))
+        if stored != dict(snapshot.payload_versions):
+            return f"store holds a different v{stored_version}"
+        for name, version in stored.items():
+            if version != snapshot.version:
+                continue
+            body, = db.execute('SELECT body FROM payloads WHERE name = ?', (name,)).fetchone()
+            if body != snapshot.bodies[name]:
+                return f"store holds a different v{stored_version}"
+        return None
+
+    def _write(self, db, snapshot):
+        if self._stored_source(db) is None:
+            # Store vide ou d'une autre source : rien de ce qu'il contient ne doit rester
+            db.execute('DELETE FROM payloads')
+        db.execute(
+            'INSERT OR REPLACE INTO snapshot_meta (id, version, revision, fetched_at, digests, source) '
+            'VALUES (1, ?, ?, ?, ?, ?)',
+            (snapshot.version, snapshot.revision, snapshot.fetched_at, json.dumps(dict(snapshot.digests)),
+             self.source)
+        )
+        db.executemany(
+            'INSERT INTO payloads (name, version, body) VALUES (?, ?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET version = excluded.version, body = excluded.body '
+            'WHERE excluded.version != payloads.version',
+            [(name, snapshot.payload_versions[name], snapshot.bodies[name]) for name in snapshot.bodies]
+        )
+
+    def save(self, snapshot):
+        """Store ``snapshot`` unless the store holds a newer version, or another one with the same number"""
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                conflict = self._conflicts(db, snapshot)
+                if conflict is not None:
+                    db.execute('ROLLBACK')
+                    logger.warning(f"Not storing snapshot v{snapshot.version}, {conflict}")
+                    return False
+                self._write(db, snapshot)
+                db.execute('COMMIT')
+                return True
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+    def update(self, build, known_versions=None):
+        """Compare-and-swap: store ``build(stored)`` computed from the stored snapshot, under the write lock.
+
+        ``stored`` is what load(known_versions) would return, and nobody can
+        write between that read and the write of the snapshot ``build``
+        returns (None to store nothing), which is returned.
+        """
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                snapshot = build(self._read(db, known_versions or {}))
+                if snapshot is not None:
+                    self._write(db, snapshot)
+                db.execute('COMMIT')
+                return snapshot
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+    def is_due(self, interval):
+        """Whether nobody has checked the spreadsheet in the last ``interval`` seconds"""
+        with closing(self._connect()) as db:
+            checked_at, = db.execute('SELECT checked_at FROM sync_state WHERE id = 1').fetchone()
+        return time.time() - checked_at >= interval
+
+    def acquire_lease(self):
+        now = time.time()
+        with closing(self._connect()) as db:
+            cursor = db.execute(
+                'UPDATE sync_state SET holder = ?, lease_expires_at = ? '
+                'WHERE id = 1 AND (lease_expires_at < ? OR holder = ?)',
+                (self.holder, now + self.lease_ttl, now, self.holder)
+            )
+            return cursor.rowcount == 1
+
+    def release_lease(self):
+        """Give the lease back, recording the check so the next one waits a full interval.
+
+        The check is recorded even when the refresh failed, so an upstream
+        outage costs one attempt per interval rather than one per worker.
+        """
+        with closing(self._connect()) as db:
+            db.execute(
+                'UPDATE sync_state SET holder = NULL, lease_expires_at = 0, checked_at = ? '
+                'WHERE id = 1 AND holder = ?',
+                (time.time(), self.holder)
+            )
@@ -0,0 +1,297 @@
+"""Keeping sheet reads within the Sheets API quota.
+
+GuardedSheetSource wraps the configured SheetSource so that every read
+goes through:
+
+* a token-bucket rate limit shared by all gunicorn workers of the host
+  (the bucket lives in a small file locked with flock);
+* retries with jittered exponential backoff on 429, 5xx and network
+  errors, honouring Retry-After;
+* a circuit breaker that fails fast after repeated failures, so callers
+  keep serving the last good snapshot instead of piling onto an API that
+  is already refusing them.
+"""
+import logging
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+
+from src.sources import SheetSource
+
+try:
+    import fcntl
+except ImportError:  # pas de flock hors Unix : limite par processus seulement
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+class UpstreamUnavailable(Exception):
+    """The read was not attempted: rate limit exhausted or circuit open."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """``rate`` tokens per second, up to ``burst``, shared through ``path``.
+
+    The bucket state (tokens left, time of the last refill) is 16 bytes in
+    a file, read and written under an exclusive flock so every process that
+    opens the same path draws from the same bucket.  Without a path, or
+    without fcntl, the bucket is per process.
+    """
+
+    _STATE = struct.Struct('dd')
+
+    def __init__(self, rate, burst, path=None):
+        self.rate = rate
+        self.burst = burst
+        self.path = path if fcntl is not None else None
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = time.time()
+
+    def _take(self, tokens, updated, now):
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, 0.0
+        return tokens, (1 - tokens) / self.rate
+
+    def _try_acquire(self):
+        """Take a token if one is available; return how long to wait otherwise"""
+        now = time.time()
+        with self._lock:
+            if self.path is None:
+                self._tokens, wait = self._take(self._tokens, self._updated, now)
+                self._updated = now
+                return wait
+
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                data = os.pread(fd, self._STATE.size, 0)
+                tokens, updated = self._STATE.unpack(data) if len(data) == self._STATE.size else (self.burst, now)
+                tokens, wait = self._take(tokens, updated, now)
+                os.pwrite(fd, self._STATE.pack(tokens, now), 0)
+                return wait
+            finally:
+                os.close(fd)
+
+    def acquire(self, timeout):
+        """Wait up to ``timeout`` seconds for a token; False if none came in time"""
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self._try_acquire()
+            if wait == 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """Closed, open after ``failure_threshold`` consecutive failures, half-open after ``reset_timeout``.
+
+    While open every call is refused without reaching the API.  Once
+    ``reset_timeout`` has passed a single probe call goes through: success
+    closes the circuit, failure opens it again for another period.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return None
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Sheets API reachable again, circuit closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def release(self):
+        """Give up a call allowed by allow() without an outcome (e.g. no rate-limit token)"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"Circuit opened after {self.failures} failed Sheets reads, "
+                                   f"retrying in {self.reset_timeout}s")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+def _is_retryable(error):
+    from googleapiclient.errors import HttpError
+
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUSES
+    return isinstance(error, OSError)
+
+
+def _retry_after(error):
+    from googleapiclient.errors import HttpError
+
+    if isinstance(error, HttpError):
+        value = error.resp.get('retry-after')
+        if value and value.isdigit():
+            return float(value)
+    return None
+
+
+class GuardedSheetSource(SheetSource):
+    """A SheetSource whose reads are rate limited, retried and circuit broken."""
+
+    def __init__(self, source, limiter, breaker, retries=3, backoff_base=0.5, backoff_max=30,
+                 acquire_timeout=10):
+        self.source = source
+        self.name = source.name
+        self.limiter = limiter
+        self.breaker = breaker
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.acquire_timeout = acquire_timeout
+        self._counters_lock = threading.Lock()
+        self.counters = {
+            'calls': 0,
+            'retries': 0,
+            'failures': 0,
+            'rate_limited': 0,
+            'short_circuited': 0
+        }
+
+    def _count(self, name):
+        with self._counters_lock:
+            self.counters[name] += 1
+
+    def _backoff(self, attempt, error):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def _call(self, operation, *args):
+        if not self.breaker.allow():
+            self._count('short_circuited')
+            raise UpstreamUnavailable('Sheets API circuit open', retry_after=self.breaker.retry_after())
+
+        attempt = 0
+        while True:
+            if not self.limiter.acquire(self.acquire_timeout):
+                self._count('rate_limited')
+                # Pas un échec de l'API : on rend la main sans toucher au disjoncteur
+                self.breaker.release()
+                raise UpstreamUnavailable('Sheets API rate limit exhausted', retry_after=1 / self.limiter.rate)
+            self._count('calls')
+            try:
+                result = getattr(self.source, operation)(*args)
+            except Exception as e:
+                if not _is_retryable(e):
+                    # L'API a répondu (400, 404...) : ce n'est pas une panne
+                    self.breaker.record_success()
+                    raise
+                if attempt >= self.retries:
+                    self._count('failures')
+                    self.breaker.record_failure()
+                    raise
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                self._count('retries')
+                logger.warning(f"Sheets {operation} failed ({str(e)}), retry {attempt}/{self.retries} in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def batch_get(self, ranges):
+        return self._call('batch_get', ranges)
+
+    def get(self, range_name, value_render_option=None):
+        return self._call('get', range_name, value_render_option)
+
+    def revision(self):
+        return self._call('revision')
+
+    def write_cells(self, range_name, cells):
+        # Les valeurs écrites sont absolues : rejouer l'appel après une erreur est sans risque
+        return self._call('write_cells', range_name, cells)
+
+    def circuit_open(self):
+        return self.breaker.state == self.breaker.OPEN
+
+    def status(self):
+        with self._counters_lock:
+            status = dict(self.counters)
+        status['circuit'] = self.breaker.state
+        status['consecutive_failures'] = self.breaker.failures
+        return status
+
+
+def _bucket_path(path):
+    if path is not None:
+        return path or None
+    # Même parent pour tous les workers gunicorn : un seau partagé par instance du master
+    return os.path.join(tempfile.gettempdir(), f"fleet-ratelimit-{os.getppid()}")
+
+
+def guard_source(source, settings):
+    """Wrap ``source`` with the UPSTREAM_* limits of the app's settings (see src/settings.py)"""
+    limiter = TokenBucket(
+        rate=settings['UPSTREAM_RATE_PER_MINUTE'] / 60,
+        burst=settings['UPSTREAM_BURST'],
+        path=_bucket_path(settings['UPSTREAM_RATE_FILE'])
+    )
+    breaker = CircuitBreaker(
+        failure_threshold=settings['UPSTREAM_FAILURE_THRESHOLD'],
+        reset_timeout=settings['UPSTREAM_RESET_TIMEOUT']
+    )
+    return GuardedSheetSource(
+        source, limiter, breaker,
+        retries=settings['UPSTREAM_RETRIES'],
+        backoff_base=settings['UPSTREAM_BACKOFF_BASE'],
+        backoff_max=settings['UPSTREAM_BACKOFF_MAX'],
+        acquire_timeout=settings['UPSTREAM_ACQUIRE_TIMEOUT']
+    )
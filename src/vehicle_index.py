@@ -0,0 +1,150 @@
+import base64
+import binascii
+import json
+import re
+from bisect import bisect_left, bisect_right
+
+from src.diff import vehicle_keys
+
+SORT_FIELDS = ('immatriculation', 'type', 'status', 'category')
+
+_PLATE_SEPARATORS = re.compile(r'[\s\-]')
+
+
+def normalize_plate(plate):
+    """'gg-441-sx' and 'GG 441 SX' both become 'GG441SX'"""
+    return _PLATE_SEPARATORS.sub('', plate or '').upper()
+
+
+class VehicleIndex:
+    """Lookup structures over one parsed inventory, built once per version.
+
+    Vehicles are numbered in inventory order.  Exact filters (plate, type,
+    status, category, agency) are dict lookups returning sets of numbers, plate
+    prefixes are a bisect over the sorted plates, and each sort field has
+    its vehicles pre-sorted on ``(value, stable key)`` so a page is a bisect
+    from the cursor.  The stable key is the (category, plate, occurrence)
+    key from src/diff.py, which is what makes cursors survive a refresh.
+    """
+
+    def __init__(self, categories):
+        keyed = vehicle_keys(categories)
+        self.vehicles = list(keyed.values())
+        self.stable_keys = [f"{category}\x1f{ident}\x1f{occurrence}" for category, ident, occurrence in keyed]
+
+        self.by_plate = {}
+        self.by_field = {'type': {}, 'status': {}, 'category': {}, 'agency': {}}
+        for number, vehicle in enumerate(self.vehicles):
+            plate = normalize_plate(vehicle.immatriculation)
+            if plate:
+                self.by_plate.setdefault(plate, set()).add(number)
+            for field, index in self.by_field.items():
+                index.setdefault((getattr(vehicle, field) or '').lower(), set()).add(number)
+
+        self.plates = sorted(self.by_plate)
+
+        self.sort_keys = {}
+        self.sorted_numbers = {}
+        for field in SORT_FIELDS:
+            keys = [(self._sort_value(vehicle, field), self.stable_keys[number])
+                    for number, vehicle in enumerate(self.vehicles)]
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+            self.sort_keys[field] = keys
+            self.sorted_numbers[field] = order
+
+    @staticmethod
+    def _sort_value(vehicle, field):
+        if field == 'immatriculation':
+            return normalize_plate(vehicle.immatriculation)
+        return getattr(vehicle, field).lower()
+
+    def _plate_prefix(self, prefix):
+        prefix = normalize_plate(prefix)
+        start = bisect_left(self.plates, prefix)
+        end = bisect_left(self.plates, prefix + '\uffff')
+        numbers = set()
+        for plate in self.plates[start:end]:
+            numbers |= self.by_plate[plate]
+        return numbers
+
+    def match(self, immatriculation=None, plate_prefix=None, **fields):
+        """Numbers of the vehicles matching every filter given, or None when no filter is given.
+
+        ``fields`` maps type/status/category/agency to a list of accepted values.
+        """
+        candidates = []
+        if immatriculation is not None:
+            candidates.append(self.by_plate.get(normalize_plate(immatriculation), set()))
+        if plate_prefix:
+            candidates.append(self._plate_prefix(plate_prefix))
+        for field, values in fields.items():
+            if values is None:
+                continue
+            index = self.by_field[field]
+            matched = set()
+            for value in values:
+                matched |= index.get(value.lower(), set())
+            candidates.append(matched)
+        if not candidates:
+            return None
+        candidates.sort(key=len)
+        return candidates[0].intersection(*candidates[1:])
+
+    def search(self, sort='immatriculation', descending=False, limit=50, after=None, **filters):
+        """One page of matching vehicles: ``(vehicles, total, last_sort_key)``.
+
+        ``after`` is the sort key of the last vehicle of the previous page;
+        ``last_sort_key`` is None on the last page.
+        """
+        keys = self.sort_keys[sort]
+        matched = self.match(**filters)
+        if matched is None:
+            ordered = self.sorted_numbers[sort]
+        else:
+            ordered = sorted(matched, key=keys.__getitem__)
+        total = len(ordered)
+
+        lookup = _KeyView(keys, ordered)
+        if descending:
+            end = bisect_left(lookup, after) if after is not None else total
+            page = ordered[max(0, end - limit):end][::-1]
+            more = end - limit > 0
+        else:
+            start = bisect_right(lookup, after) if after is not None else 0
+            page = ordered[start:start + limit]
+            more = start + limit < total
+
+        last = keys[page[-1]] if page and more else None
+        return [self.vehicles[number] for number in page], total, last
+
+
+class _KeyView:
+    """Sort keys of ``ordered`` as a sequence, for bisect without copying them"""
+
+    def __init__(self, keys, ordered):
+        self._keys = keys
+        self._ordered = ordered
+
+    def __len__(self):
+        return len(self._ordered)
+
+    def __getitem__(self, position):
+        return self._keys[self._ordered[position]]
+
+
+def encode_cursor(sort, descending, key):
+    data = json.dumps([sort, descending, list(key)], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(sort, descending, key) from a cursor; ValueError if it is not one of ours"""
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort, descending, key = json.loads(data)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise ValueError('invalid cursor') from e
+    if sort not in SORT_FIELDS or not isinstance(key, list) or len(key) != 2 \
+            or not all(isinstance(part, str) for part in key):
+        raise ValueError('invalid cursor')
+    return sort, bool(descending), tuple(key)
@@ -0,0 +1,189 @@
+"""Edits to the spreadsheet, queued and written in batches.
+
+Operators change a vehicle's status from the dashboard faster than the
+Sheets quota allows one call per click, so edits are queued by cell and
+flushed every ``interval`` seconds: a cell edited several times between two
+flushes is written once, with its last value, and a flush is a single call
+to ``write`` for every cell pending.
+"""
+import atexit
+import logging
+import threading
+import time
+import traceback
+
+from src.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = Histogram('fleet_writeback_flush_duration_seconds', 'Time to write one batch of edits to the sheet')
+EDIT_LATENCY = Histogram(
+    'fleet_writeback_edit_latency_seconds', 'Time from an edit being queued to it being written to the sheet'
+)
+EDITS = Counter(
+    'fleet_writeback_edits_total', 'Edits queued, coalesced into a pending one, written, rejected or dropped',
+    ['result']
+)
+
+
+class WriteBackQueue:
+    """Pending edits keyed by cell, written by a background thread.
+
+    ``write(edits)`` receives ``{key: value}`` and returns ``{key: reason}``
+    for the edits it could not apply (the cell no longer exists...), which
+    are dropped; if it raises, the whole batch is put back and retried at
+    the next flush, unless a newer edit of the same cell was queued
+    meanwhile.  An edit is dropped after ``max_attempts`` failed flushes.
+    ``on_failure({key: (value, reason)})`` is called once per flush with
+    every edit rejected or dropped, so the caller can undo what it showed.
+    """
+
+    def __init__(self, write, interval=2.0, max_attempts=5, on_failure=None):
+        self.write = write
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.on_failure = on_failure
+        # key -> (value, queued_at, attempts)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_error = None
+        self.last_flush_seconds = None
+        self.counters = {
+            'queued': 0,
+            'coalesced': 0,
+            'flushes': 0,
+            'written': 0,
+            'rejected': 0,
+            'failed_flushes': 0,
+            'dropped': 0
+        }
+
+    def enqueue(self, key, value):
+        """Queue ``value`` for the cell ``key``, replacing an edit of it still pending; returns the number pending"""
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                # Même cellule modifiée avant la prochaine écriture : seule la dernière valeur part
+                self._pending[key] = (value, pending[1], 0)
+                self.counters['coalesced'] += 1
+                EDITS.labels('coalesced').inc()
+            else:
+                self._pending[key] = (value, time.monotonic(), 0)
+                self.counters['queued'] += 1
+                EDITS.labels('queued').inc()
+            return len(self._pending)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='fleet-writeback', daemon=True)
+            self._thread.start()
+            logger.info(f"Write-back queue started (interval {self.interval}s)")
+        # Les éditions en attente partent aussi quand le worker s'arrête
+        atexit.register(self.stop)
+
+    def stop(self, timeout=None):
+        """Stop the thread and write the pending edits, waiting up to ``timeout`` seconds for that last flush"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+        else:
+            self.flush()
+        left = self.pending()
+        if left:
+            logger.warning(f"{left} edits still pending when the write-back queue stopped")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """Write every pending edit in one call; returns how many were written"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, {}
+
+            started = time.perf_counter()
+            try:
+                rejected = self.write({key: value for key, (value, _, _) in batch.items()}) or {}
+            except Exception as e:
+                self.counters['failed_flushes'] += 1
+                self.last_error = str(e)
+                logger.error(f"Error writing {len(batch)} edits to the sheet: {str(e)}")
+                logger.error(traceback.format_exc())
+                dropped = self._requeue(batch, str(e))
+                self._report(dropped)
+                return 0
+            finally:
+                self.last_flush_seconds = round(time.perf_counter() - started, 4)
+                FLUSH_SECONDS.observe(self.last_flush_seconds)
+
+            self.counters['flushes'] += 1
+            self.last_error = None
+            now = time.monotonic()
+            written = 0
+            for key, (value, queued_at, _) in batch.items():
+                if key in rejected:
+                    continue
+                written += 1
+                EDIT_LATENCY.observe(now - queued_at)
+            self.counters['written'] += written
+            self.counters['rejected'] += len(rejected)
+            EDITS.labels('written').inc(written)
+            EDITS.labels('rejected').inc(len(rejected))
+            if rejected:
+                logger.warning(f"{len(rejected)} edits rejected by the sheet: {rejected}")
+            self._report({key: (batch[key][0], reason) for key, reason in rejected.items() if key in batch})
+            logger.debug("Wrote %d edits in %.3fs", written, self.last_flush_seconds)
+            return written
+
+    def _requeue(self, batch, reason):
+        """Put a failed batch back, except edits superseded meanwhile or out of attempts; returns the dropped ones"""
+        dropped = {}
+        with self._lock:
+            for key, (value, queued_at, attempts) in batch.items():
+                if key in self._pending:
+                    continue
+                if attempts + 1 >= self.max_attempts:
+                    dropped[key] = (value, reason)
+                    continue
+                self._pending[key] = (value, queued_at, attempts + 1)
+        if dropped:
+            self.counters['dropped'] += len(dropped)
+            EDITS.labels('dropped').inc(len(dropped))
+            logger.error(f"Dropping {len(dropped)} edits after {self.max_attempts} failed writes")
+        return dropped
+
+    def _report(self, failed):
+        if not failed or self.on_failure is None:
+            return
+        try:
+            self.on_failure(failed)
+        except Exception as e:
+            logger.error(f"Error in write-back failure handler: {str(e)}")
+            logger.error(traceback.format_exc())
+
+    def status(self):
+        status = {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'interval': self.interval,
+            'pending': self.pending(),
+            'last_flush_seconds': self.last_flush_seconds,
+            'last_error': self.last_error
+        }
+        status.update(self.counters)
+        return status
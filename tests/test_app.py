@@ -0,0 +1,45 @@
+"""create_app(): settings passed as config, and apps that keep their services apart."""
+from benchmarks import synthetic
+from src.app import create_app
+from src.sources import save_recording
+
+
+def make_app(directory, vehicle_rows):
+    path = str(directory / 'fleet.json')
+    save_recording(path, synthetic.recording(vehicle_rows))
+    # Tout passe par config, rien par os.environ
+    return create_app({
+        'CONFIGURE_LOGGING': False,
+        'SYNC_ENABLED': False,
+        'SHEET_SOURCE': 'local',
+        'SHEET_SOURCE_PATH': path,
+        'UPSTREAM_RATE_FILE': '',
+        'UPSTREAM_RATE_PER_MINUTE': 60000,
+        'SNAPSHOT_STORE': '',
+        'HISTORY_STORE': '',
+        'METRICS_DIR': ''
+    })
+
+
+def test_two_apps_serve_their_own_sheets(tmp_path):
+    (tmp_path / 'small').mkdir()
+    (tmp_path / 'large').mkdir()
+    small = make_app(tmp_path / 'small', 10)
+    large = make_app(tmp_path / 'large', 30)
+    assert small.extensions['fleet'] is not large.extensions['fleet']
+
+    counts = []
+    for app in (small, large):
+        vehicles = app.test_client().get('/api/vehicles').get_json()
+        counts.append(len(vehicles['categories']['flotte']))
+    assert counts == [10, 30]
+    assert small.extensions['fleet'].sync_worker.current is None
+    assert large.extensions['fleet'].sync_worker.current is None
+
+
+def test_sheet_source_comes_from_config(tmp_path):
+    app = make_app(tmp_path, 10)
+    services = app.extensions['fleet']
+    services.sync_worker.refresh(force=True)
+    assert services.sync_worker.current.payloads['vehicles']['stats']
+    assert services.sheet_source.source.path == str(tmp_path / 'fleet.json')
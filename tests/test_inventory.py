@@ -0,0 +1,52 @@
+"""IncrementalInventory against full parses, on synthetic sheets edited at random."""
+import pytest
+
+from benchmarks import synthetic
+from src.inventory import IncrementalInventory, InventoryMismatch
+from src.parsers import parse_vehicle_inventory
+
+
+@pytest.mark.parametrize('agency', [None, 'paris'])
+def test_random_edits_match_full_parses(agency):
+    values = synthetic.vehicle_sheet(300)
+    inventory = IncrementalInventory(agency=agency, check=True)
+    inventory.update(values)
+    # check=True compare chaque mise à jour à un parsing complet et lève InventoryMismatch
+    for sheet in synthetic.edited_sheets(values, 200):
+        inventory.update(sheet)
+
+
+def test_unchanged_rows_keep_their_records():
+    values = synthetic.vehicle_sheet(100)
+    inventory = IncrementalInventory()
+    before, _ = inventory.update(values)
+    after, _ = inventory.update(synthetic.edit_sheet(values, 0))
+    assert inventory.last_changed_rows == 0
+    assert all(after[name] is before[name] for name in before)
+
+
+def test_agency_is_set_on_every_vehicle():
+    inventory = IncrementalInventory(agency='lyon')
+    categories, _ = inventory.update(synthetic.vehicle_sheet(50))
+    assert {vehicle.agency for vehicles in categories.values() for vehicle in vehicles} == {'lyon'}
+
+
+def test_sorted_views_follow_a_full_sort():
+    values = synthetic.vehicle_sheet(200)
+    inventory = IncrementalInventory()
+    inventory.update(values)
+    categories, _ = inventory.update(synthetic.edit_sheet(values, 20, seed=7))
+    views = inventory.sorted_views(categories)
+    for name, vehicles in categories.items():
+        assert views[name] == sorted(vehicles, key=lambda vehicle: vehicle.type)
+    assert inventory.sorted_views(dict(categories)) is None
+
+
+def test_verify_detects_a_wrong_count():
+    values = synthetic.vehicle_sheet(50)
+    inventory = IncrementalInventory()
+    categories, stats = inventory.update(values)
+    stats = dict(stats, total=stats['total'] + 1)
+    with pytest.raises(InventoryMismatch):
+        inventory.verify(values, categories, stats)
+    assert parse_vehicle_inventory(values) == inventory.update(values)
@@ -0,0 +1,105 @@
+"""Change detection of SnapshotSyncWorker: the revision check and SYNC_MAX_AGE."""
+import json
+import os
+
+from src.snapshot import SnapshotSyncWorker
+from src.sources import LocalSheetSource, save_recording
+
+RANGE = "'VÉHICULE'!A1:Z1000"
+
+
+def serialize(payload):
+    return json.dumps(payload).encode('utf-8')
+
+
+class SheetStub:
+    """A spreadsheet whose values can change without a new revision, like TODAY() formulas"""
+
+    def __init__(self, rows, revision='1'):
+        self.rows = rows
+        self.current_revision = revision
+        self.reads = 0
+
+    def fetch_values(self):
+        self.reads += 1
+        return {'vehicles': [list(row) for row in self.rows]}
+
+    def revision(self):
+        return self.current_revision
+
+
+def make_worker(sheet, max_age=None):
+    builders = {'vehicles': ('vehicles', lambda rows: {'rows': rows})}
+    return SnapshotSyncWorker(
+        sheet.fetch_values, builders, serialize, check_revision=sheet.revision, max_age=max_age
+    )
+
+
+def test_unchanged_revision_skips_the_read():
+    sheet = SheetStub([['Auris', 'AA000AA', 'MC']])
+    worker = make_worker(sheet, max_age=3600)
+    first = worker.refresh()
+    assert worker.refresh() is first
+    assert sheet.reads == 1
+    assert worker.counters['unchanged_revision'] == 1
+
+
+def test_new_revision_reads_and_publishes():
+    sheet = SheetStub([['Auris', 'AA000AA', 'MC']])
+    worker = make_worker(sheet, max_age=3600)
+    worker.refresh()
+    sheet.rows = [['Auris', 'AA000AA', 'FC']]
+    sheet.current_revision = '2'
+    snapshot = worker.refresh()
+    assert sheet.reads == 2
+    assert snapshot.version == 2
+    assert snapshot.payloads['vehicles'] == {'rows': [['Auris', 'AA000AA', 'FC']]}
+
+
+def test_max_age_forces_a_read_under_the_same_revision():
+    sheet = SheetStub([['Auris', 'AA000AA', '2026-10-17']])
+    worker = make_worker(sheet, max_age=0)
+    worker.refresh()
+    # Valeur recalculée par une formule : la révision ne bouge pas
+    sheet.rows = [['Auris', 'AA000AA', '2026-10-18']]
+    snapshot = worker.refresh()
+    assert sheet.reads == 2
+    assert worker.counters['expired'] == 1
+    assert snapshot.version == 2
+    assert snapshot.payloads['vehicles'] == {'rows': [['Auris', 'AA000AA', '2026-10-18']]}
+
+
+def test_expired_read_without_changes_keeps_the_version():
+    sheet = SheetStub([['Auris', 'AA000AA', 'MC']])
+    worker = make_worker(sheet, max_age=0)
+    first = worker.refresh()
+    snapshot = worker.refresh()
+    assert sheet.reads == 2
+    assert snapshot.version == first.version
+    assert snapshot.bodies['vehicles'] is first.bodies['vehicles']
+
+
+def test_local_source_revision_follows_the_recording(tmp_path):
+    path = str(tmp_path / 'fleet.json')
+    save_recording(path, {RANGE: {'FORMATTED_VALUE': [['Type', 'Immat', 'Statut'], ['Auris', 'AA000AA', 'MC']]}})
+    source = LocalSheetSource(path)
+    reads = []
+
+    def fetch_values():
+        reads.append(1)
+        return {'vehicles': source.get(RANGE, 'FORMATTED_VALUE')}
+
+    worker = SnapshotSyncWorker(
+        fetch_values, {'vehicles': ('vehicles', lambda rows: {'rows': rows})}, serialize,
+        check_revision=source.revision, max_age=3600
+    )
+    worker.refresh()
+    worker.refresh()
+    assert len(reads) == 1
+
+    save_recording(path, {RANGE: {'FORMATTED_VALUE': [['Type', 'Immat', 'Statut'], ['Auris', 'AA000AA', 'FC']]}})
+    mtime = os.path.getmtime(path) + 10
+    os.utime(path, (mtime, mtime))
+    snapshot = worker.refresh()
+    assert len(reads) == 2
+    assert snapshot.payloads['vehicles']['rows'][1][2] == 'FC'
@@ -0,0 +1,264 @@
+"""Status edits written back to the sheet: the queue, the row lookup, the stored patch and the PATCH route."""
+import json
+
+import pytest
+
+from benchmarks import synthetic
+from src.app import create_app
+from src.snapshot import SnapshotSyncWorker
+from src.sources import SheetSource, save_recording
+from src.store import SnapshotStore
+from src.writeback import WriteBackQueue
+
+VEHICLE_RANGE = "'VÉHICULE'!A1:Z1000"
+TOKEN = {'Authorization': 'Bearer t0k3n'}
+# Première ligne de données de synthetic.vehicle_sheet : flotte en B/C, Disponible FS en N (sans colonne de statut)
+PLATE = 'AA000AAF'
+EMBEDDED_PLATE = 'AA000AAD'
+
+
+def test_edits_of_a_cell_are_coalesced():
+    batches = []
+    queue = WriteBackQueue(lambda edits: batches.append(edits))
+    queue.enqueue('A', 'MC')
+    queue.enqueue('A', 'FC')
+    queue.enqueue('B', 'MC')
+    assert queue.flush() == 2
+    assert batches == [{'A': 'FC', 'B': 'MC'}]
+    assert queue.counters['coalesced'] == 1
+    assert queue.pending() == 0
+
+
+def test_failed_flush_requeues_then_drops():
+    failures = []
+
+    def write(edits):
+        raise IOError('quota exceeded')
+
+    queue = WriteBackQueue(write, max_attempts=2, on_failure=failures.append)
+    queue.enqueue('A', 'MC')
+    assert queue.flush() == 0
+    assert queue.pending() == 1
+    assert failures == []
+    queue.flush()
+    assert queue.pending() == 0
+    assert queue.counters['dropped'] == 1
+    assert failures == [{'A': ('MC', 'quota exceeded')}]
+
+
+def test_failed_flush_keeps_the_newer_edit():
+    def write(edits):
+        # Édition de la même cellule pendant l'écriture qui échoue
+        queue.enqueue('A', 'FC')
+        raise IOError('timeout')
+
+    queue = WriteBackQueue(write)
+    queue.enqueue('A', 'MC')
+    queue.flush()
+    assert queue._pending['A'][0] == 'FC'
+
+
+def test_rejected_edits_are_reported_not_retried():
+    failures = []
+    queue = WriteBackQueue(lambda edits: {'B': 'not in the sheet'}, on_failure=failures.append)
+    queue.enqueue('A', 'MC')
+    queue.enqueue('B', 'FC')
+    assert queue.flush() == 1
+    assert queue.pending() == 0
+    assert failures == [{'B': ('FC', 'not in the sheet')}]
+
+
+def make_store_worker(path):
+    builders = {'fleet': ('fleet', lambda rows: {'count': 0})}
+    return SnapshotSyncWorker(
+        lambda: {'fleet': [['x']]}, builders, lambda payload: json.dumps(payload).encode('utf-8'),
+        store=SnapshotStore(path)
+    )
+
+
+def increment(snapshot):
+    return {'fleet': {'count': snapshot.payloads['fleet']['count'] + 1}}
+
+
+def test_patches_from_two_workers_stack_up_in_the_store(tmp_path):
+    path = str(tmp_path / 'snapshot.db')
+    first, second = make_store_worker(path), make_store_worker(path)
+    first.refresh()
+    second.refresh()
+    assert first.patch(increment).version == 2
+    # second n'a pas vu la v2 : le patch part de ce que contient le store
+    snapshot = second.patch(increment)
+    assert snapshot.version == 3
+    assert snapshot.payloads['fleet'] == {'count': 2}
+
+
+def test_patch_returns_none_when_the_store_fails(tmp_path):
+    worker = make_store_worker(str(tmp_path / 'snapshot.db'))
+    previous = worker.refresh()
+
+    def update(build, known_versions=None):
+        raise OSError('disk full')
+
+    worker.store.update = update
+    assert worker.patch(increment) is None
+    assert worker.current is previous
+
+
+@pytest.fixture
+def fleet(tmp_path):
+    path = str(tmp_path / 'fleet.json')
+    save_recording(path, synthetic.recording(20))
+    app = create_app({
+        'CONFIGURE_LOGGING': False,
+        'SYNC_ENABLED': False,
+        'SHEET_SOURCE': 'local',
+        'SHEET_SOURCE_PATH': path,
+        # Seau en mémoire : pas celui partagé par les workers dans /tmp
+        'UPSTREAM_RATE_FILE': '',
+        'UPSTREAM_RATE_PER_MINUTE': 60000,
+        'SNAPSHOT_STORE': str(tmp_path / 'snapshot.db'),
+        'HISTORY_STORE': '',
+        'METRICS_DIR': '',
+        'EDIT_TOKENS': 'ops=t0k3n',
+        'WRITEBACK_INTERVAL': 3600
+    })
+    services = app.extensions['fleet']
+    services.sync_worker.refresh(force=True)
+    yield app, services, path
+    services.writeback_queue.stop()
+
+
+def recorded_rows(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)['ranges'][VEHICLE_RANGE]['FORMATTED_VALUE']
+
+
+def test_write_finds_the_row_on_a_fresh_read(fleet):
+    _, services, path = fleet
+    recording = synthetic.recording(20)
+    rows = recording[VEHICLE_RANGE]['FORMATTED_VALUE']
+    # Une ligne insérée en tête depuis la dernière synchro : le véhicule est maintenant en ligne 2
+    rows.insert(1, ['Kona', 'ZZ999ZZF', 'MC'])
+    save_recording(path, recording)
+
+    # Appelé par le thread d'écriture, hors de tout contexte Flask
+    rejected = services.write_vehicle_statuses({
+        (None, 'flotte', PLATE): 'ATELIER',
+        (None, 'flotte', 'BA001AAF'): 'FC',
+        (None, 'flotte', 'ZZ000ZZF'): 'ATELIER'
+    })
+    rows = recorded_rows(path)
+    assert rows[2][1:3] == [PLATE, 'ATELIER']
+    assert rows[3][1:3] == ['BA001AAF', 'FC']
+    assert rows[1][2] == 'MC'
+    assert rejected == {(None, 'flotte', 'ZZ000ZZF'): 'not in the sheet'}
+
+
+def test_write_rejects_a_plate_on_several_rows(fleet):
+    _, services, path = fleet
+    recording = synthetic.recording(20)
+    recording[VEHICLE_RANGE]['FORMATTED_VALUE'].append(['Kona', PLATE, 'MC'])
+    save_recording(path, recording)
+
+    rejected = services.write_vehicle_statuses({(None, 'flotte', PLATE): 'ATELIER'})
+    assert rejected == {(None, 'flotte', PLATE): 'on several rows'}
+
+
+def test_patch_route_queues_the_edit(fleet):
+    app, services, path = fleet
+    client = app.test_client()
+    response = client.patch(f'/api/vehicles/{PLATE.lower()}', headers=TOKEN, json={'status': 'ATELIER'})
+    assert response.status_code == 202
+    assert response.get_json()['status'] == 'ATELIER'
+    assert response.headers['X-Data-Version'] == str(services.sync_worker.current.version)
+    vehicles = client.get('/api/vehicles').get_json()['categories']['flotte']
+    assert [vehicle['status'] for vehicle in vehicles if vehicle['immatriculation'] == PLATE] == ['ATELIER']
+
+    assert services.writeback_queue.flush() == 1
+    assert recorded_rows(path)[1][1:3] == [PLATE, 'ATELIER']
+
+
+@pytest.mark.parametrize('body', [
+    None,
+    {},
+    {'status': 42},
+    {'status': '=HYPERLINK("x")'},
+    {'status': 'x' * 41},
+    {'status': 'MC', 'category': 1},
+    {'status': 'MC', 'agency': ['paris']}
+])
+def test_patch_route_rejects_bad_bodies(fleet, body):
+    app, services, _ = fleet
+    response = app.test_client().patch(f'/api/vehicles/{PLATE}', headers=TOKEN, json=body)
+    assert response.status_code == 400
+    assert services.writeback_queue.pending() == 0
+
+
+def test_patch_route_unknown_plate_is_404(fleet):
+    app, services, _ = fleet
+    response = app.test_client().patch('/api/vehicles/ZZ000ZZF', headers=TOKEN, json={'status': 'MC'})
+    assert response.status_code == 404
+
+
+def test_patch_route_vehicle_without_status_cell_is_409(fleet):
+    app, services, _ = fleet
+    response = app.test_client().patch(f'/api/vehicles/{EMBEDDED_PLATE}', headers=TOKEN, json={'status': 'MC'})
+    assert response.status_code == 409
+    assert services.writeback_queue.pending() == 0
+
+
+def test_patch_route_needs_a_token(fleet):
+    app, services, _ = fleet
+    response = app.test_client().patch(f'/api/vehicles/{PLATE}', json={'status': 'MC'})
+    assert response.status_code == 401
+
+
+def test_patch_route_store_failure_is_503_and_queues_nothing(fleet):
+    app, services, _ = fleet
+
+    def update(build, known_versions=None):
+        raise OSError('disk full')
+
+    services.sync_worker.store.update = update
+    response = app.test_client().patch(f'/api/vehicles/{PLATE}', headers=TOKEN, json={'status': 'ATELIER'})
+    assert response.status_code == 503
+    assert services.writeback_queue.pending() == 0
+
+
+def test_a_source_without_write_cells_cannot_be_created():
+    class ReadOnlySource(SheetSource):
+        def batch_get(self, ranges):
+            return [[] for _ in ranges]
+
+    with pytest.raises(TypeError):
+        ReadOnlySource()
+
+
+def test_federated_edit_goes_to_its_agency_spreadsheet(tmp_path):
+    for spreadsheet_id in ('p1', 'l1'):
+        save_recording(str(tmp_path / f'{spreadsheet_id}.json'), synthetic.recording(20))
+    app = create_app({
+        'CONFIGURE_LOGGING': False,
+        'SYNC_ENABLED': False,
+        'SPREADSHEET_IDS': 'paris=p1,lyon=l1',
+        'SHEET_SOURCE': 'local',
+        'SHEET_SOURCE_PATH': str(tmp_path / '{spreadsheet_id}.json'),
+        'UPSTREAM_RATE_FILE': '',
+        'UPSTREAM_RATE_PER_MINUTE': 60000,
+        'SNAPSHOT_STORE': '',
+        'HISTORY_STORE': '',
+        'METRICS_DIR': '',
+        'EDIT_TOKENS': 'ops=t0k3n',
+        'WRITEBACK_INTERVAL': 3600
+    })
+    services = app.extensions['fleet']
+    services.sync_worker.refresh(force=True)
+    client = app.test_client()
+    # La plaque est dans les deux classeurs : sans agence, la modification est ambiguë
+    assert client.patch(f'/api/vehicles/{PLATE}', headers=TOKEN, json={'status': 'ATELIER'}).status_code == 409
+    response = client.patch(f'/api/vehicles/{PLATE}', headers=TOKEN, json={'status': 'ATELIER', 'agency': 'lyon'})
+    assert response.status_code == 202
+
+    assert services.writeback_queue.flush() == 1
+    assert recorded_rows(str(tmp_path / 'l1.json'))[1][1:3] == [PLATE, 'ATELIER']
+    assert recorded_rows(str(tmp_path / 'p1.json'))[1][2] != 'ATELIER'